@@ -0,0 +1,27 @@
+"""Add the candidate_dhash column to the Candidates table
+
+Revision ID: 2a7c9e4d1b36
+Revises: 6d1e3f7a2b84
+Create Date: 2016-10-21 09:32:41.203715
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2a7c9e4d1b36'
+down_revision = '6d1e3f7a2b84'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    ''' Add the candidate_dhash column to the Candidates table '''
+    op.add_column(
+        'Candidates',
+        sa.Column('candidate_dhash', sa.String(16), nullable=True)
+    )
+
+
+def downgrade():
+    ''' Drop the candidate_dhash column of the Candidates table '''
+    op.drop_column('Candidates', 'candidate_dhash')
@@ -0,0 +1,42 @@
+"""Add the Covotes table
+
+Revision ID: 4b5c2d8e9f10
+Revises: 1f1fac3fa4f5
+Create Date: 2016-10-19 10:12:45.382214
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b5c2d8e9f10'
+down_revision = '1f1fac3fa4f5'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    ''' Add the Covotes table '''
+    op.create_table(
+        'Covotes',
+        sa.Column(
+            'election_id', sa.Integer,
+            sa.ForeignKey('Elections.id', ondelete='CASCADE',
+                          onupdate='CASCADE'),
+            nullable=False, index=True),
+        sa.Column(
+            'candidate_id', sa.Integer,
+            sa.ForeignKey('Candidates.id', ondelete='CASCADE',
+                          onupdate='CASCADE'),
+            nullable=False, primary_key=True),
+        sa.Column(
+            'other_candidate_id', sa.Integer,
+            sa.ForeignKey('Candidates.id', ondelete='CASCADE',
+                          onupdate='CASCADE'),
+            nullable=False, primary_key=True),
+        sa.Column('count', sa.Integer, nullable=False),
+    )
+
+
+def downgrade():
+    ''' Drop the Covotes table '''
+    op.drop_table('Covotes')
@@ -0,0 +1,41 @@
+"""Add the columns describing the picture of the candidates
+
+Revision ID: 5e8b1c3f9a27
+Revises: 2a7c9e4d1b36
+Create Date: 2016-10-21 16:48:03.570922
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e8b1c3f9a27'
+down_revision = '2a7c9e4d1b36'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+COLUMNS = [
+    ('picture_width', sa.Integer),
+    ('picture_height', sa.Integer),
+    ('picture_format', sa.String(10)),
+    ('picture_mode', sa.String(10)),
+    ('picture_size', sa.Integer),
+    ('picture_sha256', sa.String(64)),
+]
+
+
+def upgrade():
+    ''' Add the columns describing the picture of the candidates to the
+    Candidates table '''
+    for name, column_type in COLUMNS:
+        op.add_column(
+            'Candidates',
+            sa.Column(name, column_type, nullable=True)
+        )
+
+
+def downgrade():
+    ''' Drop the columns describing the picture of the candidates from the
+    Candidates table '''
+    for name, _ in COLUMNS:
+        op.drop_column('Candidates', name)
@@ -0,0 +1,52 @@
+"""Add the Jobs and JobFiles tables
+
+Revision ID: 6d1e3f7a2b84
+Revises: 4b5c2d8e9f10
+Create Date: 2016-10-20 14:05:12.817463
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6d1e3f7a2b84'
+down_revision = '4b5c2d8e9f10'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    ''' Add the Jobs and JobFiles tables '''
+    op.create_table(
+        'Jobs',
+        sa.Column('id', sa.Integer, nullable=False, primary_key=True),
+        sa.Column('job_type', sa.String(50), nullable=False),
+        sa.Column(
+            'election_id', sa.Integer,
+            sa.ForeignKey('Elections.id', ondelete='CASCADE',
+                          onupdate='CASCADE'),
+            nullable=True),
+        sa.Column('user_name', sa.String(50), nullable=False),
+        sa.Column('status', sa.String(20), nullable=False, index=True),
+        sa.Column('message', sa.Text, nullable=True),
+        sa.Column('date_created', sa.DateTime, nullable=False),
+        sa.Column('date_started', sa.DateTime, nullable=True),
+        sa.Column('date_finished', sa.DateTime, nullable=True),
+    )
+    op.create_table(
+        'JobFiles',
+        sa.Column('id', sa.Integer, nullable=False, primary_key=True),
+        sa.Column(
+            'job_id', sa.Integer,
+            sa.ForeignKey('Jobs.id', ondelete='CASCADE',
+                          onupdate='CASCADE'),
+            nullable=False, index=True),
+        sa.Column('filename', sa.String(255), nullable=False),
+        sa.Column('status', sa.String(20), nullable=False),
+        sa.Column('message', sa.Text, nullable=True),
+    )
+
+
+def downgrade():
+    ''' Drop the Jobs and JobFiles tables '''
+    op.drop_table('JobFiles')
+    op.drop_table('Jobs')
@@ -0,0 +1,27 @@
+"""Add the candidate_placeholder column to the Candidates table
+
+Revision ID: 7c4f2a9d8e13
+Revises: 5e8b1c3f9a27
+Create Date: 2016-10-24 11:20:37.441029
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c4f2a9d8e13'
+down_revision = '5e8b1c3f9a27'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    ''' Add the candidate_placeholder column to the Candidates table '''
+    op.add_column(
+        'Candidates',
+        sa.Column('candidate_placeholder', sa.Text, nullable=True)
+    )
+
+
+def downgrade():
+    ''' Drop the candidate_placeholder column of the Candidates table '''
+    op.drop_column('Candidates', 'candidate_placeholder')
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+'''
+Benchmark the backend library of nuancier on a synthetic election.
+
+The election generated holds, by default, 10 000 candidates and 1 000 000
+votes. The benchmark runs on SQLite and, when one is reachable, on a
+PostgreSQL database. The results are saved as JSON so that they can be
+compared between two commits.
+
+Usage::
+
+    python benchmarks/bench_lib.py --output before.json
+    <change things>
+    python benchmarks/bench_lib.py --output after.json --compare before.json
+
+.. warning:: The PostgreSQL database used is emptied.
+'''
+
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import nuancier.lib as nuancierlib
+from nuancier.lib import model
+
+
+TODAY = datetime.datetime.utcnow().date()
+BATCH = 10000
+DEFAULT_PG_URL = 'postgresql://localhost/nuancier_bench'
+
+
+def populate(session, n_candidates, n_votes, n_choice, seed=42,
+             election_open=False):
+    ''' Fill the database with a closed election, or an election open for
+    votes if ``election_open`` is True, holding the given number of
+    candidates and votes, and two small elections around it.
+
+    Return the identifier of the large election and the names of some of
+    its voters.
+    '''
+    rng = random.Random(seed)
+    elections = []
+    for idx, days in enumerate([30, 10, -5]):
+        election = model.Elections(
+            election_name='Benchmark %s' % idx,
+            election_folder='bench%s' % idx,
+            election_year=2016,
+            election_n_choice=n_choice,
+            submission_date_start=TODAY - datetime.timedelta(days=days + 10),
+            election_date_start=TODAY - datetime.timedelta(days=days + 5),
+            election_date_end=TODAY - datetime.timedelta(days=days),
+        )
+        session.add(election)
+        elections.append(election)
+    session.flush()
+    election_id = elections[2 if election_open else 1].id
+
+    candidates = []
+    for election in elections:
+        count = n_candidates if election.id == election_id else 50
+        rows = [dict(
+            candidate_file='wallpaper-%s.png' % idx,
+            candidate_name='Wallpaper %s' % idx,
+            candidate_author='author%s' % (idx % 500),
+            candidate_license='CC-BY-SA',
+            candidate_submitter='submitter%s' % (idx % 500),
+            submitter_email='submitter%s@example.org' % (idx % 500),
+            election_id=election.id,
+            approved=True,
+        ) for idx in range(count)]
+        for start in range(0, len(rows), BATCH):
+            session.execute(
+                model.Candidates.__table__.insert(),
+                rows[start:start + BATCH])
+        if election.id == election_id:
+            candidates = [
+                row.id for row in session.query(model.Candidates.id).filter(
+                    model.Candidates.election_id == election_id)]
+    session.commit()
+
+    # Each voter picks n_choice different candidates, the first candidates
+    # being more popular than the last ones.
+    voters = []
+    rows = []
+    n_voters = 0
+    while n_votes > 0:
+        user = 'voter%s' % n_voters
+        n_voters += 1
+        choices = set()
+        while len(choices) < min(n_choice, n_votes, len(candidates)):
+            choices.add(candidates[int(len(candidates) * rng.random() ** 2)])
+        value = 2 if n_voters % 10 == 0 else 1
+        rows.extend(
+            dict(user_name=user, candidate_id=cand, value=value)
+            for cand in choices)
+        n_votes -= len(choices)
+        if len(voters) < 100 and rng.random() < 0.01:
+            voters.append(user)
+        if len(rows) >= BATCH:
+            session.execute(model.Votes.__table__.insert(), rows)
+            rows = []
+    if rows:
+        session.execute(model.Votes.__table__.insert(), rows)
+    session.commit()
+
+    return election_id, voters or ['voter0']
+
+
+def timeit(func, repeat):
+    ''' Run the function the given number of times and return its
+    durations, in seconds, sorted.
+    '''
+    durations = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        durations.append(time.time() - start)
+    return sorted(durations)
+
+
+def run_benchmarks(session, election_id, voters, repeat):
+    ''' Time the library functions and return their durations. '''
+    def get_votes_user():
+        ''' Retrieve the votes of several voters. '''
+        for user in voters:
+            nuancierlib.get_votes_user(session, election_id, user)
+
+    counter = [0]
+
+    def add_vote():
+        ''' Cast a ballot of 16 votes. '''
+        counter[0] += 1
+        user = 'bench-voter%s' % counter[0]
+        candidates = session.query(model.Candidates.id).filter(
+            model.Candidates.election_id == election_id).limit(16)
+        for candidate in candidates:
+            nuancierlib.add_vote(session, candidate.id, user)
+        session.commit()
+
+    benchmarks = [
+        ('get_results', lambda: nuancierlib.get_results(
+            session, election_id)),
+        ('get_stats', lambda: nuancierlib.get_stats(session, election_id)),
+        ('get_votes_user (x%s)' % len(voters), get_votes_user),
+        ('Votes.cnt_voters', lambda: model.Votes.cnt_voters(
+            session, election_id)),
+        ('Candidates.by_election', lambda: model.Candidates.by_election(
+            session, election_id, approved=True)),
+        ('add_vote (x16)', add_vote),
+    ]
+
+    results = {}
+    for name, func in benchmarks:
+        durations = timeit(func, repeat)
+        session.rollback()
+        session.expunge_all()
+        results[name] = dict(
+            min=durations[0],
+            median=durations[len(durations) // 2],
+            max=durations[-1],
+        )
+        print '  %-28s min %9.4fs  median %9.4fs' % (
+            name, durations[0], durations[len(durations) // 2])
+    return results
+
+
+def run_backend(name, db_url, args):
+    ''' Populate the given database and benchmark it. '''
+    print '%s: %s' % (name, db_url)
+    session = model.create_tables(db_url)
+    if session.bind.driver != 'pysqlite':
+        session.remove()
+        model.BASE.metadata.drop_all(session.bind)
+        session = model.create_tables(db_url)
+
+    start = time.time()
+    election_id, voters = populate(
+        session, args.candidates, args.votes, args.choices)
+    print '  populated in %.1fs' % (time.time() - start)
+
+    results = run_benchmarks(session, election_id, voters, args.repeat)
+    session.remove()
+    return results
+
+
+def git_revision():
+    ''' Return the git commit the benchmark runs on, if any. '''
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=HERE).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, reference, threshold):
+    ''' Print the evolution of the median durations compared to the
+    reference results and return whether some got slower than the
+    threshold allows.
+    '''
+    regression = False
+    print 'Compared to %s:' % (reference.get('revision') or 'reference')
+    for backend in sorted(results['backends']):
+        old_backend = reference['backends'].get(backend, {})
+        for name in sorted(results['backends'][backend]):
+            if name not in old_backend:
+                continue
+            new = results['backends'][backend][name]['median']
+            old = old_backend[name]['median']
+            ratio = new / old if old else 1.0
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  <-- REGRESSION'
+                regression = True
+            print '  %-10s %-28s %9.4fs -> %9.4fs (x%.2f)%s' % (
+                backend, name, old, new, ratio, flag)
+    return regression
+
+
+def main():
+    ''' Run the benchmarks and save the results. '''
+    parser = argparse.ArgumentParser(
+        description='Benchmark the backend library of nuancier')
+    parser.add_argument(
+        '--candidates', type=int, default=10000,
+        help='Number of candidates in the election.')
+    parser.add_argument(
+        '--votes', type=int, default=1000000,
+        help='Number of votes in the election.')
+    parser.add_argument(
+        '--choices', type=int, default=16,
+        help='Number of votes per voter.')
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='Number of times each benchmark is run.')
+    parser.add_argument(
+        '--pg-url', default=os.environ.get(
+            'NUANCIER_BENCH_PG_URL', DEFAULT_PG_URL),
+        help='URL of the PostgreSQL database to use, it will be emptied.')
+    parser.add_argument(
+        '--no-pg', action='store_true', default=False,
+        help='Only run the benchmark on SQLite.')
+    parser.add_argument(
+        '--output', default='bench_lib.json',
+        help='File in which to save the results.')
+    parser.add_argument(
+        '--compare',
+        help='Results of a previous run to compare these results to.')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='Slow down, as a fraction, above which a benchmark is '
+        'reported as a regression.')
+    args = parser.parse_args()
+
+    results = dict(
+        revision=git_revision(),
+        date=datetime.datetime.utcnow().isoformat(),
+        candidates=args.candidates,
+        votes=args.votes,
+        choices=args.choices,
+        backends={},
+    )
+
+    folder = tempfile.mkdtemp(prefix='nuancier-bench-')
+    try:
+        results['backends']['sqlite'] = run_backend(
+            'sqlite', 'sqlite:///%s' % os.path.join(folder, 'bench.sqlite'),
+            args)
+    finally:
+        shutil.rmtree(folder)
+
+    if not args.no_pg:
+        try:
+            import sqlalchemy
+            sqlalchemy.create_engine(args.pg_url).connect().close()
+        except Exception as err:
+            print 'PostgreSQL not available (%s), skipping it' % err
+        else:
+            results['backends']['postgresql'] = run_backend(
+                'postgresql', args.pg_url, args)
+
+    with open(args.output, 'w') as stream:
+        json.dump(results, stream, indent=2, sort_keys=True)
+    print 'Results saved in %s' % args.output
+
+    if args.compare:
+        with open(args.compare) as stream:
+            reference = json.load(stream)
+        if compare(results, reference, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
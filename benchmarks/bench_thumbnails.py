@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+'''
+Benchmark the generation of the thumbnails of nuancier.
+
+Synthetic wallpapers, from the minimal size accepted by nuancier
+(1600x1200) up to 8K, are generated as JPEG and PNG in a temporary
+picture folder. For each of them and each thumbnail size the script
+measures, in a fresh process, the time spent decoding, resampling and
+encoding the picture, the peak memory used and the size of the thumbnail
+produced, as well as the time ``nuancier.lib.generate_thumbnail`` takes
+end to end.
+
+It then measures how many thumbnails per second are generated when the
+work is spread over several worker processes.
+
+Usage::
+
+    python benchmarks/bench_thumbnails.py --output thumbnails.json
+'''
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from PIL import Image
+
+import nuancier.lib as nuancierlib
+
+from bench_lib import git_revision
+
+
+RESOLUTIONS = ['1600x1200', '1920x1080', '3840x2160', '7680x4320']
+FORMATS = ['JPEG', 'PNG']
+THUMB_SIZES = ['128x128', '256x256', '512x512']
+WORKERS = [1, 2, 4]
+
+
+def parse_size(value):
+    ''' Return the (width, height) tuple corresponding to a ``WxH``
+    string.
+    '''
+    width, height = value.lower().split('x')
+    return (int(width), int(height))
+
+
+def make_picture(path, size, fmt):
+    ''' Generate a synthetic picture of the given size and format.
+
+    The picture mixes gradients with some noise, so that it compresses
+    about as well as a photograph.
+    '''
+    noise = Image.effect_noise(size, 32)
+    red = Image.blend(
+        Image.linear_gradient('L').resize(size), noise, 0.3)
+    green = Image.radial_gradient('L').resize(size)
+    blue = Image.blend(
+        Image.linear_gradient('L').rotate(90).resize(size), noise, 0.1)
+    image = Image.merge('RGB', (red, green, blue))
+    if fmt == 'JPEG':
+        image.save(path, fmt, quality=90)
+    else:
+        image.save(path, fmt)
+
+
+def peak_memory():
+    ''' Return the peak resident memory of the current process, in kB. '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure_picture(path, cache_folder, size):
+    ''' Measure each step of the generation of the thumbnail of the given
+    picture. Meant to run in its own process, so that the peak memory
+    is the one of this picture only.
+    '''
+    base_memory = peak_memory()
+    outfile = os.path.join(cache_folder, os.path.basename(path))
+
+    start = time.time()
+    image = Image.open(path)
+    image.load()
+    decode = time.time() - start
+
+    start = time.time()
+    image.thumbnail(size, Image.ANTIALIAS)
+    resample = time.time() - start
+
+    start = time.time()
+    image.save(outfile)
+    encode = time.time() - start
+    del image
+
+    start = time.time()
+    nuancierlib.generate_thumbnail(
+        os.path.basename(path), os.path.dirname(path), cache_folder, size)
+    total = time.time() - start
+
+    return dict(
+        decode=decode,
+        resample=resample,
+        encode=encode,
+        generate_thumbnail=total,
+        peak_memory_kb=peak_memory() - base_memory,
+        output_size=os.path.getsize(outfile),
+    )
+
+
+def _thumbnail(args):
+    ''' Generate a single thumbnail, used by the pool of workers. '''
+    filename, picture_folder, cache_folder, size = args
+    nuancierlib.generate_thumbnail(
+        filename, picture_folder, cache_folder, size)
+
+
+def measure_workers(picture_folder, cache_folder, size, workers):
+    ''' Return the time taken to generate the thumbnails of all the
+    pictures of the folder using the given number of processes.
+    '''
+    tasks = [(filename, picture_folder, cache_folder, size)
+             for filename in sorted(os.listdir(picture_folder))]
+    pool = multiprocessing.Pool(workers)
+    try:
+        start = time.time()
+        pool.map(_thumbnail, tasks, chunksize=1)
+        duration = time.time() - start
+    finally:
+        pool.close()
+        pool.join()
+    return dict(
+        pictures=len(tasks),
+        duration=duration,
+        throughput=len(tasks) / duration,
+    )
+
+
+def main():
+    ''' Run the benchmarks and save the results. '''
+    parser = argparse.ArgumentParser(
+        description='Benchmark the thumbnail generation of nuancier')
+    parser.add_argument(
+        '--resolutions', nargs='+', default=RESOLUTIONS,
+        help='Sizes, as WIDTHxHEIGHT, of the pictures to generate.')
+    parser.add_argument(
+        '--formats', nargs='+', default=FORMATS, choices=FORMATS,
+        help='Formats of the pictures to generate.')
+    parser.add_argument(
+        '--thumb-sizes', nargs='+', default=THUMB_SIZES,
+        help='Values of THUMB_SIZE, as WIDTHxHEIGHT, to benchmark.')
+    parser.add_argument(
+        '--workers', nargs='+', type=int, default=WORKERS,
+        help='Numbers of worker processes to benchmark.')
+    parser.add_argument(
+        '--copies', type=int, default=4,
+        help='Number of copies of each picture processed by the workers.')
+    parser.add_argument(
+        '--output', default='bench_thumbnails.json',
+        help='File in which to save the results.')
+    args = parser.parse_args()
+
+    results = dict(
+        revision=git_revision(),
+        date=datetime.datetime.utcnow().isoformat(),
+        pictures=[],
+        workers=[],
+    )
+
+    folder = tempfile.mkdtemp(prefix='nuancier-bench-')
+    picture_folder = os.path.join(folder, 'pictures')
+    cache_folder = os.path.join(folder, 'cache')
+    os.makedirs(picture_folder)
+    os.makedirs(cache_folder)
+    try:
+        for resolution in args.resolutions:
+            for fmt in args.formats:
+                filename = 'wallpaper-%s.%s' % (
+                    resolution, 'jpg' if fmt == 'JPEG' else 'png')
+                path = os.path.join(picture_folder, filename)
+                make_picture(path, parse_size(resolution), fmt)
+                for thumb_size in args.thumb_sizes:
+                    # A new process per picture, for its peak memory.
+                    pool = multiprocessing.Pool(1)
+                    try:
+                        stats = pool.apply(
+                            measure_picture,
+                            (path, cache_folder, parse_size(thumb_size)))
+                    finally:
+                        pool.close()
+                        pool.join()
+                    stats.update(dict(
+                        resolution=resolution,
+                        format=fmt,
+                        thumb_size=thumb_size,
+                        input_size=os.path.getsize(path),
+                    ))
+                    results['pictures'].append(stats)
+                    print '%-10s %-4s -> %-8s decode %7.1fms  resample ' \
+                        '%7.1fms  encode %6.1fms  total %7.1fms  ' \
+                        '%7.1f MB  %6.1f kB' % (
+                            resolution, fmt, thumb_size,
+                            stats['decode'] * 1000,
+                            stats['resample'] * 1000,
+                            stats['encode'] * 1000,
+                            stats['generate_thumbnail'] * 1000,
+                            stats['peak_memory_kb'] / 1024.0,
+                            stats['output_size'] / 1024.0)
+
+        for filename in os.listdir(picture_folder):
+            name, ext = os.path.splitext(filename)
+            for idx in range(1, args.copies):
+                os.link(os.path.join(picture_folder, filename),
+                        os.path.join(picture_folder,
+                                     '%s-%s%s' % (name, idx, ext)))
+        for thumb_size in args.thumb_sizes:
+            for workers in args.workers:
+                stats = measure_workers(
+                    picture_folder, cache_folder, parse_size(thumb_size),
+                    workers)
+                stats.update(dict(thumb_size=thumb_size, workers=workers))
+                results['workers'].append(stats)
+                print '%-8s %2s workers: %3s pictures in %6.2fs ' \
+                    '(%.1f pictures/s)' % (
+                        thumb_size, workers, stats['pictures'],
+                        stats['duration'], stats['throughput'])
+    finally:
+        shutil.rmtree(folder)
+
+    with open(args.output, 'w') as stream:
+        json.dump(results, stream, indent=2, sort_keys=True)
+    print 'Results saved in %s' % args.output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+'''
+Replay the voting flow of many users against the nuancier application.
+
+Each simulated user loads the voting page of an open election
+(``GET /election/<id>/vote/``) and submits a ballot
+(``POST /election/<id>/voted/``). The requests go through the WSGI stack
+of the application, in-process, with fake FAS users, so no web server or
+FAS account is needed.
+
+For each endpoint the script reports the latency percentiles, the
+throughput and the number of SQL queries run per request, as measured
+by :mod:`nuancier.instrumentation`, and saves them as JSON.
+
+Usage::
+
+    python benchmarks/bench_vote.py --users 500 --concurrency 4
+'''
+
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import flask
+
+import nuancier.app
+from nuancier.lib import model
+
+from bench_lib import git_revision, populate
+
+
+CANDIDATE_RE = re.compile(r'id="candidate(\d+)"')
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+_LOCAL = threading.local()
+
+
+class FakeFasUser(object):
+    ''' Fake FAS user, CLA+1, casting votes. '''
+    cla_done = True
+    groups = ['packager', 'cla_done']
+
+    def __init__(self, username):
+        self.username = username
+        self.email = '%s@example.org' % username
+
+
+def set_fas_user(sender, **kwargs):
+    ''' Set the user simulated by the current thread as the user logged
+    in the application.
+    '''
+    flask.g.fas_user = getattr(_LOCAL, 'user', None)
+
+
+def percentile(values, percent):
+    ''' Return the given percentile of the sorted list of values. '''
+    if not values:
+        return None
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+class Recorder(object):
+    ''' Gather the measures of the requests made, per endpoint. '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.queries = {}
+        self.errors = {}
+
+    def request(self, endpoint, method, *args, **kwargs):
+        ''' Make the request using the given client method and record how
+        long it took and how many queries it ran.
+        '''
+        start = time.time()
+        output = method(*args, **kwargs)
+        duration = time.time() - start
+        match = QUERIES_RE.search(output.headers.get('Server-Timing', ''))
+        with self.lock:
+            self.durations.setdefault(endpoint, []).append(duration)
+            if match:
+                self.queries.setdefault(endpoint, []).append(
+                    int(match.group(1)))
+            if output.status_code >= 400:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return output
+
+    def summary(self, wall_time):
+        ''' Return the statistics gathered, per endpoint. '''
+        results = {}
+        for endpoint, durations in self.durations.items():
+            durations = sorted(durations)
+            queries = self.queries.get(endpoint, [])
+            results[endpoint] = dict(
+                requests=len(durations),
+                errors=self.errors.get(endpoint, 0),
+                p50=percentile(durations, 50),
+                p95=percentile(durations, 95),
+                p99=percentile(durations, 99),
+                max=durations[-1],
+                throughput=len(durations) / wall_time,
+                queries=(float(sum(queries)) / len(queries)
+                         if queries else None),
+                max_queries=max(queries) if queries else None,
+            )
+        return results
+
+
+def simulate(users, election_id, n_choice, recorder, seed):
+    ''' Make each of the given users load the voting page and cast a
+    ballot.
+    '''
+    rng = random.Random(seed)
+    vote_url = '/election/%s/vote/' % election_id
+    voted_url = '/election/%s/voted/' % election_id
+    for username in users:
+        _LOCAL.user = FakeFasUser(username)
+        client = nuancier.app.APP.test_client()
+        output = recorder.request('vote', client.get, vote_url)
+        candidates = CANDIDATE_RE.findall(output.data)
+        csrf = CSRF_RE.search(output.data)
+        if not candidates or not csrf:
+            continue
+        data = {
+            'csrf_token': csrf.group(1),
+            'selection': rng.sample(
+                candidates, min(n_choice, len(candidates))),
+        }
+        recorder.request('process_vote', client.post, voted_url, data=data)
+
+
+def main():
+    ''' Run the load test and save the results. '''
+    parser = argparse.ArgumentParser(
+        description='Replay the voting flow against nuancier')
+    parser.add_argument(
+        '--candidates', type=int, default=500,
+        help='Number of candidates in the election.')
+    parser.add_argument(
+        '--votes', type=int, default=100000,
+        help='Number of votes already cast in the election.')
+    parser.add_argument(
+        '--choices', type=int, default=16,
+        help='Number of votes per voter.')
+    parser.add_argument(
+        '--users', type=int, default=200,
+        help='Number of users voting during the benchmark.')
+    parser.add_argument(
+        '--concurrency', type=int, default=1,
+        help='Number of users voting at the same time.')
+    parser.add_argument(
+        '--db-url',
+        help='Database to use, it will be emptied. Defaults to a '
+        'temporary SQLite database.')
+    parser.add_argument(
+        '--output', default='bench_vote.json',
+        help='File in which to save the results.')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='nuancier-bench-')
+    try:
+        db_url = args.db_url or 'sqlite:///%s' % os.path.join(
+            folder, 'bench.sqlite')
+        session = model.create_tables(db_url)
+        if session.bind.driver != 'pysqlite':
+            session.remove()
+            model.BASE.metadata.drop_all(session.bind)
+            session = model.create_tables(db_url)
+        election_id, _ = populate(
+            session, args.candidates, args.votes, args.choices,
+            election_open=True)
+        session.remove()
+
+        nuancier.app.create_app({
+            'DB_URL': db_url,
+            'PICTURE_FOLDER': os.path.join(folder, 'pictures'),
+            'CACHE_FOLDER': os.path.join(folder, 'cache'),
+            'NUANCIER_SERVER_TIMING': True,
+            'NUANCIER_SLOW_REQUEST_THRESHOLD': None,
+        })
+        # Same hack as tests.user_set: drop the before_request of
+        # flask_fas_openid which resets flask.g.fas_user.
+        nuancier.app.APP.before_request_funcs[None] = []
+        flask.appcontext_pushed.connect(set_fas_user, nuancier.app.APP)
+
+        recorder = Recorder()
+        threads = []
+        for idx in range(args.concurrency):
+            users = ['loaduser%s' % num
+                     for num in range(idx, args.users, args.concurrency)]
+            threads.append(threading.Thread(
+                target=simulate,
+                args=(users, election_id, args.choices, recorder, idx)))
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.time() - start
+    finally:
+        shutil.rmtree(folder)
+
+    results = dict(
+        revision=git_revision(),
+        date=datetime.datetime.utcnow().isoformat(),
+        candidates=args.candidates,
+        votes=args.votes,
+        users=args.users,
+        concurrency=args.concurrency,
+        wall_time=wall_time,
+        endpoints=recorder.summary(wall_time),
+    )
+
+    for endpoint, stats in sorted(results['endpoints'].items()):
+        print '%-13s %5s req  p50 %7.1fms  p95 %7.1fms  p99 %7.1fms  ' \
+            '%6.1f req/s  %5.1f queries/req  %s errors' % (
+                endpoint, stats['requests'], stats['p50'] * 1000,
+                stats['p95'] * 1000, stats['p99'] * 1000,
+                stats['throughput'], stats['queries'] or 0,
+                stats['errors'])
+
+    with open(args.output, 'w') as stream:
+        json.dump(results, stream, indent=2, sort_keys=True)
+    print 'Results saved in %s' % args.output
+
+
+if __name__ == '__main__':
+    main()
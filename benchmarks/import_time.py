@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+'''
+Measure the cold start-up time of the different layers of nuancier.
+
+Each statement is run in a fresh python interpreter, several times, and
+the time spent on top of an empty interpreter is reported.
+
+The last two statements compile all the templates, as the first requests
+of a new process do: once from scratch, and once loading them from a
+bytecode cache filled beforehand, as ``nuancier-admin compile-templates``
+does at deploy time.
+
+Usage::
+
+    python benchmarks/import_time.py [--runs 10]
+'''
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, '..')
+
+STATEMENTS = [
+    ('pkg_resources', 'import pkg_resources'),
+    ('model', 'import nuancier.lib.model'),
+    ('lib', 'import nuancier.lib'),
+    ('app module', 'import nuancier.app'),
+    ('create_app', 'import nuancier.app; nuancier.app.create_app()'),
+    ('compile templates',
+     'import nuancier.app, nuancier.templating; '
+     'nuancier.templating.precompile(nuancier.app.create_app())'),
+    ('cached templates',
+     'import nuancier.app, nuancier.templating; '
+     'nuancier.templating.precompile(nuancier.app.create_app('
+     '{"NUANCIER_TEMPLATE_CACHE_FOLDER": %(cache_folder)r}))'),
+]
+
+
+def time_statement(statement, runs):
+    ''' Return the wall-clock durations, in seconds, of running the given
+    statement in a new python interpreter.
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [path for path in [env.get('PYTHONPATH')] if path])
+    durations = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', statement], env=env)
+        durations.append(time.time() - start)
+    return sorted(durations)
+
+
+def main():
+    ''' Run the benchmark and print the results. '''
+    parser = argparse.ArgumentParser(
+        description='Measure the import time of nuancier')
+    parser.add_argument(
+        '--runs', type=int, default=10,
+        help='Number of interpreters started per statement.')
+    args = parser.parse_args()
+
+    baseline = time_statement('pass', args.runs)
+    base_min = baseline[0]
+
+    cache_folder = tempfile.mkdtemp(prefix='nuancier-templates-')
+    values = {'cache_folder': cache_folder}
+    try:
+        # Fill the bytecode cache
+        time_statement(STATEMENTS[-1][1] % values, 1)
+
+        print '%-20s %10s %10s' % ('', 'min (ms)', 'median (ms)')
+        for name, statement in STATEMENTS:
+            durations = time_statement(statement % values, args.runs)
+            print '%-20s %10.1f %10.1f' % (
+                name,
+                (durations[0] - base_min) * 1000,
+                (durations[len(durations) // 2] - base_min) * 1000)
+    finally:
+        shutil.rmtree(cache_folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,15 @@
 #!/usr/bin/env python
 
-## These two lines are needed to run on EL6
-__requires__ = ['SQLAlchemy >= 0.7', 'jinja2 >= 2.4']
-import pkg_resources
+import nuancier.bootstrap
+nuancier.bootstrap.select_versions()
 
-from nuancier import APP
+from nuancier.config import load_config
 from nuancier.lib import model
 
+CONFIG = load_config()
+
 path_alembic = None
-if 'PATH_ALEMBIC_INI' in APP.config \
-        and APP.config['PATH_ALEMBIC_INI']:
-    path_alembic = APP.config['PATH_ALEMBIC_INI']
-model.create_tables(APP.config['DB_URL'], path_alembic, True)
+if 'PATH_ALEMBIC_INI' in CONFIG \
+        and CONFIG['PATH_ALEMBIC_INI']:
+    path_alembic = CONFIG['PATH_ALEMBIC_INI']
+model.create_tables(CONFIG['DB_URL'], path_alembic, True)
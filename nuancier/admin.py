@@ -29,10 +29,15 @@ import flask
 
 from sqlalchemy.exc import SQLAlchemyError
 
-import nuancier
+import nuancier.app
+import nuancier.forms
 import nuancier.lib as nuancierlib
+import nuancier.lib.duplicates
+import nuancier.lib.export
+import nuancier.lib.jobs
+import nuancier.lib.storage
 
-from nuancier import APP, SESSION, LOG, nuancier_admin_required
+from nuancier.app import APP, SESSION, LOG, nuancier_admin_required
 
 
 ## Some of the object we use here have inherited methods which apparently
@@ -58,7 +63,7 @@ def admin_index():
 @nuancier_admin_required
 def admin_edit(election_id):
     ''' Edit an election. '''
-    if not nuancier.is_nuancier_admin(flask.g.fas_user):
+    if not nuancier.app.is_nuancier_admin(flask.g.fas_user):
         flask.flash('You are not an administrator of nuancier',
                         'error')
         return flask.redirect(flask.url_for('msg'))
@@ -114,7 +119,7 @@ def admin_edit(election_id):
 @nuancier_admin_required
 def admin_new():
     ''' Create a new election. '''
-    if not nuancier.is_nuancier_admin(flask.g.fas_user):
+    if not nuancier.app.is_nuancier_admin(flask.g.fas_user):
         flask.flash('You are not an administrator of nuancier',
                         'error')
         return flask.redirect(flask.url_for('msg'))
@@ -223,9 +228,19 @@ def admin_review_status(election_id, status):
             if candidate.approved_motif not in [None, '']
         ]
 
+    duplicates = nuancier.lib.duplicates.find_duplicates(
+        SESSION, election.id, candidates,
+        APP.config.get('NUANCIER_DUPLICATE_DISTANCE', 5))
+    others = {}
+    if duplicates:
+        others = dict(
+            (candidate.id, candidate)
+            for candidate in nuancierlib.get_candidates(SESSION, election.id)
+        )
+
     template = 'admin_review.html'
     if election.election_public or election.election_open \
-            or not nuancier.is_nuancier_admin(flask.g.fas_user):
+            or not nuancier.app.is_nuancier_admin(flask.g.fas_user):
         template = 'admin_review_ro.html'
 
     return flask.render_template(
@@ -233,6 +248,8 @@ def admin_review_status(election_id, status):
         election=election,
         form=nuancier.forms.ConfirmationForm(),
         candidates=candidates,
+        duplicates=duplicates,
+        others=others,
         picture_folder=os.path.join(
             APP.config['PICTURE_FOLDER'], election.election_folder),
         cache_folder=os.path.join(
@@ -245,7 +262,7 @@ def admin_review_status(election_id, status):
 @nuancier_admin_required
 def admin_process_review(election_id):
     ''' Process the reviewing of a new election. '''
-    if not nuancier.is_nuancier_admin(flask.g.fas_user):
+    if not nuancier.app.is_nuancier_admin(flask.g.fas_user):
         flask.flash('You are not an administrator of nuancier',
                         'error')
         return flask.redirect(flask.url_for('msg'))
@@ -377,6 +394,16 @@ def admin_process_review(election_id):
         LOG.exception(err)
         flask.flash('Could not approve/deny candidate', 'error')
 
+    # The sprite sheets only hold the approved candidates
+    if APP.config.get('NUANCIER_SPRITES', False):
+        try:
+            nuancier.lib.jobs.enqueue_sprites(
+                SESSION, election, flask.g.fas_user.username)
+            SESSION.commit()
+        except SQLAlchemyError as err:  # pragma: no cover
+            SESSION.rollback()
+            LOG.exception(err)
+
     flask.flash('Candidate(s) updated')
 
     for msg in msgs:
@@ -408,26 +435,164 @@ def admin_cache(election_id):
         return flask.render_template('msg.html')
 
     try:
-        nuancierlib.generate_cache(
+        job = nuancier.lib.jobs.enqueue_thumbnails(
             session=SESSION,
             election=election,
-            picture_folder=APP.config['PICTURE_FOLDER'],
-            cache_folder=APP.config['CACHE_FOLDER'],
-            size=APP.config['THUMB_SIZE'])
-        flask.flash('Cache regenerated for election %s' %
-                    election.election_name)
-    except nuancierlib.NuancierMultiExceptions as multierr:  # pragma: no cover
-        SESSION.rollback()
-        LOG.debug('User: "%s" could not generate cache for "%s"',
-                  flask.g.fas_user.username, election_id)
-        LOG.exception(multierr.messages)
-        for msg in multierr.messages:
-            flask.flash(msg, 'error')
+            user_name=flask.g.fas_user.username,
+            picture_folder=nuancier.app.get_storage(
+                nuancierlib.storage.PICTURES),
+            cache_folder=nuancier.app.get_storage(
+                nuancierlib.storage.CACHE))
+        SESSION.commit()
     except nuancierlib.NuancierException as err:
         SESSION.rollback()
         LOG.debug('User: "%s" could not generate cache for "%s"',
                   flask.g.fas_user.username, election_id)
         LOG.exception(err)
         flask.flash(err.message, 'error')
+        return flask.redirect(next_url)
+    except SQLAlchemyError as err:  # pragma: no cover
+        SESSION.rollback()
+        LOG.exception(err)
+        flask.flash('Could not queue the generation of the cache', 'error')
+        return flask.redirect(next_url)
+
+    flask.flash('Cache regeneration queued for election %s' %
+                election.election_name)
+    return flask.redirect(
+        flask.url_for('.admin_job', job_id=job.id, next=next_url))
+
+
+@APP.route('/admin/job/<int:job_id>/')
+@nuancier_admin_required
+def admin_job(job_id):
+    ''' Display the progress of a job run by nuancier-worker. '''
+    job = nuancier.lib.jobs.get_job(SESSION, job_id)
+    if not job:
+        flask.flash('No job found', 'error')
+        return flask.render_template('msg.html')
+
+    next_url = flask.request.args.get('next')
+    if not next_url or not nuancier.app.is_safe_url(next_url):
+        next_url = flask.url_for('.admin_index')
+
+    return flask.render_template(
+        'admin_job.html',
+        job=job,
+        progress=job.api_repr(),
+        next_url=next_url,
+    )
+
+
+@APP.route('/admin/job/<int:job_id>/progress')
+@nuancier_admin_required
+def admin_job_progress(job_id):
+    ''' Return the status of a job and of each of its files as JSON. '''
+    job = nuancier.lib.jobs.get_job(SESSION, job_id)
+    if not job:
+        output = flask.jsonify({'error': 'No job found'})
+        output.status_code = 404
+        return output
+
+    output = flask.jsonify(job.api_repr())
+    output.headers['Cache-Control'] = 'no-cache'
+    return output
+
+
+@APP.route('/admin/<int:election_id>/covotes/', methods=['GET', 'POST'])
+@nuancier_admin_required
+def admin_covotes(election_id):
+    ''' Display the candidates the most often voted for together in a
+    closed election and allow to (re-)compute them.
+    '''
+    election = nuancierlib.get_election(SESSION, election_id)
+
+    if not election:
+        flask.flash('No election found', 'error')
+        return flask.render_template('msg.html')
+
+    if not election.election_public:
+        flask.flash('This election is not closed yet', 'error')
+        return flask.redirect(flask.url_for('admin_index'))
+
+    form = nuancier.forms.ConfirmationForm()
+    if form.validate_on_submit():
+        if not nuancier.app.is_nuancier_admin(flask.g.fas_user):
+            flask.flash('You are not an administrator of nuancier',
+                        'error')
+            return flask.redirect(flask.url_for(
+                'admin_covotes', election_id=election_id))
+        try:
+            cnt = nuancierlib.build_covotes(SESSION, election)
+            SESSION.commit()
+            flask.flash('Co-votes computed for election %s: %s pairs of '
+                        'candidates' % (election.election_name, cnt))
+        except nuancierlib.NuancierException as err:
+            SESSION.rollback()
+            flask.flash(err.message, 'error')
+        except SQLAlchemyError as err:  # pragma: no cover
+            SESSION.rollback()
+            LOG.debug('User: "%s" could not compute the co-votes of "%s"',
+                      flask.g.fas_user.username, election_id)
+            LOG.exception(err)
+            flask.flash('Could not compute the co-votes of this election',
+                        'error')
+        return flask.redirect(flask.url_for(
+            'admin_covotes', election_id=election_id))
+
+    try:
+        limit = int(flask.request.args.get('limit', 5))
+    except ValueError:
+        limit = 5
+
+    similar = nuancierlib.get_similar_candidates(
+        SESSION, election_id, limit=limit)
+    candidates = dict(
+        (candidate.id, candidate)
+        for candidate in nuancierlib.get_candidates(SESSION, election_id))
+
+    return flask.render_template(
+        'admin_covotes.html',
+        election=election,
+        form=form,
+        results=nuancierlib.get_results(SESSION, election_id),
+        candidates=candidates,
+        similar=similar,
+        limit=limit,
+    )
+
+
+@APP.route('/admin/<int:election_id>/export/<what>.<fmt>')
+@nuancier_admin_required
+def admin_export(election_id, what, fmt):
+    ''' Stream the votes, results or candidates of an election as CSV or
+    NDJSON.
+    '''
+    election = nuancierlib.get_election(SESSION, election_id)
+
+    if not election:
+        flask.flash('No election found', 'error')
+        return flask.render_template('msg.html')
+
+    if what in ['votes', 'results']:
+        if not nuancier.app.is_nuancier_admin(flask.g.fas_user):
+            flask.flash('You are not an administrator of nuancier',
+                        'error')
+            return flask.redirect(flask.url_for('admin_index'))
+        if not election.election_public:
+            flask.flash('This election is not closed yet', 'error')
+            return flask.redirect(flask.url_for('admin_index'))
+
+    try:
+        chunks = nuancier.lib.export.export(SESSION, election_id, what, fmt)
+    except nuancierlib.NuancierException as err:
+        flask.flash(err.message, 'error')
+        return flask.redirect(flask.url_for('admin_index'))
 
-    return flask.redirect(next_url)
+    response = flask.Response(
+        flask.stream_with_context(chunks),
+        mimetype=nuancier.lib.export.MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = \
+        'attachment; filename=%s-%s.%s' % (
+            election.election_folder, what, fmt)
+    return response
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+
+'''
+Read-only JSON API of nuancier.
+
+All the endpoints are paginated (``page`` and ``per_page`` arguments) and
+accept a ``fields`` argument, a comma separated list of the fields to
+return for each item. Their responses carry a strong ETag, derived from the
+last changes made to the data returned, so clients sending it back in an
+``If-None-Match`` header get a ``304 Not Modified`` when nothing changed.
+'''
+
+import datetime
+import hashlib
+
+import flask
+
+import nuancier.lib as nuancierlib
+from nuancier.app import APP, SESSION
+from nuancier.lib import model
+
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
+
+class APIError(Exception):
+    ''' Error to report to the client of the API. '''
+
+    def __init__(self, message, status_code=400):
+        ''' Instanciate a new APIError object. '''
+        super(APIError, self).__init__(message)
+        self.status_code = status_code
+
+
+@APP.errorhandler(APIError)
+def api_error(err):
+    ''' Return the error as a JSON object. '''
+    response = flask.jsonify(error=err.message)
+    response.status_code = err.status_code
+    return response
+
+
+def _serialize(data):
+    ''' Convert the dates of the given dictionnary into strings. '''
+    for key, value in data.items():
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            data[key] = value.isoformat()
+    return data
+
+
+def _get_fields(allowed):
+    ''' Return the list of fields requested, or None if all the fields
+    are.
+    '''
+    fields = flask.request.args.get('fields')
+    if not fields:
+        return None
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = set(fields) - set(allowed)
+    if unknown:
+        raise APIError('Unknown fields: %s, available fields are: %s' % (
+            ', '.join(sorted(unknown)), ', '.join(sorted(allowed))))
+    return fields
+
+
+def _get_page():
+    ''' Return the page and the number of items per page requested. '''
+    try:
+        page = int(flask.request.args.get('page', 1))
+        per_page = int(flask.request.args.get('per_page', DEFAULT_PER_PAGE))
+    except ValueError:
+        raise APIError('page and per_page must be integers')
+    if page < 1 or per_page < 1 or per_page > MAX_PER_PAGE:
+        raise APIError(
+            'page must be positive and per_page between 1 and %s' %
+            MAX_PER_PAGE)
+    return page, per_page
+
+
+def _paginate(items, page, per_page):
+    ''' Return the items of the requested page, either of a list or of a
+    query, and the information about the pagination.
+    '''
+    start = (page - 1) * per_page
+    if isinstance(items, list):
+        total = len(items)
+        items = items[start:start + per_page]
+    else:
+        total = items.count()
+        items = items.limit(per_page).offset(start).all()
+    return items, dict(
+        page=page,
+        per_page=per_page,
+        total=total,
+        pages=(total + per_page - 1) // per_page,
+    )
+
+
+def _respond(key, version, build, allowed):
+    ''' Return the JSON response built by ``build``, or a 304 response if
+    the client already has it.
+
+    :arg key: the name of the list of items in the response.
+    :arg version: a tuple identifying the state of the data returned, it
+        must change whenever the data does.
+    :arg build: a callable returning the items of the page requested and
+        the information about the pagination, given the page and the number
+        of items per page.
+    :arg allowed: the fields the items have.
+    '''
+    page, per_page = _get_page()
+    fields = _get_fields(allowed)
+    etag = hashlib.sha1(repr(
+        (key, version, page, per_page, fields)
+    )).hexdigest()
+
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    items, pagination = build(page, per_page)
+    if fields:
+        items = [
+            dict((field, item[field]) for field in fields)
+            for item in items
+        ]
+    pagination[key] = items
+    response = flask.jsonify(pagination)
+    response.set_etag(etag)
+    return response
+
+
+def _get_election(election_id):
+    ''' Return the election or raise an APIError if it does not exist. '''
+    election = nuancierlib.get_election(SESSION, election_id)
+    if not election:
+        raise APIError('No election found', 404)
+    return election
+
+
+def _candidate_repr(election, candidate):
+    ''' Return the representation of a candidate in the API. '''
+    data = candidate.api_repr(version=1)
+    filename = '%s/%s' % (election.election_folder, candidate.candidate_file)
+    data.update(dict(
+        id=candidate.id,
+        url=flask.url_for('base_picture', filename=filename, _external=True),
+        thumbnail_url=flask.url_for(
+            'base_cache', filename=filename, _external=True),
+    ))
+    return data
+
+
+ELECTION_FIELDS = (
+    'id', 'name', 'year', 'date_start', 'date_end', 'submission_date_start',
+    'submission_open', 'election_open', 'election_public')
+CANDIDATE_FIELDS = (
+    'id', 'name', 'author', 'original_url', 'license', 'submitter', 'url',
+    'thumbnail_url')
+RESULT_FIELDS = CANDIDATE_FIELDS + ('rank', 'votes')
+
+
+@APP.route('/api/v1/elections')
+def api_elections():
+    ''' Return the list of the elections, the most recent first. '''
+    def build(page, per_page):
+        ''' Return the requested page of elections. '''
+        elections, pagination = _paginate(
+            nuancierlib.get_elections(SESSION), page, per_page)
+        items = []
+        for election in elections:
+            data = _serialize(election.api_repr(version=1))
+            data.update(dict(
+                submission_open=election.submission_open,
+                election_open=election.election_open,
+                election_public=election.election_public,
+            ))
+            items.append(data)
+        return items, pagination
+
+    # Whether the elections are open depends on the day
+    version = (
+        model.Elections.last_update(SESSION),
+        datetime.datetime.utcnow().date())
+    return _respond('elections', version, build, ELECTION_FIELDS)
+
+
+@APP.route('/api/v1/elections/<int:election_id>/candidates')
+def api_candidates(election_id):
+    ''' Return the approved candidates of an election, once it is open or
+    public.
+    '''
+    election = _get_election(election_id)
+    # Like the page of the election, do not show the candidates while they
+    # are being submitted and reviewed
+    if not election.election_open and not election.election_public:
+        raise APIError('This election is not open', 403)
+
+    def build(page, per_page):
+        ''' Return the requested page of candidates. '''
+        # Sort the candidates uploaded at the same time by identifier so
+        # that the pages do not overlap
+        candidates, pagination = _paginate(
+            model.Candidates.by_election(
+                SESSION, election_id, approved=True, yield_per=per_page
+            ).order_by(model.Candidates.id),
+            page, per_page)
+        return [_candidate_repr(election, candidate)
+                for candidate in candidates], pagination
+
+    version = (
+        election.date_updated,
+        model.Candidates.last_update(SESSION, election_id))
+    return _respond('candidates', version, build, CANDIDATE_FIELDS)
+
+
+@APP.route('/api/v1/elections/<int:election_id>/results')
+def api_results(election_id):
+    ''' Return the approved candidates of a closed election, ranked by the
+    number of votes they received.
+    '''
+    election = _get_election(election_id)
+    if not election.election_public:
+        raise APIError('The results of this election are not public yet', 403)
+
+    def build(page, per_page):
+        ''' Return the requested page of results. '''
+        results, pagination = _paginate(
+            model.Candidates.tallies_by_election(
+                SESSION, election_id, yield_per=per_page),
+            page, per_page)
+        items = []
+        for idx, (candidate, votes, _) in enumerate(results):
+            data = _candidate_repr(election, candidate)
+            data['rank'] = (page - 1) * per_page + idx + 1
+            data['votes'] = int(votes)
+            items.append(data)
+        return items, pagination
+
+    version = (
+        election.date_updated,
+        model.Candidates.last_update(SESSION, election_id),
+        model.Votes.tally_version(SESSION, election_id))
+    return _respond('results', version, build, RESULT_FIELDS)
@@ -0,0 +1,622 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2013-2014  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+'''
+The nuancier Flask application.
+'''
+
+import hashlib
+import logging
+import logging.handlers
+import mimetypes
+import os
+import sys
+import urlparse
+
+import flask
+import dogpile.cache
+from dogpile.cache.api import NO_VALUE
+from functools import wraps
+from jinja2 import Markup
+
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug import secure_filename
+
+import nuancier.config
+import nuancier.forms
+import nuancier.instrumentation
+import nuancier.lib as nuancierlib
+import nuancier.lib.packs
+import nuancier.lib.storage
+import nuancier.metrics
+import nuancier.proxy
+import nuancier.templating
+
+from nuancier import __version__
+
+
+## Some of the object we use here have inherited methods which apparently
+## pylint does not detect.
+# pylint: disable=E1101, E1103
+## We set up the application in create_app
+# pylint: disable=W0603
+
+
+APP = flask.Flask(__name__)
+
+# The FAS extension, set up by create_app
+FAS = None
+
+# The cache, configured by create_app
+CACHE = dogpile.cache.make_region()
+
+LOG = APP.logger
+
+# The engine behind the session is only created on first use, so that it
+# relies on the configuration loaded by create_app
+SESSION = nuancierlib.create_lazy_session(lambda: APP.config['DB_URL'])
+
+_INITIALIZED = False
+
+
+def create_app(config=None):
+    ''' Configure the nuancier Flask application and return it.
+
+    The configuration is loaded from the default configuration, the file
+    pointed by the ``NUANCIER_CONFIG`` environment variable and finally
+    the provided config. The extensions, the loggers and the views are
+    only set up the first time this function is called.
+
+    :kwarg config: a dict of configuration values or the path to a
+        configuration file.
+    '''
+    global FAS, _INITIALIZED
+
+    if isinstance(config, basestring):
+        APP.config.update(nuancier.config.load_config(config))
+    else:
+        APP.config.update(nuancier.config.load_config())
+        APP.config.update(config or {})
+
+    load_groups(APP.config)
+
+    if _INITIALIZED:
+        return APP
+
+    # Set up FAS extension
+    ## pylint cannot import flask extension correctly
+    # pylint: disable=E0611,F0401
+    from flask.ext.fas_openid import FAS as FASOpenID
+    FAS = FASOpenID(APP)
+    APP.wsgi_app = nuancier.proxy.ReverseProxied(APP.wsgi_app)
+    APP.wsgi_app = nuancier.instrumentation.RequestTimer(
+        APP.wsgi_app,
+        threshold=APP.config.get('NUANCIER_SLOW_REQUEST_THRESHOLD'),
+        header=APP.config.get('NUANCIER_SERVER_TIMING', False),
+        logger=APP.logger)
+    flask.request_started.connect(set_request_endpoint, APP)
+    flask.request_finished.connect(set_request_streamed, APP)
+
+    # Initialize the cache.
+    CACHE.configure(
+        APP.config.get('NUANCIER_CACHE_BACKEND', 'dogpile.cache.memory'),
+        wrap=[nuancier.instrumentation.CacheMetricsProxy],
+        **APP.config.get('NUANCIER_CACHE_KWARGS', {})
+    )
+
+    # Share the metrics between the processes
+    nuancier.metrics.REGISTRY.configure(
+        APP.config.get('NUANCIER_METRICS_FOLDER'))
+
+    # Share the compiled templates between the processes
+    if APP.config.get('NUANCIER_TEMPLATE_CACHE_FOLDER'):
+        nuancier.templating.configure_bytecode_cache(
+            APP, APP.config['NUANCIER_TEMPLATE_CACHE_FOLDER'])
+
+    # Set up the logger
+    ## Send emails for big exception
+    mail_handler = logging.handlers.SMTPHandler(
+        APP.config.get('NUANCIER_EMAIL_SMTP_SERVER', '127.0.0.1'),
+        APP.config.get('NUANCIER_EMAIL_FROM', 'nobody@fedoraproject.org'),
+        APP.config.get('NUANCIER_EMAIL_ERROR_TO', 'admin@fedoraproject.org'),
+        '[Nuancier] error')
+    mail_handler.setFormatter(logging.Formatter('''
+        Message type:       %(levelname)s
+        Location:           %(pathname)s:%(lineno)d
+        Module:             %(module)s
+        Function:           %(funcName)s
+        Time:               %(asctime)s
+
+        Message:
+
+        %(message)s
+    '''))
+    mail_handler.setLevel(logging.ERROR)
+    if not APP.debug:
+        APP.logger.addHandler(mail_handler)
+
+    # Log to stderr as well
+    stderr_log = logging.StreamHandler(sys.stderr)
+    stderr_log.setLevel(logging.INFO)
+    APP.logger.addHandler(stderr_log)
+
+    # Finalize the import of other controllers
+    ## They register their views on APP when imported
+    # pylint: disable=W0612
+    from nuancier import admin, api, ui
+
+    _INITIALIZED = True
+    return APP
+
+
+def is_safe_url(target):
+    """ Checks that the target url is safe and sending to the current
+    website not some other malicious one.
+    """
+    ref_url = urlparse.urlparse(flask.request.host_url)
+    test_url = urlparse.urlparse(
+        urlparse.urljoin(flask.request.host_url, target))
+    return test_url.scheme in ('http', 'https') and \
+        ref_url.netloc == test_url.netloc
+
+
+def _groups_set(groups):
+    ''' Return the provided group or list of groups as a frozenset.
+    '''
+    if isinstance(groups, basestring):
+        return frozenset([groups])
+    return frozenset(groups)
+
+
+# The FAS groups granting a role in nuancier, computed by load_groups
+ADMIN_GROUPS = REVIEW_GROUPS = WEIGHTED_GROUPS = frozenset()
+
+
+def load_groups(config):
+    ''' Compute from the configuration the FAS groups granting a role in
+    nuancier.
+    '''
+    global ADMIN_GROUPS, REVIEW_GROUPS, WEIGHTED_GROUPS
+    ADMIN_GROUPS = _groups_set(config['ADMIN_GROUP'])
+    REVIEW_GROUPS = _groups_set(config['REVIEW_GROUP'])
+    WEIGHTED_GROUPS = _groups_set(config['WEIGHTED_GROUP'])
+
+
+class UserRoles(object):
+    ''' The roles a FAS user has in nuancier.
+
+    :arg user: the FAS user for which to resolve the roles, can be None.
+    '''
+
+    __slots__ = ('user', 'admin', 'reviewer', 'weighted')
+
+    def __init__(self, user):
+        self.user = user
+        self.admin = self.reviewer = self.weighted = False
+
+        if not user or not user.cla_done or len(user.groups) < 1:
+            return
+
+        groups = set(user.groups)
+        self.admin = not groups.isdisjoint(ADMIN_GROUPS)
+        self.reviewer = not groups.isdisjoint(REVIEW_GROUPS)
+        self.weighted = not groups.isdisjoint(WEIGHTED_GROUPS)
+
+
+def get_user_roles(user):
+    ''' Return the UserRoles of the specified user.
+
+    Within a request, the roles of the user logged in are resolved only
+    once and stored on ``flask.g`` for the rest of the request.
+    '''
+    if not user or not flask.has_request_context() \
+            or user is not getattr(flask.g, 'fas_user', None):
+        return UserRoles(user)
+
+    roles = getattr(flask.g, 'nuancier_roles', None)
+    if roles is None or roles.user is not user:
+        roles = UserRoles(user)
+        flask.g.nuancier_roles = roles
+    return roles
+
+
+def is_nuancier_admin(user):
+    ''' Is the user a nuancier admin.
+    '''
+    return get_user_roles(user).admin
+
+
+def is_nuancier_reviewer(user):
+    ''' Is the user a nuancier reviewer.
+    '''
+    return get_user_roles(user).reviewer
+
+
+def has_weigthed_vote(user):
+    ''' Has the user a weigthed vote or not.
+    '''
+    return get_user_roles(user).weighted
+
+
+def fas_login_required(function):
+    ''' Flask decorator to ensure that the user is logged in against FAS.
+    To use this decorator you need to have a function named 'auth_login'.
+    Without that function the redirect if the user is not logged in will not
+    work.
+
+    '''
+    @wraps(function)
+    def decorated_function(*args, **kwargs):
+        ''' Wrapped function actually checking if the user is logged in.
+        '''
+        if not hasattr(flask.g, 'fas_user') or flask.g.fas_user is None:
+            return flask.redirect(flask.url_for('.login',
+                                                next=flask.request.url))
+        elif not flask.g.fas_user.cla_done:
+            flask.flash('You must sign the CLA (Contributor License '
+                        'Agreement to use nuancier', 'error')
+            return flask.redirect(flask.url_for('index'))
+        return function(*args, **kwargs)
+    return decorated_function
+
+
+def contributor_required(function):
+    ''' Flask decorator to ensure that the user is logged in against FAS.
+
+    We'll always make sure the user is CLA+1 as it's what's needed to be
+    allowed to vote.
+    '''
+    @wraps(function)
+    def decorated_function(*args, **kwargs):
+        ''' Wrapped function actually checking if the user is logged in.
+        '''
+        if not hasattr(flask.g, 'fas_user') or flask.g.fas_user is None:
+            return flask.redirect(flask.url_for('.login',
+                                                next=flask.request.url))
+        elif not flask.g.fas_user.cla_done:
+            flask.flash('You must sign the CLA (Contributor License '
+                        'Agreement to use nuancier', 'error')
+            return flask.redirect(flask.url_for('index'))
+        elif len(flask.g.fas_user.groups) == 0:
+            flask.flash('You must be in one more group than the CLA',
+                        'error')
+            return flask.redirect(flask.url_for('index'))
+        return function(*args, **kwargs)
+    return decorated_function
+
+
+def nuancier_admin_required(function):
+    ''' Decorator used to check if the loged in user is a nuancier admin
+    or not.
+    '''
+    @wraps(function)
+    def decorated_function(*args, **kwargs):
+        ''' Wrapped function actually checking if the user is an admin for
+        nuancier.
+        '''
+        if not hasattr(flask.g, 'fas_user') or flask.g.fas_user is None:
+            return flask.redirect(flask.url_for('.login',
+                                                next=flask.request.url))
+        elif not flask.g.fas_user.cla_done:
+            flask.flash('You must sign the CLA (Contributor License '
+                        'Agreement to use nuancier', 'error')
+            return flask.redirect(flask.url_for('index'))
+        elif len(flask.g.fas_user.groups) == 0:
+            flask.flash(
+                'You must be in one more group than the CLA', 'error')
+            return flask.redirect(flask.url_for('index'))
+        roles = get_user_roles(flask.g.fas_user)
+        if not roles.admin and not roles.reviewer:
+            flask.flash(
+                'You are neither an administrator or a reviewer of nuancier',
+                'error')
+            return flask.redirect(flask.url_for('msg'))
+        else:
+            return function(*args, **kwargs)
+    return decorated_function
+
+
+def validate_input_file(input_file):
+    ''' Validate the submitted input file.
+
+    This validation has four layers:
+      - extension of the file provided
+      - MIMETYPE of the file provided
+      - size of the image (1600x1200 minimal)
+      - ratio of the image (16:9)
+
+    :arg input_file: a File object of the candidate submitted/uploaded and
+        for which we want to check that it compliants with our expectations.
+    :return: the information about the picture read while validating it,
+        see ``nuancier.lib.validate_picture``.
+    '''
+
+    return nuancierlib.validate_picture(
+        secure_filename(input_file.filename),
+        input_file.mimetype,
+        input_file.stream,
+        APP.config)
+
+
+## Generic APP functions
+
+@APP.template_filter('format_grp')
+def format_grp(groups):
+    """ Template filter to present correctly the groups given.
+    In this case groups can be a string or a list
+    """
+    if isinstance(groups, basestring):  # pragma: no cover
+        groups = set([groups])
+    else:  # pragma: no cover
+        groups = set(groups)
+
+    return ', '.join(groups)
+
+@APP.template_global()
+def thumbnail_attrs(candidate):
+    ''' Return the attributes of the ``img`` tag of the thumbnail of the
+    candidate: its width and height, so that the browser can lay out the
+    page before the thumbnails are loaded, and its placeholder, shown until
+    the thumbnail, loaded lazily, is there.
+    '''
+    attrs = Markup(' loading="lazy"')
+    if candidate.picture_width and candidate.picture_height:
+        width, height = nuancierlib.thumbnail_size(
+            candidate.picture_width, candidate.picture_height,
+            APP.config['THUMB_SIZE'])
+        attrs += Markup(' width="%d" height="%d"') % (width, height)
+    if candidate.candidate_placeholder:
+        attrs += Markup(
+            ' style="background: url(%s) center / cover no-repeat"'
+        ) % candidate.candidate_placeholder
+    return attrs
+
+
+@APP.template_global()
+def candidate_tiles(macro, election, candidates, sprites=None):
+    ''' Return the HTML of the tile of each of the candidates, rendered by
+    the given macro of ``_tiles.html``.
+
+    The tiles are cached in the CACHE region, keyed by the date at which the
+    candidate and its election were last updated and by the placeholder and
+    size of its picture, which the worker fills in later, so that a page
+    only has to render the tiles of the candidates which changed.
+
+    If the sprites of the election, see ``nuancier.lib.sprites``, are
+    given, the macro is told whether the candidate is in them.
+    '''
+    sprites = sprites or None
+    flags = [
+        sprites is not None and str(candidate.id) in sprites['candidates']
+        for candidate in candidates
+    ]
+    keys = [
+        'tile|%s|%s|%s|%s|%s|%s|%s|%s' % (
+            macro, flask.request.script_root,
+            election.id, election.date_updated.isoformat(),
+            candidate.id, candidate.date_updated.isoformat(),
+            hashlib.sha1(repr((
+                candidate.candidate_placeholder,
+                candidate.picture_width,
+                candidate.picture_height,
+            ))).hexdigest(),
+            'sprite' if sprite else '')
+        for candidate, sprite in zip(candidates, flags)
+    ]
+    values = CACHE.get_multi(
+        keys,
+        expiration_time=APP.config.get(
+            'NUANCIER_FRAGMENT_CACHE_EXPIRATION', 86400))
+
+    render = None
+    missing = {}
+    tiles = []
+    for key, value, candidate, sprite in zip(
+            keys, values, candidates, flags):
+        if value is NO_VALUE:
+            if render is None:
+                render = flask.get_template_attribute('_tiles.html', macro)
+            if sprites is None:
+                value = unicode(render(election, candidate))
+            else:
+                value = unicode(render(election, candidate, sprite))
+            missing[key] = value
+        tiles.append(Markup(value))
+    if missing:
+        CACHE.set_multi(missing)
+    return tiles
+
+
+@APP.context_processor
+def inject_is_admin():
+    ''' Inject whether the user is a nuancier admin or not in every page
+    (every template).
+    '''
+    user = None
+    if hasattr(flask.g, 'fas_user'):
+        user = flask.g.fas_user
+    roles = get_user_roles(user)
+    return dict(is_admin=roles.admin,
+                is_reviewer=roles.reviewer,
+                version=__version__)
+
+
+# pylint: disable=W0613
+@APP.teardown_request
+def shutdown_session(exception=None):
+    ''' Remove the DB session at the end of each request. '''
+    SESSION.remove()
+
+
+# pylint: disable=W0613
+def set_request_endpoint(sender, **extra):
+    ''' Let the request timer know which endpoint processes the request.
+    '''
+    stats = flask.request.environ.get('nuancier.stats')
+    if stats is not None:
+        stats.endpoint = flask.request.endpoint
+
+
+# pylint: disable=W0613
+def set_request_streamed(sender, response, **extra):
+    ''' Let the request timer know whether the body of the response is
+    generated while it is sent, the files are sent as they are.
+    '''
+    stats = flask.request.environ.get('nuancier.stats')
+    if stats is not None:
+        stats.streamed = response.is_streamed \
+            and not response.direct_passthrough
+
+
+# pylint: disable=W0613
+@APP.before_request
+def set_session():
+    """ Set the flask session as permanent. """
+    flask.session.permanent = True
+
+
+def get_storage(kind):
+    ''' Return the storage of the given kind of files, see
+    ``nuancier.lib.storage``, as configured.
+    '''
+    return nuancierlib.storage.get_storage(APP.config, kind)
+
+
+def send_stored(storage, filename):
+    ''' Return the response sending the given file of the storage: either
+    the file itself or a redirection to the storage, if it can serve it.
+    '''
+    url = storage.url(filename)
+    if url is not None:
+        return flask.redirect(url)
+    # Only the local storage cannot serve its files
+    return flask.send_from_directory(storage.root, filename)
+
+
+@CACHE.cache_on_arguments(expiration_time=3600)
+@APP.route('/pictures/<path:filename>')
+def base_picture(filename):
+    ''' Returns a picture having the provided path relative to the
+    PICTURE_FOLDER set in the configuration.
+    '''
+    return send_stored(get_storage(nuancierlib.storage.PICTURES), filename)
+
+
+@CACHE.cache_on_arguments(expiration_time=3600)
+@APP.route('/cache/<path:filename>')
+def base_cache(filename):
+    ''' Returns a picture having the provided path relative to the
+    CACHE_FOLDER set in the configuration, reading it from the pack of the
+    thumbnails of its folder if it is in there and has not been generated
+    again since the pack was built.
+    '''
+    storage = get_storage(nuancierlib.storage.CACHE)
+    folder, name = os.path.split(filename)
+    # Packing removes the thumbnails from the folder, those left in there
+    # are newer than their packed copy
+    if APP.config.get('NUANCIER_THUMBNAIL_PACKS', False) and folder \
+            and isinstance(storage, nuancierlib.storage.LocalStorage) \
+            and not storage.exists(filename):
+        try:
+            pack = nuancierlib.packs.get_pack(
+                flask.safe_join(storage.root, folder))
+        except IOError as err:  # pragma: no cover
+            LOG.exception(err)
+            pack = None
+        if pack is not None and name in pack:
+            response = flask.Response(
+                pack.get(name),
+                mimetype=mimetypes.guess_type(name)[0]
+                or 'application/octet-stream')
+            response.set_etag(pack.digest(name))
+            response.cache_control.public = True
+            response.cache_control.max_age = APP.get_send_file_max_age(name)
+            return response.make_conditional(flask.request)
+    return send_stored(storage, filename)
+
+
+@APP.route('/display/<path:filename>.jpg')
+def base_display(filename):
+    ''' Returns the version of the picture having the provided path
+    relative to the PICTURE_FOLDER shown in the lightbox, or redirects to
+    the picture itself if it has no such version (yet).
+    '''
+    storage = get_storage(nuancierlib.storage.CACHE)
+    display = nuancierlib.get_display_path(filename)
+    if APP.config.get('DISPLAY_SIZE') and storage.exists(display):
+        return send_stored(storage, display)
+    return flask.redirect(flask.url_for('base_picture', filename=filename))
+
+
+@APP.route('/metrics')
+def metrics():
+    ''' Returns the metrics of nuancier in the Prometheus text format.
+    '''
+    return flask.Response(
+        nuancier.metrics.REGISTRY.render(),
+        mimetype='text/plain; version=0.0.4')
+
+
+@APP.route('/msg/')
+def msg():
+    ''' Page used to display error messages
+    '''
+    return flask.render_template('msg.html')
+
+
+@APP.route('/login/', methods=['GET', 'POST'])
+def login():  # pragma: no cover
+    ''' Login mechanism for this application.
+    '''
+    next_url = None
+    if 'next' in flask.request.args:
+        if is_safe_url(flask.request.args['next']):
+            next_url = flask.request.args['next']
+
+    if not next_url or next_url == flask.url_for('.login'):
+        next_url = flask.url_for('.index')
+
+    if hasattr(flask.g, 'fas_user') and flask.g.fas_user is not None:
+        return flask.redirect(next_url)
+    else:
+        groups = ADMIN_GROUPS | REVIEW_GROUPS | WEIGHTED_GROUPS
+
+        return FAS.login(return_url=next_url, groups=list(groups))
+
+
+@APP.route('/logout/')
+def logout():  # pragma: no cover
+    ''' Log out if the user is logged in other do nothing.
+    Return to the index page at the end.
+    '''
+    next_url = None
+    if 'next' in flask.request.args:
+        if is_safe_url(flask.request.args['next']):
+            next_url = flask.request.args['next']
+
+    if not next_url or next_url == flask.url_for('.login'):
+        next_url = flask.url_for('.index')
+
+    if hasattr(flask.g, 'fas_user') and flask.g.fas_user is not None:
+        FAS.logout()
+        flask.flash('You are no longer logged-in')
+
+    return flask.redirect(next_url)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+
+'''
+Start-up of the scripts of nuancier run from a checkout.
+
+EL6 (python 2.6) ships several versions of SQLAlchemy and jinja2 side by
+side, as eggs, and only puts the recent ones on the path if the running
+script requests them from ``pkg_resources``. Elsewhere the right versions
+are on the path already and importing ``pkg_resources`` only slows down
+the start-up, so it is skipped.
+
+The ``nuancier-admin`` and ``nuancier-worker`` commands installed by
+setup.py do not need this: their wrappers already load ``pkg_resources``
+with the requirements of nuancier.
+'''
+
+import sys
+
+
+# The versions to select on EL6
+REQUIREMENTS = ['SQLAlchemy >= 0.8', 'jinja2 >= 2.4']
+
+
+def select_versions():
+    ''' Put the versions of SQLAlchemy and jinja2 needed by nuancier on
+    the path, on EL6 only. Must be called by the script run, before
+    anything imports SQLAlchemy, jinja2 or ``pkg_resources``.
+    '''
+    if sys.version_info >= (2, 7):
+        return
+    import __main__
+    # pkg_resources reads the requirements of the script run at import
+    __main__.__requires__ = REQUIREMENTS
+    import pkg_resources  # pylint: disable=W0612
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+
+'''
+Command line interface to administrate nuancier.
+
+Installed as ``nuancier-admin``, it runs the maintenance tasks that are too
+long to be run while answering a web request.
+'''
+
+import argparse
+import multiprocessing
+import sys
+
+import nuancier.config
+import nuancier.lib as nuancierlib
+import nuancier.lib.export
+
+
+def do_covotes(session, config, args):
+    ''' Compute the co-votes of a closed election. '''
+    election = nuancierlib.get_election(session, args.election_id)
+    if not election:
+        raise nuancierlib.NuancierException(
+            'No election found with the identifier %s' % args.election_id)
+    cnt = nuancierlib.build_covotes(session, election)
+    session.commit()
+    print 'Co-votes computed for election %s: %s pairs of candidates' % (
+        election.election_name, cnt)
+
+
+def do_export(session, config, args):
+    ''' Export the votes, results or candidates of an election. '''
+    election = nuancierlib.get_election(session, args.election_id)
+    if not election:
+        raise nuancierlib.NuancierException(
+            'No election found with the identifier %s' % args.election_id)
+    chunks = nuancier.lib.export.export(
+        session, election.id, args.what, args.format)
+    stream = sys.stdout
+    if args.output:
+        stream = open(args.output, 'w')
+    try:
+        for chunk in chunks:
+            stream.write(chunk)
+    finally:
+        if args.output:
+            stream.close()
+
+
+def _check_local_storage(config):
+    ''' Fail unless the pictures are stored on the local filesystem, in
+    the PICTURE_FOLDER the command reads them from.
+    '''
+    if config.get('NUANCIER_STORAGE', 'local') != 'local':
+        raise nuancierlib.NuancierException(
+            'This command reads the pictures from PICTURE_FOLDER and only '
+            'works with the local storage')
+
+
+def do_import(session, config, args):
+    ''' Load the candidates listed in the infos.txt file of an election. '''
+    import nuancier.lib.importer
+
+    _check_local_storage(config)
+
+    election = nuancierlib.get_election(session, args.election_id)
+    if not election:
+        raise nuancierlib.NuancierException(
+            'No election found with the identifier %s' % args.election_id)
+
+    pool = None
+    if args.processes > 1:
+        pool = multiprocessing.Pool(args.processes)
+    try:
+        imported, errors = nuancier.lib.importer.import_candidates(
+            session, election,
+            picture_folder=config['PICTURE_FOLDER'],
+            cache_folder=config['CACHE_FOLDER'],
+            config=config,
+            candidate_license=args.license,
+            submitter=args.submitter,
+            submitter_email=args.email,
+            approved=args.approve,
+            pool=pool)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    session.commit()
+
+    for error in errors:
+        print >> sys.stderr, error
+    print '%s candidates imported in election %s, %s errors' % (
+        len(imported), election.election_name, len(errors))
+
+
+def do_backfill(session, config, args):
+    ''' Store the information about the pictures and the perceptual hash
+    of the candidates submitted before they were stored at upload.
+    '''
+    import nuancier.lib.duplicates
+
+    _check_local_storage(config)
+    election = nuancierlib.get_election(session, args.election_id)
+    if not election:
+        raise nuancierlib.NuancierException(
+            'No election found with the identifier %s' % args.election_id)
+
+    cnt, errors = nuancierlib.backfill_metadata(
+        session, election, config['PICTURE_FOLDER'])
+    cnt_dhash, errors_dhash = nuancier.lib.duplicates.backfill(
+        session, election, config['PICTURE_FOLDER'])
+    session.commit()
+
+    for error in errors + errors_dhash:
+        print >> sys.stderr, error
+    print 'Pictures of %s candidates and perceptual hashes of %s ' \
+        'candidates stored in election %s, %s errors' % (
+            cnt, cnt_dhash, election.election_name,
+            len(errors) + len(errors_dhash))
+
+
+def do_publish(session, config, args):
+    ''' Publish the closed elections as a static web site. '''
+    import nuancier.app
+
+    _check_local_storage(config)
+    nuancier.app.create_app(args.config)
+    import nuancier.publish
+
+    published, removed = nuancier.publish.publish(
+        session, args.output_dir, base_url=args.base_url,
+        pictures=args.pictures, force=args.force)
+    for election_id in published:
+        print 'Published election %s' % election_id
+    for election_id in removed:
+        print 'Removed election %s' % election_id
+
+
+def do_compile_templates(session, config, args):
+    ''' Compile all the templates into the shared bytecode cache. '''
+    import nuancier.app
+    app = nuancier.app.create_app(args.config)
+    if not app.config.get('NUANCIER_TEMPLATE_CACHE_FOLDER'):
+        raise nuancierlib.NuancierException(
+            'NUANCIER_TEMPLATE_CACHE_FOLDER is not set in the configuration')
+    import nuancier.templating
+
+    if args.clear:
+        app.jinja_env.bytecode_cache.clear()
+    cnt = nuancier.templating.precompile(app)
+    print '%s templates compiled in %s' % (
+        cnt, app.config['NUANCIER_TEMPLATE_CACHE_FOLDER'])
+
+
+def parse_arguments(argv=None):
+    ''' Parse the arguments given on the command line. '''
+    parser = argparse.ArgumentParser(
+        prog='nuancier-admin',
+        description='Administrate nuancier')
+    parser.add_argument(
+        '--config',
+        help='Configuration file to use in addition to the one pointed by '
+        'the NUANCIER_CONFIG environment variable.')
+
+    subparsers = parser.add_subparsers(title='actions')
+
+    parser_covotes = subparsers.add_parser(
+        'covotes',
+        help='Compute how many users voted for each pair of candidates of '
+        'a closed election.')
+    parser_covotes.add_argument(
+        'election_id', type=int, help='Identifier of the election.')
+    parser_covotes.set_defaults(func=do_covotes)
+
+    parser_export = subparsers.add_parser(
+        'export',
+        help='Export the anonymized votes, the results or the candidates '
+        'of an election.')
+    parser_export.add_argument(
+        'election_id', type=int, help='Identifier of the election.')
+    parser_export.add_argument(
+        'what', choices=nuancier.lib.export.EXPORTS, help='What to export.')
+    parser_export.add_argument(
+        '--format', choices=nuancier.lib.export.FORMATS, default='csv',
+        help='Format of the export, defaults to CSV.')
+    parser_export.add_argument(
+        '--output', help='File to write the export to, defaults to the '
+        'standard output.')
+    parser_export.set_defaults(func=do_export)
+
+    parser_import = subparsers.add_parser(
+        'import',
+        help='Load as candidates the pictures listed in the infos.txt file '
+        'of the folder of an election and generate their thumbnails.')
+    parser_import.add_argument(
+        'election_id', type=int, help='Identifier of the election.')
+    parser_import.add_argument(
+        '--license', default='CC-BY-SA',
+        help='License of the pictures, defaults to CC-BY-SA.')
+    parser_import.add_argument(
+        '--submitter', required=True,
+        help='User name recorded as the submitter of the candidates.')
+    parser_import.add_argument(
+        '--email', required=True,
+        help='Email address recorded for the submitter of the candidates.')
+    parser_import.add_argument(
+        '--approve', action='store_true', default=False,
+        help='Approve the imported candidates.')
+    parser_import.add_argument(
+        '--processes', type=int, default=multiprocessing.cpu_count(),
+        help='Number of processes in which to check the pictures and '
+        'generate their thumbnails, defaults to the number of CPUs.')
+    parser_import.set_defaults(func=do_import)
+
+    parser_backfill = subparsers.add_parser(
+        'backfill',
+        help='Store the size, format and digest of the pictures and the '
+        'perceptual hash of the candidates of an election submitted before '
+        'they were stored at upload.')
+    parser_backfill.add_argument(
+        'election_id', type=int, help='Identifier of the election.')
+    parser_backfill.set_defaults(func=do_backfill)
+
+    parser_publish = subparsers.add_parser(
+        'publish',
+        help='Render the pages of the closed elections into a static web '
+        'site, only rendering again the elections that changed.')
+    parser_publish.add_argument(
+        'output_dir', help='Directory in which to write the web site.')
+    parser_publish.add_argument(
+        '--base-url', default='http://localhost/',
+        help='URL at which the web site is served.')
+    parser_publish.add_argument(
+        '--pictures', action='store_true', default=False,
+        help='Copy the pictures of the candidates in addition to their '
+        'thumbnails.')
+    parser_publish.add_argument(
+        '--force', action='store_true', default=False,
+        help='Render all the elections again.')
+    parser_publish.set_defaults(func=do_publish)
+
+    parser_compile = subparsers.add_parser(
+        'compile-templates',
+        help='Compile all the templates into the folder set by '
+        'NUANCIER_TEMPLATE_CACHE_FOLDER, to run at deploy time.')
+    parser_compile.add_argument(
+        '--clear', action='store_true', default=False,
+        help='Remove the templates previously compiled first.')
+    parser_compile.set_defaults(func=do_compile_templates)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    ''' Entry point of ``nuancier-admin``. '''
+    args = parse_arguments(argv)
+    config = nuancier.config.load_config(args.config)
+    session = nuancierlib.create_session(config['DB_URL'])
+    try:
+        args.func(session, config, args)
+    except nuancierlib.NuancierException as err:
+        session.rollback()
+        print >> sys.stderr, err
+        return 1
+    finally:
+        session.remove()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+'''
+Loading of the nuancier configuration without requiring Flask.
+'''
+
+import os
+
+import nuancier.default_config
+
+
+def load_config(config_file=None):
+    ''' Return the nuancier configuration as a dict.
+
+    The configuration is made of the default configuration, overridden by
+    the file pointed by the ``NUANCIER_CONFIG`` environment variable and
+    then by the specified configuration file. As with Flask, only the
+    uppercase keys are kept.
+
+    :kwarg config_file: the path to an additional configuration file.
+    '''
+    config = {}
+    for key in dir(nuancier.default_config):
+        if key.isupper():
+            config[key] = getattr(nuancier.default_config, key)
+
+    for filename in (os.environ.get('NUANCIER_CONFIG'), config_file):
+        if not filename:
+            continue
+        values = {'__file__': filename}
+        with open(filename) as stream:
+            exec(compile(stream.read(), filename, 'exec'), values)
+        for key in values:
+            if key.isupper():
+                config[key] = values[key]
+
+    return config
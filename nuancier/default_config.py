@@ -52,14 +52,49 @@ PICTURE_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'pictures')
 # Cache folder
 CACHE_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'cache')
 
+# Where the pictures and their thumbnails are stored: 'local' for the
+# PICTURE_FOLDER and CACHE_FOLDER above, 's3' for the bucket of an
+# S3-compatible object store described by NUANCIER_S3, for example:
+# NUANCIER_S3 = {
+#     'endpoint': 'https://s3.amazonaws.com',
+#     'bucket': 'nuancier',
+#     'access_key': '...',
+#     'secret_key': '...',
+#     'region': 'us-east-1',
+# }
+NUANCIER_STORAGE = 'local'
+NUANCIER_S3 = {}
+
 # Size of the thumbnails (keeping the ratio)
 THUMB_SIZE = (256, 256)
 
+# Maximal size of the version of the pictures shown in the lightbox, keeping
+# the ratio. Set to None to show the original pictures instead.
+DISPLAY_SIZE = (1920, 1920)
+
+# Whether the election and vote pages load the thumbnails from sprite sheets,
+# built by nuancier-worker, and the number of thumbnails per sheet
+NUANCIER_SPRITES = False
+NUANCIER_SPRITE_CELLS = 100
+
+# Whether the thumbnails of each election are stored in a single pack file
+# rather than in one file each
+NUANCIER_THUMBNAIL_PACKS = False
+
 # The default backend for dogpile
 # Options are listed at:
 # http://dogpilecache.readthedocs.org/en/latest/api.html  (backend section)
 NUANCIER_CACHE_BACKEND = 'dogpile.cache.memory'
 
+# How long, in seconds, the rendered tiles of the candidates are kept in the
+# cache
+NUANCIER_FRAGMENT_CACHE_EXPIRATION = 86400
+
+# The folder in which the processes share the compiled templates, filled at
+# deploy time by `nuancier-admin compile-templates`. When None, each process
+# compiles the templates the first time it renders them.
+NUANCIER_TEMPLATE_CACHE_FOLDER = None
+
 ALLOWED_EXTENSIONS = ['svg', 'png', 'jpeg', 'jpg']
 ALLOWED_MIMETYPES = [
     'image/jpeg',
@@ -70,6 +105,10 @@ ALLOWED_MIMETYPES = [
 PICTURE_MIN_WIDTH = 1600
 PICTURE_MIN_HEIGHT = 1200
 
+# Two candidates whose perceptual hashes (64 bits) differ by at most this
+# number of bits are flagged as possible duplicates on the review page
+NUANCIER_DUPLICATE_DISTANCE = 5
+
 # Flask configuration option
 # Set the maximum size of an upload someone may do, defaults here to 16MB
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024
@@ -84,5 +123,18 @@ NUANCIER_EMAIL_SMTP_SERVER = 'localhost'
 # The email address to send error report to
 NUANCIER_EMAIL_ERROR_TO = 'pingou@pingoured.fr'
 
+# Requests taking longer than this number of seconds are logged as slow,
+# set it to None to disable this logging
+NUANCIER_SLOW_REQUEST_THRESHOLD = 2.0
+# A boolean specifying whether to add the Server-Timing header, giving the
+# time spent processing the request and in the database, to the responses.
+# Every client sees it, only turn it on to debug a deployment.
+NUANCIER_SERVER_TIMING = False
+
+# The folder in which the processes (ie: the uWSGI or gunicorn workers)
+# share their metrics, so that /metrics exports the metrics of all of them.
+# When None, /metrics only exports the metrics of the process answering.
+NUANCIER_METRICS_FOLDER = None
+
 FEDMENU_URL = 'https://apps.fedoraproject.org/fedmenu'
 FEDMENU_DATA_URL = 'https://apps.fedoraproject.org/js/data.js'
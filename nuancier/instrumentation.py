@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+'''
+Per-request timing and SQL query counting for nuancier.
+
+The ``RequestTimer`` WSGI middleware measures each request, while
+SQLAlchemy event hooks count the queries run and the time spent in the
+database during the request being processed by the current thread.
+These measures, as well as the usage of the database pools and of the
+cache, are fed to :mod:`nuancier.metrics`.
+'''
+
+import logging
+import threading
+import time
+
+import sqlalchemy
+from dogpile.cache.api import NO_VALUE
+from dogpile.cache.proxy import ProxyBackend
+from sqlalchemy import event
+
+import nuancier.metrics as metrics
+
+
+LOG = logging.getLogger(__name__)
+
+_LOCAL = threading.local()
+_INSTRUMENTED = []
+
+
+class RequestStats(object):
+    ''' The timing information gathered about a single request. '''
+
+    def __init__(self):
+        self.endpoint = None
+        self.start = time.time()
+        self.duration = None
+        self.queries = 0
+        self.query_time = 0.0
+        # Whether the body of the response is produced while it is sent
+        self.streamed = False
+
+    @property
+    def elapsed(self):
+        ''' Return the time spent on this request so far, in seconds. '''
+        if self.duration is not None:
+            return self.duration
+        return time.time() - self.start
+
+    def stop(self):
+        ''' Mark the end of the request. '''
+        self.duration = time.time() - self.start
+
+    def server_timing(self):
+        ''' Return the value of the ``Server-Timing`` header describing this
+        request.
+        '''
+        return 'app;dur=%.1f, db;dur=%.1f;desc="%s queries"' % (
+            self.elapsed * 1000, self.query_time * 1000, self.queries)
+
+
+def current_stats():
+    ''' Return the RequestStats of the request processed by the current
+    thread, or None outside of a request.
+    '''
+    return getattr(_LOCAL, 'stats', None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    ''' Record when a query starts. '''
+    if current_stats() is not None:
+        conn.info.setdefault('nuancier_query_start', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    ''' Account a finished query to the current request. '''
+    stats = current_stats()
+    starts = conn.info.get('nuancier_query_start')
+    if stats is None or not starts:
+        return
+    stats.queries += 1
+    stats.query_time += time.time() - starts.pop()
+
+
+def _pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    ''' Account a connection taken out of a pool. '''
+    metrics.DB_CHECKOUTS.inc()
+    metrics.DB_CONNECTIONS_CHECKED_OUT.inc()
+
+
+def _pool_checkin(dbapi_connection, connection_record):
+    ''' Account a connection returned to its pool. '''
+    metrics.DB_CONNECTIONS_CHECKED_OUT.dec()
+
+
+def instrument_engines():
+    ''' Listen to the queries run by all the SQLAlchemy engines and to the
+    usage of their pools.
+    '''
+    if _INSTRUMENTED:
+        return
+    engine = sqlalchemy.engine.Engine
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(sqlalchemy.pool.Pool, 'checkout', _pool_checkout)
+    event.listen(sqlalchemy.pool.Pool, 'checkin', _pool_checkin)
+    _INSTRUMENTED.append(True)
+
+
+class CacheMetricsProxy(ProxyBackend):
+    ''' dogpile proxy backend counting the hits and misses of the cache.
+    '''
+
+    def get(self, key):
+        value = self.proxied.get(key)
+        metrics.CACHE_REQUESTS.inc(
+            result='miss' if value is NO_VALUE else 'hit')
+        return value
+
+    def get_multi(self, keys):
+        values = self.proxied.get_multi(keys)
+        for value in values:
+            metrics.CACHE_REQUESTS.inc(
+                result='miss' if value is NO_VALUE else 'hit')
+        return values
+
+
+class _TimedIterable(object):
+    ''' Wrap a streamed body, so that the request is only finished once the
+    body has been sent or the server closes it: the queries run while the
+    body is produced are then accounted to the request.
+    '''
+
+    def __init__(self, iterable, finish):
+        self.iterable = iterable
+        self._finish = finish
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            yield chunk
+        self.finish()
+
+    def finish(self):
+        ''' Finish the request, unless it already is. '''
+        if self._finish is not None:
+            finish, self._finish = self._finish, None
+            finish()
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.finish()
+
+
+class RequestTimer(object):
+    ''' WSGI middleware measuring the duration and the SQL queries of each
+    request.
+
+    The statistics are aggregated per endpoint, the requests slower than the
+    given threshold are logged and, if asked, the statistics are added to
+    the response in a ``Server-Timing`` header.
+
+    A request ends when the application returns, unless the application
+    marks its body as streamed by setting the ``streamed`` attribute of the
+    ``nuancier.stats`` of the environ: the request then ends once its body
+    is sent. The other bodies, files in particular, are handed to the server
+    untouched, so that it can send them with ``sendfile``.
+
+    :param app: the WSGI application
+    :kwarg threshold: the duration, in seconds, above which a request is
+        logged as slow. ``None`` or ``0`` disables the logging.
+    :kwarg header: a boolean specifying whether to add the
+        ``Server-Timing`` header to the responses.
+    :kwarg logger: the logger to report the slow requests to.
+    '''
+    def __init__(self, app, threshold=None, header=False, logger=LOG):
+        self.app = app
+        self.threshold = threshold
+        self.header = header
+        self.logger = logger
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        instrument_engines()
+
+    def __call__(self, environ, start_response):
+        stats = RequestStats()
+        _LOCAL.stats = stats
+        environ['nuancier.stats'] = stats
+
+        def _start_response(status, headers, exc_info=None):
+            ''' Add the Server-Timing header to the response. '''
+            if self.header:
+                headers = list(headers)
+                headers.append(('Server-Timing', stats.server_timing()))
+            return start_response(status, headers, exc_info)
+
+        def _finish():
+            ''' Account the request, once its body has been sent. '''
+            stats.stop()
+            _LOCAL.stats = None
+            self.record(environ, stats)
+
+        try:
+            app_iter = self.app(environ, _start_response)
+        except:
+            _finish()
+            raise
+        if not stats.streamed:
+            # Do not account the time the client takes to read the body
+            _finish()
+            return app_iter
+        return _TimedIterable(app_iter, _finish)
+
+    def record(self, environ, stats):
+        ''' Aggregate the statistics of a finished request and log it if it
+        was slow.
+        '''
+        endpoint = stats.endpoint or 'unknown'
+        with self._lock:
+            count, total, slowest = self.endpoints.get(endpoint, (0, 0.0, 0.0))
+            self.endpoints[endpoint] = (
+                count + 1, total + stats.duration,
+                max(slowest, stats.duration))
+        metrics.REQUEST_DURATION.observe(stats.duration, endpoint=endpoint)
+        metrics.REQUEST_QUERIES.inc(stats.queries, endpoint=endpoint)
+
+        if self.threshold and stats.duration > self.threshold:
+            self.logger.warning(
+                'Slow request: %s %s (%s) took %.3fs, %s queries in %.3fs',
+                environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'),
+                endpoint, stats.duration, stats.queries, stats.query_time)
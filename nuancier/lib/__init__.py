@@ -28,8 +28,13 @@ Backend library for nuancier.
 ## import Image is not
 # pylint: disable=R0912
 
+import base64
+import hashlib
+import heapq
+import io
 import os
 import sys
+import threading
 
 import sqlalchemy
 from sqlalchemy.orm import sessionmaker
@@ -48,10 +53,33 @@ except ImportError:  # pragma: no cover
         print >> sys.stderr, 'Could not import PIL nor Pillow, one of ' \
             'them should be installed'
 
+try:
+    from PIL import features as PIL_FEATURES
+except ImportError:  # pragma: no cover
+    # Old versions of pillow cannot tell which formats they support
+    PIL_FEATURES = None
+
 import nuancier.lib.model
+import nuancier.lib.packs
+import nuancier.lib.storage
+import nuancier.metrics as metrics
 import nuancier.notifications as notifications
 
 
+# Width and height, in pixels, of the placeholders of the pictures
+PLACEHOLDER_SIZE = 16
+# Where, in the cache folder of an election, the display versions of the
+# pictures are stored and their quality
+DISPLAY_FOLDER = 'display'
+DISPLAY_QUALITY = 85
+
+# The columns of the Candidates table describing their picture
+METADATA_FIELDS = (
+    'picture_width', 'picture_height', 'picture_format', 'picture_mode',
+    'picture_size', 'picture_sha256',
+)
+
+
 class NuancierException(Exception):
     """ Generic Exception object used to throw nuancier specific error.
     """
@@ -85,6 +113,31 @@ def create_session(db_url, debug=False, pool_recycle=3600):
     return scopedsession
 
 
+def create_lazy_session(db_url, debug=False, pool_recycle=3600):
+    """ Create the Session object to use to query the database, the engine
+    behind it being only created the first time the database is used.
+
+    :arg db_url: a callable returning the URL used to connect to the
+        database, see ``create_session``.
+    :kwarg debug: a boolean specifying wether we should have the verbose
+        output of sqlalchemy or not.
+    :return a Session that can be used to query the database.
+    """
+    maker = sessionmaker()
+    lock = threading.Lock()
+
+    def session_factory():
+        """ Bind the session maker to its engine on first use. """
+        if maker.kw.get('bind') is None:
+            with lock:
+                if maker.kw.get('bind') is None:
+                    maker.configure(bind=sqlalchemy.create_engine(
+                        db_url(), echo=debug, pool_recycle=pool_recycle))
+        return maker()
+
+    return scoped_session(session_factory)
+
+
 def get_candidates(session, election_id, approved=None):
     """ Return the candidates for a specified election.
 
@@ -270,7 +323,8 @@ def edit_election(session, election, election_name, election_folder,
 def add_candidate(session, candidate_file, candidate_name, candidate_author,
                   candidate_original_url, candidate_license,
                   candidate_submitter, submitter_email,
-                  election_id, user=None):
+                  election_id, user=None, candidate_dhash=None,
+                  metadata=None):
     """ Add a new candidate to the database.
 
     :arg session: session with which to interact with the database
@@ -284,6 +338,12 @@ def add_candidate(session, candidate_file, candidate_name, candidate_author,
     :arg submitter_email: the email address of submitter
     :arg election_id: the identifier of the election this candidate is
             candidate for.
+    :kwarg user: the user adding the candidate.
+    :kwarg candidate_dhash: the perceptual hash of the picture of the
+            candidate.
+    :kwarg metadata: a dictionnary of the information about the picture
+            of the candidate, as returned by ``validate_picture`` and
+            ``get_picture_digest``.
     """
     if not user:
         raise NuancierException('User required to add a new candidate')
@@ -306,6 +366,13 @@ def add_candidate(session, candidate_file, candidate_name, candidate_author,
             % (candidate_file)
         )
 
+    metadata = metadata or {}
+    if metadata.get('picture_sha256') and \
+            nuancier.lib.model.Candidates.by_election_sha256(
+                session, election_id, metadata['picture_sha256']):
+        raise NuancierException(
+            'This picture has already been submitted to this election')
+
     candidate = nuancier.lib.model.Candidates(
         candidate_file=candidate_file,
         candidate_name=candidate_name,
@@ -315,7 +382,10 @@ def add_candidate(session, candidate_file, candidate_name, candidate_author,
         candidate_submitter=candidate_submitter,
         submitter_email=submitter_email,
         election_id=election_id,
+        candidate_dhash=candidate_dhash,
     )
+    for key in METADATA_FIELDS:
+        setattr(candidate, key, metadata.get(key))
     session.add(candidate)
     session.flush()
 
@@ -345,52 +415,225 @@ def add_vote(session, candidate_id, username, value=1):
     session.flush()
 
 
+def validate_picture(filename, mimetype, stream, config):
+    """ Check that the given picture can be a candidate.
+
+    This validation has three layers:
+      - extension of the file provided
+      - MIMETYPE of the file provided
+      - size of the image (``PICTURE_MIN_WIDTH`` x ``PICTURE_MIN_HEIGHT``
+        minimal)
+
+    :arg filename: the name of the file of the picture.
+    :arg mimetype: the MIME type of the picture.
+    :arg stream: a file object from which to read the picture.
+    :arg config: the configuration of nuancier, providing the allowed
+        extensions and MIME types and the minimal size of the pictures.
+    :return: a dictionnary of the ``picture_width``, ``picture_height``,
+        ``picture_format`` and ``picture_mode`` of the picture.
+    """
+    extension = os.path.splitext(filename)[1][1:].lower()
+    if extension not in config.get('ALLOWED_EXTENSIONS', []):
+        raise NuancierException(
+            'The submitted candidate has the file extension "%s" which is '
+            'not an allowed format' % extension)
+
+    mimetype = (mimetype or '').lower()
+    if mimetype not in config.get(
+            'ALLOWED_MIMETYPES', []):  # pragma: no cover
+        raise NuancierException(
+            'The submitted candidate has the MIME type "%s" which is '
+            'not an allowed MIME type' % mimetype)
+
+    try:
+        image = Image.open(stream)
+    except:
+        raise NuancierException(
+            'The submitted candidate could not be opened as an Image')
+    width, height = image.size
+    min_width = config.get('PICTURE_MIN_WIDTH', 1600)
+    min_height = config.get('PICTURE_MIN_HEIGHT', 1200)
+    if width < min_width:
+        raise NuancierException(
+            'The submitted candidate has a width of %s pixels which is lower'
+            ' than the minimum %s pixels required' % (width, min_width))
+    if height < min_height:
+        raise NuancierException(
+            'The submitted candidate has a height of %s pixels which is lower'
+            ' than the minimum %s pixels required' % (height, min_height))
+
+    return dict(
+        picture_width=width,
+        picture_height=height,
+        picture_format=image.format,
+        picture_mode=image.mode,
+    )
+
+
+def get_picture_digest(stream):
+    """ Return a dictionnary of the ``picture_size``, in bytes, and of the
+    ``picture_sha256`` hexadecimal digest of the given picture.
+
+    :arg stream: a file object from which to read the picture.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: stream.read(64 * 1024), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    return dict(picture_size=size, picture_sha256=digest.hexdigest())
+
+
+def get_picture_metadata(path):
+    """ Return a dictionnary of the information about the given picture
+    stored with the candidates, as returned by ``validate_picture`` and
+    ``get_picture_digest``.
+
+    :arg path: the path to the picture.
+    """
+    try:
+        with open(path, 'rb') as stream:
+            image = Image.open(stream)
+            metadata = dict(
+                picture_width=image.size[0],
+                picture_height=image.size[1],
+                picture_format=image.format,
+                picture_mode=image.mode,
+            )
+            stream.seek(0)
+            metadata.update(get_picture_digest(stream))
+    except IOError:
+        raise NuancierException('Cannot read the picture "%s"' % path)
+    return metadata
+
+
+def thumbnail_size(width, height, size):
+    """ Return the width and height of the thumbnail of a picture of the
+    given width and height, as generated by ``generate_thumbnail``.
+
+    :arg width: the width of the picture.
+    :arg height: the height of the picture.
+    :arg size: the maximal width and height of the thumbnail.
+    """
+    max_width, max_height = size
+    if width > max_width:
+        height = int(max(height * max_width / width, 1))
+        width = int(max_width)
+    if height > max_height:
+        width = int(max(width * max_height / height, 1))
+        height = int(max_height)
+    return width, height
+
+
+def get_display_path(filename):
+    """ Return the path of the display version of the given picture,
+    relative to the cache folder, as generated by ``generate_thumbnail``.
+
+    :arg filename: the path of the picture, relative to the picture folder.
+    """
+    folder, name = os.path.split(filename)
+    return os.path.join(folder, DISPLAY_FOLDER, name + '.jpg')
+
+
+def _flatten(image):
+    """ Return the given picture in RGB, with its transparent parts laid
+    over a white background, ready to be saved as a JPEG.
+    """
+    if image.mode == 'RGB':
+        return image
+    if 'A' not in image.mode and 'transparency' not in image.info:
+        return image.convert('RGB')
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.split()[3])
+    return background
+
+
+def _save_image(image, storage, path, fmt, **params):
+    """ Store the given picture in the storage, encoded in the given format.
+    """
+    stream = io.BytesIO()
+    image.save(stream, fmt, **params)
+    stream.seek(0)
+    storage.put(path, stream)
+
+
 def generate_thumbnail(filename, picture_folder, cache_folder,
-                       size=(128, 128)):
+                       size=(128, 128), display_size=None):
     """ Generate the thumbnail of the given picture of the picture_folder
     in the cache_folder and at the specified size.
 
     :arg filename:
-    :arg picture_folder:
-    :arg cache_folder
+    :arg picture_folder: the folder of the pictures, or their storage, see
+        ``nuancier.lib.storage``.
+    :arg cache_folder: the folder of the thumbnails, or their storage.
     :kwarg size:
+    :kwarg display_size: if set, the maximal width and height of the
+        version of the picture shown in the lightbox, saved as a JPEG in
+        the ``display`` sub-folder of the cache_folder, see
+        ``get_display_path``.
+    :return: the placeholder of the picture, see ``make_placeholder``.
     """
-    infile = os.path.join(picture_folder, filename)
-    outfile = os.path.join(cache_folder, filename)
+    pictures = nuancier.lib.storage.as_storage(picture_folder)
+    cache = nuancier.lib.storage.as_storage(cache_folder)
     try:
-        image = Image.open(infile)
-        image.thumbnail(size, Image.ANTIALIAS)
-        image.save(outfile)
-    except (IOError, IndexError) as err:  # pragma: no cover
+        with metrics.THUMBNAIL_DURATION.time():
+            image = Image.open(pictures.open(filename))
+            # The thumbnails are in the format of their extension
+            Image.init()
+            fmt = Image.EXTENSION.get(
+                os.path.splitext(filename)[1].lower(), image.format)
+            if display_size is None:
+                image.thumbnail(size, Image.ANTIALIAS)
+                _save_image(image, cache, filename, fmt)
+                return make_placeholder(image)
+
+            # Decode the picture only once: the thumbnail is made from the
+            # display version, at the size computed from the original.
+            width, height = image.size
+            image.thumbnail(display_size, Image.ANTIALIAS)
+            _save_image(
+                _flatten(image), cache, get_display_path(filename), 'JPEG',
+                quality=DISPLAY_QUALITY, optimize=True, progressive=True)
+            thumbnail = image.resize(
+                thumbnail_size(width, height, size), Image.ANTIALIAS)
+            _save_image(thumbnail, cache, filename, fmt)
+            return make_placeholder(thumbnail)
+    except (IOError, IndexError, OSError) as err:  # pragma: no cover
         print >> sys.stderr, "Cannot create thumbnail", err
-        raise NuancierException('Cannot create thumbnail for "%s"' % infile)
+        raise NuancierException('Cannot create thumbnail for "%s"' % (
+            os.path.join(getattr(pictures, 'root', ''), filename)))
 
 
-def generate_cache(session, election, picture_folder, cache_folder,
-                   size=(128, 128)):
-    """ Generate the cache of the picture for a given election.
-    This function reads all the file in the picture_folder, finds in it the
-    file ``infos.txt`` containing for each picture in the folder their name
-    and loads this information in the database.
-    At the same time, it generate a small thumbnail of the picture into the
-    cache folder for faster loading of the overview page.
-
-    The file ``infos.txt`` should have the following layout:
-
-    ::
+def make_placeholder(image):
+    """ Return a tiny, blurry version of the given picture, as a ``data:``
+    URL to inline in the pages while the thumbnail is loading.
 
-        filename1    author name1    image name 1
-        filename2    author name2    image name 2
-        filename3    author name3    image name 3
-        ...
-
-    The character delimiting the values is a tabulation (tab, \t).
+    :arg image: the picture, or its thumbnail, as a PIL Image.
+    """
+    image = image.copy()
+    image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.ANTIALIAS)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.mode else 'RGB')
+    fmt, mimetype = 'PNG', 'image/png'
+    if PIL_FEATURES is not None and PIL_FEATURES.check('webp'):
+        fmt, mimetype = 'WEBP', 'image/webp'
+    stream = io.BytesIO()
+    image.save(stream, fmt, quality=40)
+    return 'data:%s;base64,%s' % (
+        mimetype, base64.b64encode(stream.getvalue()))
+
+
+def get_election_folders(election, picture_folder, cache_folder):
+    """ Return the folder containing the pictures of the given election and
+    the folder in which to store their thumbnails, creating the latter if
+    needed.
 
-    :arg session:
-    :arg election_id:
-    :arg picture_folder:
-    :arg cache_folder:
-    :kwarg size:
+    :arg election:
+    :arg picture_folder: the folder containing the folders of the pictures
+        of all the elections.
+    :arg cache_folder: the folder containing the folders of the thumbnails
+        of all the elections.
     """
     picture_folder = os.path.join(picture_folder, election.election_folder)
 
@@ -419,24 +662,116 @@ def generate_cache(session, election, picture_folder, cache_folder,
     if not os.path.exists(cache_folder):
         os.makedirs(cache_folder)
 
+    return picture_folder, cache_folder
+
+
+def get_election_storages(election, picture_folder, cache_folder):
+    """ Return the storage of the pictures of the given election and the
+    storage of their thumbnails. On the local filesystem, the folders are
+    checked and created as by ``get_election_folders``.
+
+    :arg election:
+    :arg picture_folder: the folder, or the storage, of the pictures of all
+        the elections.
+    :arg cache_folder: the folder, or the storage, of the thumbnails of all
+        the elections.
+    """
+    pictures = nuancier.lib.storage.as_storage(picture_folder)
+    cache = nuancier.lib.storage.as_storage(cache_folder)
+    local = nuancier.lib.storage.LocalStorage
+    if isinstance(pictures, local) and isinstance(cache, local):
+        picture_folder, cache_folder = get_election_folders(
+            election, pictures.root, cache.root)
+        return local(picture_folder), local(cache_folder)
+    return pictures.subfolder(election.election_folder), \
+        cache.subfolder(election.election_folder)
+
+
+def generate_cache(session, election, picture_folder, cache_folder,
+                   size=(128, 128), display_size=None, pack=False):
+    """ Generate the cache of the picture for a given election.
+    This function generates a small thumbnail of the picture of each
+    candidate of the election into the cache folder for faster loading of
+    the overview page.
+
+    To load the pictures listed in the ``infos.txt`` file of the folder of
+    the election as candidates, see ``nuancier.lib.importer``.
+
+    :arg session:
+    :arg election_id:
+    :arg picture_folder: the folder, or the storage, of the pictures of all
+        the elections.
+    :arg cache_folder: the folder, or the storage, of the thumbnails of all
+        the elections.
+    :kwarg size:
+    :kwarg display_size: the maximal size of the version of the pictures
+        shown in the lightbox, none is generated if it is None.
+    :kwarg pack: whether to store the thumbnails in the pack of the
+        election, see ``nuancier.lib.packs``, which needs them to be on
+        the local filesystem.
+    """
+    pictures, cache = get_election_storages(
+        election, picture_folder, cache_folder)
+    if pack and not isinstance(cache, nuancier.lib.storage.LocalStorage):
+        raise NuancierException(
+            'The thumbnails can only be packed on the local filesystem')
+
     candidates = nuancier.lib.model.Candidates.by_election(
         session, election.id)
 
     exceptions = []
     for candidate in candidates:
         try:
-            generate_thumbnail(
+            candidate.candidate_placeholder = generate_thumbnail(
                 candidate.candidate_file,
-                picture_folder,
-                cache_folder,
-                size)
+                pictures,
+                cache,
+                size,
+                display_size)
         except NuancierException, err:  # pragma: no cover
             exceptions.append(err.message)
 
+    session.flush()
+
+    if pack:
+        nuancier.lib.packs.build_pack(
+            cache.root,
+            [candidate.candidate_file for candidate in candidates])
+
     if exceptions:  # pragma: no cover
         raise NuancierMultiExceptions(exceptions)
 
 
+def backfill_metadata(session, election, picture_folder):
+    """ Store the information about the picture of the candidates of the
+    given election which were submitted before it was stored at upload.
+
+    :arg session:
+    :arg election:
+    :arg picture_folder:
+    :return: the number of candidates updated and the list of the errors
+        met.
+    """
+    cnt = 0
+    errors = []
+    for candidate in nuancier.lib.model.Candidates.by_election(
+            session, election.id):
+        if candidate.picture_sha256:
+            continue
+        try:
+            metadata = get_picture_metadata(os.path.join(
+                picture_folder, election.election_folder,
+                candidate.candidate_file))
+        except NuancierException as err:
+            errors.append(err.message)
+            continue
+        for key in METADATA_FIELDS:
+            setattr(candidate, key, metadata[key])
+        cnt += 1
+    session.flush()
+    return cnt, errors
+
+
 def get_stats(session, election_id):
     """ Return a dictionnary containing a number of statistics for the
     specified election.
@@ -444,50 +779,110 @@ def get_stats(session, election_id):
     :arg session:
     :arg election_id:
     """
+    # NumPy is slow to import, only load it when statistics are needed
+    import nuancier.lib.tally
+
     election = get_election(session, election_id)
-    votes = nuancier.lib.model.Votes.cnt_votes(session, election_id)
-    voters = nuancier.lib.model.Votes.cnt_voters(session, election_id)
-    results = nuancier.lib.model.Votes.by_election(session, election_id)
-
-    # Count the number of votes for each participant
-    user_votes = {}
-    for vote in results:
-        if vote.user_name in user_votes:
-            user_votes[vote.user_name] += 1
-        else:
-            user_votes[vote.user_name] = 1
-
-    # Invert the dictionnary
-    votes_user = {}
-    for user in user_votes:
-        if user_votes[user] in votes_user:
-            votes_user[user_votes[user]] += 1
-        else:
-            votes_user[user_votes[user]] = 1
-
-    data = [[key, votes_user[key]] for key in votes_user]
+    tally = nuancier.lib.tally.Tally.from_election(session, election_id)
 
     # Retrieve the list of authors
     authors = set(
         [cand.candidate_author for cand in election.candidates_approved])
 
     # Get the distribution of votes per candidate
-    election_results = get_results(session, election_id)
-    data2 = []
-    cnt = 0
-    for result in election_results:
-        cnt += 1
-        data2.append([cnt, int(result[1])])
+    data2 = [
+        [cnt + 1, total]
+        for cnt, (_, total) in enumerate(tally.ranking())
+    ]
 
     return dict(
-        votes=votes,
-        voters=voters,
-        data=data,
+        votes=tally.total(),
+        voters=tally.n_voters,
+        data=tally.votes_per_voter(),
         authors=authors,
         data2=data2,
     )
 
 
+def build_covotes(session, election):
+    """ Compute and store how many users voted for each pair of candidates
+    of the specified election. The election must be closed, so that the
+    votes no longer change.
+
+    :arg session:
+    :arg election:
+    :return: the number of pairs of candidates stored.
+    """
+    if not election.election_public:
+        raise NuancierException(
+            'The election "%s" is not closed yet' % election.election_name)
+
+    import nuancier.lib.tally
+
+    tally = nuancier.lib.tally.Tally.from_election(session, election.id)
+    nuancier.lib.model.Covotes.delete_election(session, election.id)
+    rows = []
+    cnt = 0
+    for candidate_id, other_candidate_id, count in tally.covotes():
+        rows.append(dict(
+            election_id=election.id,
+            candidate_id=candidate_id,
+            other_candidate_id=other_candidate_id,
+            count=count,
+        ))
+        if len(rows) >= 10000:
+            session.execute(
+                nuancier.lib.model.Covotes.__table__.insert(), rows)
+            cnt += len(rows)
+            rows = []
+    if rows:
+        session.execute(nuancier.lib.model.Covotes.__table__.insert(), rows)
+        cnt += len(rows)
+    session.flush()
+    return cnt
+
+
+def get_similar_candidates(session, election_id, limit=5):
+    """ Return, for each candidate of the specified election, the candidates
+    the most often voted for together with it, based on the co-votes stored
+    by ``build_covotes``.
+
+    The similarity of two candidates is the number of users who voted for
+    both divided by the number of users who voted for either of them.
+
+    :arg session:
+    :arg election_id:
+    :kwarg limit: the number of similar candidates returned per candidate.
+    :return: a dictionnary associating to the identifier of each candidate
+        a list of ``(other_candidate_id, count, similarity)``, from the most
+        similar candidate to the least.
+    """
+    votes = nuancier.lib.model.Votes.cnt_per_candidate(session, election_id)
+
+    # Keep the `limit` most similar candidates of each candidate in a heap
+    similar = {}
+    for candidate_id, other_candidate_id, count in \
+            nuancier.lib.model.Covotes.by_election(session, election_id):
+        similarity = float(count) / (
+            votes[candidate_id] + votes[other_candidate_id] - count)
+        for first, second in [(candidate_id, other_candidate_id),
+                              (other_candidate_id, candidate_id)]:
+            heap = similar.setdefault(first, [])
+            entry = (similarity, count, -second)
+            if len(heap) < limit:
+                heapq.heappush(heap, entry)
+            elif heap and entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+    return dict(
+        (candidate_id, [
+            (-other, count, similarity)
+            for similarity, count, other in sorted(heap, reverse=True)
+        ])
+        for candidate_id, heap in similar.items()
+    )
+
+
 def get_contributions(session, submitter):
     """ Return the list of contributions that have been denied and that
     were made by the specified submitter.
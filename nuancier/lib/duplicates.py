@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+'''
+Detection of the near-duplicate candidates of an election.
+
+Each picture is summarized by its difference hash (dHash): the picture is
+reduced to a 9x8 grey-scale image and each of the 64 bits of the hash says
+whether a pixel is brighter than its right neighbour. Two pictures which
+look the same, even once resized, re-encoded or slightly retouched, have
+hashes differing by only a few bits.
+
+The hashes of the candidates of an election are kept in a BK-tree, which
+finds all the hashes within a given Hamming distance of a picture without
+comparing it to every candidate.
+'''
+
+import os
+import threading
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    # This is for the old versions not using pillow
+    import Image
+
+import nuancier.lib
+import nuancier.lib.model
+
+
+# Width and height of the grid of differences making the hash
+HASH_SIZE = 8
+
+
+def dhash(stream):
+    """ Return the difference hash of the given picture, as a string of 16
+    hexadecimal digits.
+
+    :arg stream: a file object, or the path of a file, from which to read
+        the picture.
+    """
+    try:
+        image = Image.open(stream)
+        # Let the JPEG decoder skip most of the pixels
+        image.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+        image = image.convert('L').resize(
+            (HASH_SIZE + 1, HASH_SIZE), Image.ANTIALIAS)
+    except (IOError, IndexError, ValueError):
+        raise nuancier.lib.NuancierException(
+            'The submitted candidate could not be read as an Image')
+
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (
+                pixels[offset + col] > pixels[offset + col + 1])
+    return '%016x' % value
+
+
+def distance(hash1, hash2):
+    """ Return the number of bits differing between two hashes.
+
+    :arg hash1: a hash as an integer.
+    :arg hash2: a hash as an integer.
+    """
+    return bin(hash1 ^ hash2).count('1')
+
+
+class BKTree(object):
+    """ A Burkhard-Keller tree of hashes, using the Hamming distance.
+
+    Each node keeps its children by their distance to it, so that a search
+    only visits the children whose distance is within the searched distance
+    of the distance between the node and the searched hash.
+    """
+
+    def __init__(self):
+        """ Create an empty tree. """
+        # A node is [hash, items, {distance: child}]
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        """ Add an item to the tree.
+
+        :arg value: the hash of the item, as an integer.
+        :arg item: the item.
+        """
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+
+        node = self.root
+        while True:
+            dist = distance(value, node[0])
+            if dist == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """ Return the ``(distance, item)`` of the items whose hash is within
+        the given distance of the given hash, from the closest to the
+        farthest.
+
+        :arg value: the hash searched, as an integer.
+        :arg max_distance: the maximal number of bits differing.
+        """
+        found = []
+        if self.root is None:
+            return found
+
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            dist = distance(value, node[0])
+            if dist <= max_distance:
+                found.extend((dist, item) for item in node[1])
+            for child_dist, child in node[2].iteritems():
+                if dist - max_distance <= child_dist <= dist + max_distance:
+                    nodes.append(child)
+        found.sort()
+        return found
+
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_index(session, election_id):
+    """ Return the BK-tree of the hashes of the candidates of the specified
+    election, the items of the tree being the identifiers of the
+    candidates.
+
+    The trees are kept in memory, and built again when the candidates of
+    the election change.
+
+    :arg session:
+    :arg election_id:
+    """
+    version = tuple(nuancier.lib.model.Candidates.dhashes_version(
+        session, election_id))
+    with _INDEXES_LOCK:
+        cached = _INDEXES.get(election_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    tree = BKTree()
+    for candidate_id, value in \
+            nuancier.lib.model.Candidates.dhashes_by_election(
+                session, election_id):
+        tree.add(int(value, 16), candidate_id)
+    with _INDEXES_LOCK:
+        _INDEXES[election_id] = (version, tree)
+    return tree
+
+
+def find_duplicates(session, election_id, candidates, max_distance):
+    """ Return, for the given candidates of the specified election, the
+    other candidates of the election whose picture looks the same.
+
+    :arg session:
+    :arg election_id:
+    :arg candidates: the candidates for which to look for duplicates.
+    :arg max_distance: the maximal number of bits by which the hashes of
+        two duplicates differ.
+    :return: a dictionnary associating to the identifier of each candidate
+        having duplicates a list of ``(distance, other_candidate_id)``.
+    """
+    tree = get_index(session, election_id)
+    duplicates = {}
+    for candidate in candidates:
+        if not candidate.candidate_dhash:
+            continue
+        found = [
+            (dist, other_id)
+            for dist, other_id in tree.search(
+                int(candidate.candidate_dhash, 16), max_distance)
+            if other_id != candidate.id
+        ]
+        if found:
+            duplicates[candidate.id] = found
+    return duplicates
+
+
+def backfill(session, election, picture_folder):
+    """ Compute the hash of the candidates of the given election which do
+    not have one yet.
+
+    :arg session:
+    :arg election:
+    :arg picture_folder:
+    :return: the number of candidates updated and the list of the errors
+        met.
+    """
+    cnt = 0
+    errors = []
+    for candidate in nuancier.lib.model.Candidates.by_election(
+            session, election.id):
+        if candidate.candidate_dhash:
+            continue
+        path = os.path.join(
+            picture_folder, election.election_folder,
+            candidate.candidate_file)
+        try:
+            candidate.candidate_dhash = dhash(path)
+        except nuancier.lib.NuancierException as err:
+            errors.append('%s: %s' % (candidate.candidate_file, err))
+            continue
+        cnt += 1
+    session.flush()
+    return cnt, errors
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+
+'''
+Streaming export of the votes, results and candidates of an election.
+
+The rows are fetched from the database a batch at a time and the export
+is produced as a generator of text chunks, so that the memory used stays
+the same whatever the number of votes of the election.
+'''
+
+import csv
+import hashlib
+import hmac
+import io
+import json
+import os
+
+import nuancier.lib
+import nuancier.lib.model
+
+
+EXPORTS = ('votes', 'results', 'candidates')
+FORMATS = ('csv', 'ndjson')
+MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+BATCH = 1000
+
+
+def iter_votes(session, election_id):
+    """ Yield the votes of the specified election, anonymized.
+
+    The name of the voters is replaced by a pseudonym, which is the same for
+    all the votes of a user within an export but differs from one export
+    to another.
+
+    :arg session:
+    :arg election_id:
+    """
+    key = os.urandom(16)
+    votes = nuancier.lib.model.Votes.by_election(
+        session, election_id,
+        columns=(nuancier.lib.model.Votes.user_name,
+                 nuancier.lib.model.Votes.candidate_id,
+                 nuancier.lib.model.Votes.value),
+        yield_per=BATCH)
+    for user_name, candidate_id, value in votes:
+        yield (
+            ('voter', hmac.new(
+                key, user_name.encode('utf-8'), hashlib.sha1
+            ).hexdigest()[:16]),
+            ('candidate_id', candidate_id),
+            ('value', value),
+        )
+
+
+def iter_results(session, election_id):
+    """ Yield the results of the approved candidates of the specified
+    election, from the candidate with the most votes to the one with the
+    least.
+
+    :arg session:
+    :arg election_id:
+    """
+    tallies = nuancier.lib.model.Candidates.tallies_by_election(
+        session, election_id, yield_per=BATCH)
+    for rank, (candidate, votes, voters) in enumerate(tallies):
+        yield (
+            ('rank', rank + 1),
+            ('candidate_id', candidate.id),
+            ('name', candidate.candidate_name),
+            ('author', candidate.candidate_author),
+            ('votes', int(votes)),
+            ('voters', voters),
+        )
+
+
+def iter_candidates(session, election_id):
+    """ Yield the information about the candidates of the specified
+    election, leaving out the email address of their submitter.
+
+    :arg session:
+    :arg election_id:
+    """
+    candidates = nuancier.lib.model.Candidates.by_election(
+        session, election_id, yield_per=BATCH)
+    for candidate in candidates:
+        yield (
+            ('candidate_id', candidate.id),
+            ('file', candidate.candidate_file),
+            ('name', candidate.candidate_name),
+            ('author', candidate.candidate_author),
+            ('original_url', candidate.candidate_original_url),
+            ('license', candidate.candidate_license),
+            ('submitter', candidate.candidate_submitter),
+            ('approved', candidate.approved),
+            ('date_created', candidate.date_created.isoformat()),
+        )
+
+
+ITERATORS = {
+    'votes': iter_votes,
+    'results': iter_results,
+    'candidates': iter_candidates,
+}
+
+
+def _to_csv(rows):
+    """ Convert the rows into CSV, preceded by a header line. """
+    stream = io.BytesIO()
+    writer = csv.writer(stream)
+    cnt = 0
+    for row in rows:
+        if cnt == 0:
+            writer.writerow([key for key, _ in row])
+        writer.writerow([
+            value.encode('utf-8') if isinstance(value, unicode) else value
+            for _, value in row
+        ])
+        cnt += 1
+        if cnt % BATCH == 0:
+            yield stream.getvalue()
+            stream.seek(0)
+            stream.truncate()
+    if stream.tell():
+        yield stream.getvalue()
+
+
+def _to_ndjson(rows):
+    """ Convert the rows into JSON objects, one per line. """
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(
+            dict(row), sort_keys=True, separators=(',', ':')))
+        if len(chunk) == BATCH:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+def export(session, election_id, what, fmt):
+    """ Return a generator producing the export of the specified data of an
+    election in the specified format.
+
+    :arg session:
+    :arg election_id:
+    :arg what: what to export, one of ``EXPORTS``.
+    :arg fmt: the format of the export, one of ``FORMATS``.
+    """
+    if what not in ITERATORS:
+        raise nuancier.lib.NuancierException(
+            'Cannot export "%s", only %s can be' % (what, ', '.join(EXPORTS)))
+    if fmt not in FORMATS:
+        raise nuancier.lib.NuancierException(
+            'Unknown export format "%s"' % fmt)
+
+    rows = ITERATORS[what](session, election_id)
+    if fmt == 'csv':
+        return _to_csv(rows)
+    return _to_ndjson(rows)
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+'''
+Bulk import of the candidates of an election from its ``infos.txt``.
+
+The folder of the pictures of an election may contain a file ``infos.txt``
+describing, one per line, the pictures to load as candidates::
+
+    filename1    author name1    image name 1
+    filename2    author name2    image name 2
+    ...
+
+The character delimiting the values is a tabulation (tab, \t). The file is
+read line by line, the pictures are validated, then the thumbnails of those
+which are not duplicates are generated, both in a pool of processes, and
+the valid pictures are inserted in the database in a single batch.
+'''
+
+import codecs
+import itertools
+import mimetypes
+import os
+
+import nuancier.lib
+import nuancier.lib.duplicates
+import nuancier.lib.model
+import nuancier.lib.packs
+
+
+# The configuration keys needed to validate the pictures
+VALIDATION_KEYS = [
+    'ALLOWED_EXTENSIONS', 'ALLOWED_MIMETYPES',
+    'PICTURE_MIN_WIDTH', 'PICTURE_MIN_HEIGHT',
+]
+
+
+def read_infos(path):
+    """ Return an iterator over the ``(line number, filename, author,
+    name)`` described in the given ``infos.txt`` file, or over
+    ``(line number, None, None, error)`` for the lines which could not be
+    read. Empty lines and lines starting with ``#`` are skipped.
+
+    :arg path: the path to the ``infos.txt`` file.
+    """
+    with codecs.open(path, encoding='utf-8') as stream:
+        for lineno, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = [field.strip() for field in line.split('\t')]
+            fields = [field for field in fields if field]
+            if len(fields) != 3:
+                yield lineno, None, None, (
+                    'Line %s: expected a filename, an author and a name '
+                    'separated by tabulations' % lineno)
+                continue
+            filename, author, name = fields
+            if max(len(field) for field in fields) > 255:
+                yield lineno, None, None, (
+                    'Line %s: the values are limited to 255 characters'
+                    % lineno)
+                continue
+            if os.path.basename(filename) != filename:
+                yield lineno, None, None, (
+                    'Line %s: "%s" is not the name of a file of the '
+                    'folder' % (lineno, filename))
+                continue
+            yield lineno, filename, author, name
+
+
+def _inspect_picture(task):
+    """ Validate one picture and read its digests, in a process of the
+    pool, and return the line of ``infos.txt`` it comes from together with
+    the error met if any and the information about the picture.
+    """
+    lineno, filename, picture_folder, config = task
+    try:
+        path = os.path.join(picture_folder, filename)
+        if not os.path.isfile(path):
+            raise nuancier.lib.NuancierException(
+                'No file "%s" in the folder' % filename)
+        with open(path, 'rb') as stream:
+            metadata = nuancier.lib.validate_picture(
+                filename, mimetypes.guess_type(filename)[0], stream, config)
+            stream.seek(0)
+            metadata.update(nuancier.lib.get_picture_digest(stream))
+            stream.seek(0)
+            metadata['candidate_dhash'] = nuancier.lib.duplicates.dhash(
+                stream)
+    except nuancier.lib.NuancierException as err:
+        return lineno, 'Line %s: %s' % (lineno, err.message), None
+    return lineno, None, metadata
+
+
+def _generate_thumbnail(task):
+    """ Generate the thumbnail of one picture, in a process of the pool,
+    and return the line of ``infos.txt`` it comes from together with the
+    error met if any and the placeholder of the picture.
+    """
+    lineno, filename, picture_folder, cache_folder, size, display_size = task
+    try:
+        placeholder = nuancier.lib.generate_thumbnail(
+            filename, picture_folder, cache_folder, size, display_size)
+    except nuancier.lib.NuancierException as err:
+        return lineno, 'Line %s: %s' % (lineno, err.message), None
+    return lineno, None, placeholder
+
+
+def import_candidates(session, election, picture_folder, cache_folder,
+                      config, candidate_license, submitter, submitter_email,
+                      approved=False, pool=None):
+    """ Load as candidates of the given election the pictures listed in the
+    ``infos.txt`` file of its folder, generating their thumbnails at the
+    same time.
+
+    The pictures already candidates of the election are skipped, so that
+    the import can be run again after fixing the pictures which failed, and
+    the pictures identical to a candidate are reported.
+
+    :arg session:
+    :arg election:
+    :arg picture_folder:
+    :arg cache_folder:
+    :arg config: the configuration of nuancier, providing the rules the
+        pictures must follow, the size of the thumbnails and of the
+        version of the pictures shown in the lightbox and whether to pack
+        the thumbnails.
+    :arg candidate_license: the license of the pictures.
+    :arg submitter: the name of the user importing the pictures.
+    :arg submitter_email: the email address of the user importing the
+        pictures.
+    :kwarg approved: whether the imported candidates are approved.
+    :kwarg pool: a ``multiprocessing.Pool`` in which to process the
+        pictures, they are processed one after the other if it is None.
+    :return: the list of the files imported and the list of the errors met.
+    """
+    picture_folder, cache_folder = nuancier.lib.get_election_folders(
+        election, picture_folder, cache_folder)
+    infos = os.path.join(picture_folder, 'infos.txt')
+    if not os.path.isfile(infos):
+        raise nuancier.lib.NuancierException(
+            'No infos.txt file in the folder %s' % picture_folder)
+
+    existing = set()
+    digests = set()
+    for candidate in nuancier.lib.model.Candidates.by_election(
+            session, election.id):
+        existing.add(candidate.candidate_file)
+        if candidate.picture_sha256:
+            digests.add(candidate.picture_sha256)
+    size = tuple(config['THUMB_SIZE'])
+    display_size = config.get('DISPLAY_SIZE')
+    if display_size:
+        display_size = tuple(display_size)
+    rules = dict(
+        (key, config[key]) for key in VALIDATION_KEYS if key in config)
+
+    errors = []
+    pictures = {}
+    checks = []
+    for lineno, filename, author, name in read_infos(infos):
+        if filename is None:
+            errors.append(name)
+        elif filename in existing:
+            continue
+        else:
+            existing.add(filename)
+            pictures[lineno] = (filename, author, name)
+            checks.append((lineno, filename, picture_folder, rules))
+
+    imap = itertools.imap if pool is None else pool.imap
+
+    # The duplicates are left out before any file is generated for them
+    metadatas = {}
+    tasks = []
+    for lineno, error, metadata in imap(_inspect_picture, checks):
+        if error:
+            errors.append(error)
+            continue
+        if metadata['picture_sha256'] in digests:
+            errors.append(
+                'Line %s: this picture has already been submitted to this '
+                'election' % lineno)
+            continue
+        digests.add(metadata['picture_sha256'])
+        metadatas[lineno] = metadata
+        tasks.append(
+            (lineno, pictures[lineno][0], picture_folder, cache_folder,
+             size, display_size))
+
+    rows = []
+    for lineno, error, placeholder in imap(_generate_thumbnail, tasks):
+        if error:
+            errors.append(error)
+            continue
+        filename, author, name = pictures[lineno]
+        row = dict(
+            candidate_file=filename,
+            candidate_name=name,
+            candidate_author=author,
+            candidate_license=candidate_license,
+            candidate_submitter=submitter,
+            submitter_email=submitter_email,
+            election_id=election.id,
+            approved=approved,
+            candidate_placeholder=placeholder,
+        )
+        row.update(metadatas[lineno])
+        rows.append(row)
+
+    if rows:
+        session.execute(
+            nuancier.lib.model.Candidates.__table__.insert(), rows)
+        session.flush()
+
+    if config.get('NUANCIER_THUMBNAIL_PACKS'):
+        nuancier.lib.packs.build_pack(
+            cache_folder,
+            [candidate.candidate_file
+             for candidate in nuancier.lib.model.Candidates.by_election(
+                 session, election.id)])
+
+    return [row['candidate_file'] for row in rows], errors
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+'''
+Queue of the tasks too long to be run while answering a web request.
+
+The web application queues the jobs in the database and ``nuancier-worker``
+claims and runs them, spreading the files of each job over a pool of
+processes and recording the status of every file as it goes, so that the
+progress of a job can be followed from the administration panel.
+'''
+
+import itertools
+import logging
+import time
+
+import sqlalchemy as sa
+
+import nuancier.lib
+import nuancier.lib.model
+import nuancier.lib.packs
+import nuancier.lib.sprites
+import nuancier.lib.storage
+
+
+LOG = logging.getLogger(__name__)
+
+# Type of the job generating the thumbnails of the candidates of an election
+THUMBNAILS = 'thumbnails'
+# Type of the job packing the thumbnails of an election into sprite sheets
+SPRITES = 'sprites'
+
+# Minimal number of seconds between two commits of the progress of a job
+PROGRESS_INTERVAL = 1.0
+
+
+def get_job(session, job_id):
+    """ Return the job corresponding to the provided identifier.
+
+    :arg session:
+    :arg job_id:
+    """
+    return nuancier.lib.model.Jobs.by_id(session, job_id)
+
+
+def enqueue_thumbnails(session, election, user_name, picture_folder,
+                       cache_folder):
+    """ Queue the generation of the thumbnails of all the candidates of the
+    specified election and return the job, or return the job already
+    queued for this election if there is one.
+
+    :arg session:
+    :arg election:
+    :arg user_name: the name of the user queuing the job.
+    :arg picture_folder: the folder, or the storage, of the pictures.
+    :arg cache_folder: the folder, or the storage, of the thumbnails.
+    """
+    # Fail now rather than in the worker if the folders are not usable
+    nuancier.lib.get_election_storages(
+        election, picture_folder, cache_folder)
+
+    # A running job listed the candidates before the new ones were added
+    job = nuancier.lib.model.Jobs.get_pending(
+        session, THUMBNAILS, election.id, statuses=['queued'])
+    if job:
+        return job
+
+    job = nuancier.lib.model.Jobs(
+        job_type=THUMBNAILS,
+        election_id=election.id,
+        user_name=user_name,
+    )
+    for candidate in nuancier.lib.model.Candidates.by_election(
+            session, election.id):
+        job.files.append(
+            nuancier.lib.model.JobFiles(filename=candidate.candidate_file))
+    session.add(job)
+    session.flush()
+    return job
+
+
+def enqueue_sprites(session, election, user_name):
+    """ Queue the packing of the thumbnails of the approved candidates of
+    the specified election into sprite sheets and return the job, or
+    return the job already queued for this election if there is one.
+
+    :arg session:
+    :arg election:
+    :arg user_name: the name of the user queuing the job.
+    """
+    # A running job may have read the candidates before they changed
+    job = nuancier.lib.model.Jobs.get_pending(
+        session, SPRITES, election.id, statuses=['queued'])
+    if job:
+        return job
+
+    job = nuancier.lib.model.Jobs(
+        job_type=SPRITES,
+        election_id=election.id,
+        user_name=user_name,
+    )
+    session.add(job)
+    session.flush()
+    return job
+
+
+def _generate_thumbnail(task):
+    """ Generate one thumbnail, in a process of the pool of the worker, and
+    return the identifier of its file together with the error met if any
+    and the placeholder of the picture.
+    """
+    file_id, filename, pictures, cache, size, display_size = task
+    try:
+        placeholder = nuancier.lib.generate_thumbnail(
+            filename, pictures, cache, size, display_size)
+    except nuancier.lib.NuancierException as err:
+        return file_id, err.message, None
+    except Exception as err:
+        # A bad picture should only fail its own file, not the whole job
+        LOG.exception('Cannot generate the thumbnail of %s', filename)
+        return file_id, '%s: %s' % (err.__class__.__name__, err), None
+    return file_id, None, placeholder
+
+
+def _run_thumbnails(session, job, config, pool):
+    """ Generate the thumbnails of a job queued by ``enqueue_thumbnails``.
+    """
+    pictures, cache = nuancier.lib.get_election_storages(
+        job.election,
+        nuancier.lib.storage.get_storage(
+            config, nuancier.lib.storage.PICTURES),
+        nuancier.lib.storage.get_storage(
+            config, nuancier.lib.storage.CACHE))
+    size = tuple(config['THUMB_SIZE'])
+    display_size = config.get('DISPLAY_SIZE')
+    if display_size:
+        display_size = tuple(display_size)
+
+    # The files already done were processed before the job was requeued
+    files = dict(
+        (jobfile.id, jobfile)
+        for jobfile in job.files
+        if jobfile.status != 'done'
+    )
+    tasks = [
+        (file_id, jobfile.filename, pictures, cache, size, display_size)
+        for file_id, jobfile in files.items()
+    ]
+    if pool is None:
+        results = itertools.imap(_generate_thumbnail, tasks)
+    else:
+        results = pool.imap_unordered(_generate_thumbnail, tasks)
+
+    candidates = dict(
+        (candidate.candidate_file, candidate)
+        for candidate in nuancier.lib.model.Candidates.by_election(
+            session, job.election_id)
+    )
+
+    last_commit = time.time()
+    for file_id, error, placeholder in results:
+        jobfile = files[file_id]
+        jobfile.status = 'failed' if error else 'done'
+        jobfile.message = error
+        candidate = candidates.get(jobfile.filename)
+        if placeholder and candidate:
+            candidate.candidate_placeholder = placeholder
+        if time.time() - last_commit >= PROGRESS_INTERVAL:
+            session.commit()
+            last_commit = time.time()
+
+    if config.get('NUANCIER_THUMBNAIL_PACKS'):
+        if not isinstance(cache, nuancier.lib.storage.LocalStorage):
+            raise nuancier.lib.NuancierException(
+                'The thumbnails can only be packed on the local filesystem')
+        try:
+            nuancier.lib.packs.build_pack(cache.root, candidates)
+        except (IOError, OSError) as err:
+            raise nuancier.lib.NuancierException(
+                'Cannot pack the thumbnails: %s' % err)
+
+    if config.get('NUANCIER_SPRITES'):
+        _run_sprites(session, job, config, pool)
+
+
+def _run_sprites(session, job, config, pool):
+    """ Build the sprite sheets of a job queued by ``enqueue_sprites``, or
+    of the election of a thumbnails job once they are generated.
+    """
+    if config.get('NUANCIER_STORAGE', 'local') != 'local':
+        raise nuancier.lib.NuancierException(
+            'The sprites can only be built on the local filesystem')
+    try:
+        nuancier.lib.sprites.build_sprites(
+            session, job.election, config['CACHE_FOLDER'],
+            tuple(config['THUMB_SIZE']),
+            config.get('NUANCIER_SPRITE_CELLS', 100))
+    except (IOError, OSError) as err:
+        raise nuancier.lib.NuancierException(
+            'Cannot build the sprites: %s' % err)
+
+
+RUNNERS = {
+    THUMBNAILS: _run_thumbnails,
+    SPRITES: _run_sprites,
+}
+
+
+def run_job(session, job, config, pool=None):
+    """ Run the given job, claimed by ``Jobs.claim``, and mark it as done or
+    failed.
+
+    :arg session:
+    :arg job:
+    :arg config: the configuration of nuancier.
+    :kwarg pool: a ``multiprocessing.Pool`` on which to spread the files of
+        the job, they are processed one after the other if it is None.
+    """
+    try:
+        runner = RUNNERS.get(job.job_type)
+        if runner is None:
+            raise nuancier.lib.NuancierException(
+                'Unknown type of job: %s' % job.job_type)
+        runner(session, job, config, pool)
+    except nuancier.lib.NuancierException as err:
+        LOG.exception('Job %s failed', job.id)
+        session.rollback()
+        job.status = 'failed'
+        job.message = err.message
+    except Exception as err:
+        # Never leave the job running, nor kill the worker, on an
+        # unexpected error (database, storage...)
+        LOG.exception('Job %s failed', job.id)
+        session.rollback()
+        job.status = 'failed'
+        job.message = '%s: %s' % (err.__class__.__name__, err)
+    else:
+        if any(jobfile.status == 'failed' for jobfile in job.files):
+            job.status = 'failed'
+            job.message = 'Some files could not be processed'
+        else:
+            job.status = 'done'
+    job.date_finished = sa.func.current_timestamp()
+    session.commit()
+    return job
@@ -23,11 +23,6 @@
 Mapping of python classes to Database Tables.
 '''
 
-## Ignore warning about pkg_resources, it does help us
-# pylint: disable=W0611
-__requires__ = ['SQLAlchemy >= 0.7', 'jinja2 >= 2.4']
-import pkg_resources
-
 import datetime
 import logging
 
@@ -190,6 +185,16 @@ class Elections(BASE):
             Elections.election_date_end.desc()
         ).all()
 
+    @classmethod
+    def last_update(cls, session):
+        """ Return the number of elections and the date of the last change
+        made to one of them.
+        """
+        return session.query(
+            sa.func.count(cls.id),
+            sa.func.max(cls.date_updated)
+        ).one()
+
     @classmethod
     def by_id(cls, session, election_id):
         """ Return the election corresponding to the provided identifier.
@@ -267,6 +272,17 @@ class Candidates(BASE):
     )
     approved = sa.Column(sa.Boolean, default=False, nullable=False)
     approved_motif = sa.Column(sa.Text, nullable=True)
+    # Perceptual hash of the picture, to spot the near-duplicates
+    candidate_dhash = sa.Column(sa.String(16), nullable=True)
+    # Information about the picture, read once when it is submitted
+    picture_width = sa.Column(sa.Integer, nullable=True)
+    picture_height = sa.Column(sa.Integer, nullable=True)
+    picture_format = sa.Column(sa.String(10), nullable=True)
+    picture_mode = sa.Column(sa.String(10), nullable=True)
+    picture_size = sa.Column(sa.Integer, nullable=True)
+    picture_sha256 = sa.Column(sa.String(64), nullable=True)
+    # Tiny version of the picture, shown while the thumbnail loads
+    candidate_placeholder = sa.Column(sa.Text, nullable=True)
 
     date_created = sa.Column(sa.DateTime, nullable=False,
                              default=sa.func.current_timestamp())
@@ -288,7 +304,8 @@ class Candidates(BASE):
 
     def __init__(self, candidate_file, candidate_name, candidate_author,
                  candidate_license, candidate_submitter, submitter_email,
-                 election_id, candidate_original_url=None, approved=False):
+                 election_id, candidate_original_url=None, approved=False,
+                 candidate_dhash=None):
         """ Constructor
 
         :arg candidate_file: the file name of the candidate
@@ -303,6 +320,8 @@ class Candidates(BASE):
             someone else, this should be a link to the original artwork.
         :kwarg approved: a boolean specifying if this candidate is approved
             or not for this election.
+        :kwarg candidate_dhash: the perceptual hash of the picture of the
+            candidate.
         """
         self.candidate_file = candidate_file
         self.candidate_name = candidate_name
@@ -313,6 +332,7 @@ class Candidates(BASE):
         self.candidate_submitter = candidate_submitter
         self.submitter_email = submitter_email
         self.approved = approved
+        self.candidate_dhash = candidate_dhash
 
     def __repr__(self):
         return 'Candidates(file:%r, name:%r, election_id:%r, created:%r' % (
@@ -339,11 +359,16 @@ class Candidates(BASE):
         return session.query(cls).get(candidate_id)
 
     @classmethod
-    def by_election(cls, session, election_id, approved=None):
+    def by_election(cls, session, election_id, approved=None,
+                    yield_per=None):
         """ Return the candidate associated to the given election
         identifier. Filter them if they are approved or not for the
         election.
 
+        If ``yield_per`` is specified, an iterator fetching the candidates
+        ``yield_per`` at a time from the database is returned instead of
+        a list.
+
         """
         query = session.query(
             cls
@@ -358,6 +383,8 @@ class Candidates(BASE):
 
         query = query.order_by(Candidates.date_created)
 
+        if yield_per:
+            return query.yield_per(yield_per)
         return query.all()
 
     @classmethod
@@ -409,6 +436,97 @@ class Candidates(BASE):
         )
         return query.all()
 
+    @classmethod
+    def last_update(cls, session, election_id):
+        """ Return the number of candidates of a given election, the sum of
+        the identifiers of those approved and the date of the last change
+        made to one of them.
+
+        """
+        return session.query(
+            sa.func.count(cls.id),
+            sa.func.sum(sa.case([(cls.approved == True, cls.id)], else_=0)),
+            sa.func.max(cls.date_updated)
+        ).filter(
+            cls.election_id == election_id
+        ).one()
+
+    @classmethod
+    def by_election_sha256(cls, session, election_id, picture_sha256,
+                           exclude_id=None):
+        """ Return the candidate of a given election whose picture has the
+        given SHA-256 digest, if there is one, ignoring the candidate whose
+        identifier is ``exclude_id``.
+
+        """
+        query = session.query(
+            cls
+        ).filter(
+            cls.election_id == election_id
+        ).filter(
+            cls.picture_sha256 == picture_sha256
+        )
+        if exclude_id is not None:
+            query = query.filter(cls.id != exclude_id)
+        return query.first()
+
+    @classmethod
+    def dhashes_by_election(cls, session, election_id):
+        """ Return the ``(id, candidate_dhash)`` of the candidates of a
+        given election whose perceptual hash is known.
+
+        """
+        return session.query(
+            cls.id, cls.candidate_dhash
+        ).filter(
+            cls.election_id == election_id
+        ).filter(
+            cls.candidate_dhash != None
+        ).all()
+
+    @classmethod
+    def dhashes_version(cls, session, election_id):
+        """ Return the number of candidates of a given election whose
+        perceptual hash is known, the sum of their identifiers and the date
+        of the last change made to one of them.
+
+        """
+        return session.query(
+            sa.func.count(cls.id),
+            sa.func.sum(cls.id),
+            sa.func.max(cls.date_updated)
+        ).filter(
+            cls.election_id == election_id
+        ).filter(
+            cls.candidate_dhash != None
+        ).one()
+
+    @classmethod
+    def tallies_by_election(cls, session, election_id, yield_per=1000):
+        """ Return an iterator over the ``(candidate, votes, voters)`` of the
+        approved candidates of a given election, ranked by the number of
+        votes each received. ``votes`` is the sum of the value of the votes
+        and ``voters`` the number of users who voted for the candidate.
+
+        """
+        votes = sa.func.coalesce(sa.func.sum(Votes.value), 0)
+        return session.query(
+            cls,
+            votes.label('votes'),
+            sa.func.count(Votes.user_name).label('voters')
+        ).outerjoin(
+            Votes, Votes.candidate_id == cls.id
+        ).filter(
+            cls.election_id == election_id
+        ).filter(
+            cls.approved == True
+        ).group_by(
+            *cls.__table__.columns
+        ).order_by(
+            votes.desc(),
+            cls.id
+        ).yield_per(yield_per)
+
     @classmethod
     def get_by_submitter(cls, session, submitter, election_id=None):
         """ Return the list of denied submission of the specified submitter
@@ -485,6 +603,24 @@ class Votes(BASE):
             Candidates.election_id == election_id
         ).first()[0]
 
+    @classmethod
+    def tally_version(cls, session, election_id):
+        """ Return the number of votes on the specified election and the date
+        of the last one. As votes are never changed once cast, this changes
+        whenever the results of the election do.
+
+        :arg session:
+        :arg election_id:
+        """
+        return session.query(
+            sa.func.count(cls.user_name),
+            sa.func.max(cls.date_created)
+        ).filter(
+            Votes.candidate_id == Candidates.id
+        ).filter(
+            Candidates.election_id == election_id
+        ).one()
+
     @classmethod
     def cnt_voters(cls, session, election_id,):
         """ Return the votes on the specified election.
@@ -501,19 +637,62 @@ class Votes(BASE):
         ).count()
 
     @classmethod
-    def by_election(cls, session, election_id):
-        """ Return the votes on the specified election.
+    def by_election(cls, session, election_id, columns=None,
+                    yield_per=1000):
+        """ Return an iterator over the votes on the specified election.
+
+        The votes are ordered by user, so the votes of a ballot follow each
+        other, and are fetched from the database ``yield_per`` at a time so
+        that the votes of a large election are never all in memory.
 
         :arg session:
         :arg election_id:
+        :kwarg columns: the columns of the Votes table to return instead of
+            Votes objects.
+        :kwarg yield_per: the number of votes fetched at a time.
         """
         return session.query(
-            cls
+            *(columns or [cls])
         ).filter(
             Votes.candidate_id == Candidates.id
         ).filter(
             Candidates.election_id == election_id
-        ).all()
+        ).order_by(
+            Votes.user_name,
+            Votes.candidate_id
+        ).yield_per(yield_per)
+
+    @classmethod
+    def values_by_election(cls, session, election_id):
+        """ Return the ``(user_name, candidate_id, value)`` of the votes on
+        the specified election, without loading them as Votes objects.
+
+        :arg session:
+        :arg election_id:
+        """
+        return cls.by_election(
+            session, election_id,
+            columns=(cls.user_name, cls.candidate_id, cls.value),
+            yield_per=10000)
+
+    @classmethod
+    def cnt_per_candidate(cls, session, election_id):
+        """ Return a dictionnary of the number of votes, regardless of their
+        value, each candidate of the specified election received.
+
+        :arg session:
+        :arg election_id:
+        """
+        return dict(session.query(
+            cls.candidate_id,
+            sa.func.count(cls.user_name)
+        ).filter(
+            Votes.candidate_id == Candidates.id
+        ).filter(
+            Candidates.election_id == election_id
+        ).group_by(
+            cls.candidate_id
+        ).all())
 
     @classmethod
     def by_election_user(cls, session, election_id, username):
@@ -535,3 +714,247 @@ class Votes(BASE):
         ).order_by(
             Votes.candidate_id
         ).all()
+
+
+class Covotes(BASE):
+    ''' This table lists, for a closed election, how many users voted for
+    each pair of candidates. Only the pairs that received votes are stored
+    and each pair is stored once, ``candidate_id`` being the candidate with
+    the smallest identifier.
+
+    Table -- Covotes
+    '''
+
+    __tablename__ = 'Covotes'
+    election_id = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('Elections.id',
+                      ondelete='CASCADE',
+                      onupdate='CASCADE'
+                      ),
+        nullable=False,
+        index=True,
+    )
+    candidate_id = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('Candidates.id',
+                      ondelete='CASCADE',
+                      onupdate='CASCADE'
+                      ),
+        nullable=False,
+        primary_key=True
+    )
+    other_candidate_id = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('Candidates.id',
+                      ondelete='CASCADE',
+                      onupdate='CASCADE'
+                      ),
+        nullable=False,
+        primary_key=True
+    )
+    count = sa.Column(sa.Integer, nullable=False)
+
+    def __repr__(self):
+        return 'Covotes(candidate_id:%r, other_candidate_id:%r, count:%r)' % (
+            self.candidate_id, self.other_candidate_id, self.count)
+
+    @classmethod
+    def by_election(cls, session, election_id, yield_per=10000):
+        """ Return an iterator over the ``(candidate_id, other_candidate_id,
+        count)`` of the specified election.
+
+        :arg session:
+        :arg election_id:
+        :kwarg yield_per: the number of pairs fetched at a time.
+        """
+        return session.query(
+            cls.candidate_id, cls.other_candidate_id, cls.count
+        ).filter(
+            cls.election_id == election_id
+        ).yield_per(yield_per)
+
+    @classmethod
+    def delete_election(cls, session, election_id):
+        """ Remove the co-votes stored for the specified election.
+
+        :arg session:
+        :arg election_id:
+        """
+        session.query(
+            cls
+        ).filter(
+            cls.election_id == election_id
+        ).delete(synchronize_session=False)
+
+
+class Jobs(BASE):
+    ''' This table lists the tasks queued to be run by ``nuancier-worker``
+    rather than while answering a web request, such as the generation of
+    the thumbnails of an election.
+
+    A job is ``queued`` until a worker claims it, ``running`` while the
+    worker processes it and then either ``done`` or ``failed``.
+
+    Table -- Jobs
+    '''
+
+    __tablename__ = 'Jobs'
+    id = sa.Column(sa.Integer, nullable=False, primary_key=True)
+    job_type = sa.Column(sa.String(50), nullable=False)
+    election_id = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('Elections.id',
+                      ondelete='CASCADE',
+                      onupdate='CASCADE'
+                      ),
+        nullable=True,
+    )
+    user_name = sa.Column(sa.String(50), nullable=False)
+    status = sa.Column(
+        sa.String(20), nullable=False, default='queued', index=True)
+    message = sa.Column(sa.Text, nullable=True)
+
+    date_created = sa.Column(sa.DateTime, nullable=False,
+                             default=sa.func.current_timestamp())
+    date_started = sa.Column(sa.DateTime, nullable=True)
+    date_finished = sa.Column(sa.DateTime, nullable=True)
+
+    election = relation('Elections')
+    files = relation(
+        'JobFiles', backref='job', order_by='JobFiles.id',
+        cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return 'Jobs(id:%r, type:%r, election_id:%r, status:%r)' % (
+            self.id, self.job_type, self.election_id, self.status)
+
+    @property
+    def finished(self):
+        """ Return whether the job is done or failed. """
+        return self.status in ('done', 'failed')
+
+    def api_repr(self):
+        """ Return the status of the job and of its files as a dict. """
+        files = [
+            dict(filename=jobfile.filename, status=jobfile.status,
+                 message=jobfile.message)
+            for jobfile in self.files
+        ]
+        return dict(
+            id=self.id,
+            type=self.job_type,
+            election_id=self.election_id,
+            status=self.status,
+            message=self.message,
+            total=len(files),
+            done=len([item for item in files if item['status'] == 'done']),
+            failed=len(
+                [item for item in files if item['status'] == 'failed']),
+            files=files,
+        )
+
+    @classmethod
+    def by_id(cls, session, job_id):
+        """ Return the job corresponding to the provided identifier. """
+        return session.query(cls).get(job_id)
+
+    @classmethod
+    def get_pending(cls, session, job_type, election_id,
+                    statuses=('queued', 'running')):
+        """ Return the job of the given type, for the given election, which
+        is queued or running, if there is one.
+
+        :arg session:
+        :arg job_type:
+        :arg election_id:
+        :kwarg statuses: the statuses of the jobs to consider.
+        """
+        return session.query(
+            cls
+        ).filter(
+            cls.job_type == job_type
+        ).filter(
+            cls.election_id == election_id
+        ).filter(
+            cls.status.in_(list(statuses))
+        ).order_by(
+            cls.id
+        ).first()
+
+    @classmethod
+    def claim(cls, session):
+        """ Mark the oldest queued job as running and return it, or return
+        None if no job is queued.
+
+        The job is only returned if its status could be changed, so that
+        two workers never run the same job.
+
+        :arg session:
+        """
+        while True:
+            job_id = session.query(
+                cls.id
+            ).filter(
+                cls.status == 'queued'
+            ).order_by(
+                cls.id
+            ).limit(1).scalar()
+            if job_id is None:
+                session.commit()
+                return None
+
+            cnt = session.query(
+                cls
+            ).filter(
+                cls.id == job_id
+            ).filter(
+                cls.status == 'queued'
+            ).update({
+                'status': 'running',
+                'date_started': sa.func.current_timestamp(),
+            }, synchronize_session=False)
+            session.commit()
+            if cnt:
+                return cls.by_id(session, job_id)
+
+    @classmethod
+    def requeue_running(cls, session):
+        """ Queue again the jobs left running, for example by a worker
+        which has been killed, and return their number.
+
+        :arg session:
+        """
+        cnt = session.query(
+            cls
+        ).filter(
+            cls.status == 'running'
+        ).update({'status': 'queued'}, synchronize_session=False)
+        session.commit()
+        return cnt
+
+
+class JobFiles(BASE):
+    ''' This table lists the files processed by a job and their status.
+
+    Table -- JobFiles
+    '''
+
+    __tablename__ = 'JobFiles'
+    id = sa.Column(sa.Integer, nullable=False, primary_key=True)
+    job_id = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('Jobs.id',
+                      ondelete='CASCADE',
+                      onupdate='CASCADE'
+                      ),
+        nullable=False,
+        index=True,
+    )
+    filename = sa.Column(sa.String(255), nullable=False)
+    status = sa.Column(sa.String(20), nullable=False, default='queued')
+    message = sa.Column(sa.Text, nullable=True)
+
+    def __repr__(self):
+        return 'JobFiles(job_id:%r, filename:%r, status:%r)' % (
+            self.job_id, self.filename, self.status)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+'''
+Order in which the candidates of an election are presented to a user.
+
+Each user sees the candidates in a random order of their own, which stays
+the same from one page load to the next. The order is drawn from a private
+``random.Random`` instance seeded from the user name, so that computing it
+never touches the random generator shared by the whole process, and it is
+cached as an array of indexes into the list of approved candidates.
+'''
+
+import array
+import hashlib
+import random
+
+from dogpile.cache.api import NO_VALUE
+
+
+def get_seed(user_name):
+    """ Return the seed of the random order of the candidates for the
+    given user.
+
+    :arg user_name: the name of the user.
+    """
+    if isinstance(user_name, unicode):
+        user_name = user_name.encode('utf-8')
+    return int(hashlib.sha1(user_name).hexdigest(), 16) % 100000
+
+
+def get_permutation(n_candidates, user_name=None):
+    """ Return the order in which the given number of candidates is
+    presented to the user, as an array of indexes.
+
+    :arg n_candidates: the number of candidates to order.
+    :kwarg user_name: the name of the user, the order is drawn at random
+        for every call when it is None.
+    """
+    if user_name:
+        rng = random.Random(get_seed(user_name))
+    else:
+        rng = random.Random()
+    permutation = array.array('i', xrange(n_candidates))
+    rng.shuffle(permutation)
+    return permutation
+
+
+def order_candidates(candidates, user_name=None, region=None):
+    """ Return the given candidates in the order in which they are
+    presented to the user.
+
+    :arg candidates: the approved candidates of an election.
+    :kwarg user_name: the name of the user, the candidates are shuffled
+        at random when it is None.
+    :kwarg region: a dogpile.cache region in which to keep the order of
+        the candidates of each user.
+    """
+    if not candidates:
+        return []
+    if not user_name or region is None:
+        permutation = get_permutation(len(candidates), user_name)
+    else:
+        # The order only depends on the seed and on the set of candidates
+        ids = array.array('i', [candidate.id for candidate in candidates])
+        key = 'order|%s|%s|%s' % (
+            candidates[0].election_id,
+            hashlib.sha1(ids.tostring()).hexdigest(),
+            get_seed(user_name))
+        permutation = region.get(key)
+        if permutation is NO_VALUE:
+            permutation = get_permutation(len(candidates), user_name)
+            region.set(key, permutation)
+    return [candidates[index] for index in permutation]
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+
+'''
+Storage of the thumbnails of an election in a single pack file.
+
+Rather than one file per thumbnail, the thumbnails of an election can be
+packed into the ``thumbnails.pack`` file of its cache folder: a header
+giving the length of the index, the index itself, in JSON, giving the
+offset, from the end of the index, the length and the digest of each
+thumbnail, and the thumbnails one after the other.
+
+The pack is written to a temporary file and renamed over the previous one,
+so that it is replaced atomically, and is read through ``mmap``, which
+saves opening and reading a file per thumbnail. Each thumbnail read is still
+copied out of the mapped file. A thumbnail generated again
+after the pack was built is left in the folder, where it takes precedence
+over its packed copy until the pack is built again.
+'''
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+# The name of the pack in the cache folder of an election
+PACK_FILE = 'thumbnails.pack'
+# The header of a pack: its magic number and the length of its index
+HEADER = struct.Struct('>8sI')
+MAGIC = 'NUANPACK'
+# Minimal number of seconds between two checks that a pack was not replaced
+CHECK_INTERVAL = 1.0
+
+_PACKS = {}
+_PACKS_LOCK = threading.Lock()
+
+
+class FolderLock(object):
+    """ Lock a cache folder between the processes building files in it.
+
+    The folder itself is locked, so that no lock file is left in it.
+
+    :arg folder:
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.handle = None
+
+    def __enter__(self):
+        self.handle = os.open(self.folder, os.O_RDONLY)
+        if fcntl is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+        os.close(self.handle)
+
+
+class Pack(object):
+    """ A pack file, mapped in memory. """
+
+    def __init__(self, path):
+        """ Open and map the pack at the given path.
+
+        :arg path:
+        """
+        self.path = path
+        with open(path, 'rb') as stream:
+            stat = os.fstat(stream.fileno())
+            self.version = (stat.st_ino, stat.st_mtime)
+            self._map = mmap.mmap(
+                stream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, length = HEADER.unpack_from(self._map)
+            if magic != MAGIC:
+                raise ValueError('Not a pack of thumbnails')
+            self._start = HEADER.size + length
+            self.index = json.loads(self._map[HEADER.size:self._start])
+        except (struct.error, ValueError) as err:
+            self._map.close()
+            raise IOError('Cannot read the pack %s: %s' % (path, err))
+        self.checked = time.time()
+
+    def __contains__(self, filename):
+        return filename in self.index
+
+    def get(self, filename):
+        """ Return the content of the given thumbnail, or None if it is not
+        in the pack.
+
+        The content is copied out of the mapped file: the bodies of the WSGI
+        responses must be strings on python 2, ``buffer`` objects are
+        refused by servers such as mod_wsgi or wsgiref.
+
+        :arg filename:
+        """
+        if filename not in self.index:
+            return None
+        offset, length = self.index[filename][:2]
+        offset += self._start
+        return self._map[offset:offset + length]
+
+    def digest(self, filename):
+        """ Return the digest of the given thumbnail, or None if it is not
+        in the pack.
+
+        :arg filename:
+        """
+        if filename not in self.index:
+            return None
+        return self.index[filename][2]
+
+    def close(self):
+        """ Unmap the pack. """
+        self._map.close()
+
+
+def build_pack(folder, filenames):
+    """ Pack the given thumbnails of the cache folder of an election into
+    its pack file, replacing it, and remove the thumbnails packed from the
+    folder.
+
+    The thumbnails not in the folder are taken from the previous pack, if
+    they are in it, so that the pack can be completed with the thumbnails
+    generated since it was built.
+
+    :arg folder: the cache folder of the election.
+    :arg filenames: the thumbnails to pack.
+    :return: the number of thumbnails packed.
+    """
+    # The builds of the worker, of the importer and of generate_cache
+    # would otherwise remove the thumbnails packed by one another
+    with FolderLock(folder):
+        return _build_pack(folder, filenames)
+
+
+def _build_pack(folder, filenames):
+    """ Build the pack of ``build_pack``, once the folder is locked. """
+    path = os.path.join(folder, PACK_FILE)
+    previous = None
+    if os.path.exists(path):
+        previous = Pack(path)
+
+    contents = []
+    packed = []
+    try:
+        for filename in sorted(set(filenames)):
+            infile = os.path.join(folder, filename)
+            if os.path.isfile(infile):
+                with open(infile, 'rb') as stream:
+                    contents.append((filename, stream.read()))
+                packed.append(infile)
+            elif previous is not None and filename in previous:
+                contents.append((filename, previous.get(filename)))
+    finally:
+        if previous is not None:
+            previous.close()
+
+    # The offsets are relative to the end of the index
+    index = {}
+    offset = 0
+    for filename, content in contents:
+        index[filename] = [
+            offset, len(content), hashlib.sha1(content).hexdigest()]
+        offset += len(content)
+    data = json.dumps(index, sort_keys=True)
+
+    handle, tmp_path = tempfile.mkstemp(dir=folder, prefix='.tmp-')
+    try:
+        with os.fdopen(handle, 'wb') as stream:
+            stream.write(HEADER.pack(MAGIC, len(data)))
+            stream.write(data)
+            for _, content in contents:
+                stream.write(content)
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+    for infile in packed:
+        os.unlink(infile)
+    return len(contents)
+
+
+def get_pack(folder):
+    """ Return the pack of the cache folder of an election, or None if it
+    has none.
+
+    The packs are kept open, and opened again when they are replaced.
+
+    :arg folder: the cache folder of the election.
+    """
+    path = os.path.join(folder, PACK_FILE)
+    with _PACKS_LOCK:
+        pack = _PACKS.get(path)
+        now = time.time()
+        if pack is not None and now - pack.checked < CHECK_INTERVAL:
+            return pack
+        try:
+            stat = os.stat(path)
+        except OSError:
+            _PACKS.pop(path, None)
+            return None
+        if pack is not None and pack.version == (stat.st_ino, stat.st_mtime):
+            pack.checked = now
+            return pack
+        # The previous map is left to the requests still reading it
+        pack = _PACKS[path] = Pack(path)
+        return pack
+
+
+def open_thumbnail(folder, filename):
+    """ Return a stream reading the given thumbnail of the cache folder of
+    an election, be it in the folder or in its pack.
+
+    :arg folder: the cache folder of the election.
+    :arg filename:
+    """
+    path = os.path.join(folder, filename)
+    if os.path.isfile(path):
+        return open(path, 'rb')
+    pack = get_pack(folder)
+    if pack is None or filename not in pack:
+        raise IOError('No thumbnail %s in %s' % (filename, folder))
+    return io.BytesIO(pack.get(filename))
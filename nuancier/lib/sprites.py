@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+
+'''
+Sprite sheets of the thumbnails of the candidates of an election.
+
+Rather than one request per thumbnail, the election and vote pages can load
+the thumbnails of the approved candidates from a few sheets, each holding a
+grid of thumbnails, together with a stylesheet giving the position of each
+candidate in them. Both are stored in the ``sprites`` sub-folder of the
+cache folder of the election, next to ``sprites.json`` which maps each
+candidate to its sheet and coordinates.
+
+The names of the sheets and of the stylesheet contain the digest of the
+sheets, so that they can be cached by the browsers for as long as they are
+served.
+'''
+
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    # This is for the old versions not using pillow
+    import Image
+
+import nuancier.lib.model
+import nuancier.lib.packs
+
+
+LOG = logging.getLogger(__name__)
+
+# Where, in the cache folder of an election, the sprites are stored
+SPRITES_FOLDER = 'sprites'
+# The file mapping the candidates to their position in the sheets
+MAP_FILE = 'sprites.json'
+# Number of thumbnails per row of a sheet
+COLUMNS = 10
+# Quality of the sheets, saved as JPEG
+QUALITY = 85
+
+_MAPS = {}
+
+
+def _write(path, data):
+    """ Write the data in the specified file, replacing it atomically. """
+    handle, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(handle, 'wb') as stream:
+            stream.write(data)
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def _read_map(path):
+    """ Return the map of the sprites stored in the specified file, or None
+    if it cannot be read.
+    """
+    try:
+        with open(path) as stream:
+            return json.load(stream)
+    except (IOError, ValueError) as err:
+        LOG.warning('Cannot read the sprites %s: %s', path, err)
+        return None
+
+
+def _percent(value):
+    """ Format the given number as a CSS percentage. """
+    return ('%.4f' % value).rstrip('0').rstrip('.') + '%'
+
+
+def _stylesheet(sprites):
+    """ Return the stylesheet giving to the element of class
+    ``sprite-<candidate identifier>`` the thumbnail of the candidate as
+    background.
+
+    The sizes and positions are relative, so that the thumbnails can be
+    shown at any width: the height follows from the ratio of the thumbnail.
+    """
+    rules = [
+        '.sprite { display: inline-block; max-width: 100%; '
+        'background-repeat: no-repeat; }',
+        '.sprite:before { content: ""; display: block; }',
+    ]
+    for candidate_id, (index, x, y, width, height) in sorted(
+            sprites['candidates'].items(), key=lambda item: int(item[0])):
+        sheet_width, sheet_height = sprites['sizes'][index]
+        pos_x = 0
+        if sheet_width > width:
+            pos_x = 100.0 * x / (sheet_width - width)
+        pos_y = 0
+        if sheet_height > height:
+            pos_y = 100.0 * y / (sheet_height - height)
+        rules.append(
+            '.sprite-%s { width: %dpx; background-image: url(%s); '
+            'background-size: %s %s; background-position: %s %s; }' % (
+                candidate_id, width, sprites['sheets'][index],
+                _percent(100.0 * sheet_width / width),
+                _percent(100.0 * sheet_height / height),
+                _percent(pos_x), _percent(pos_y)))
+        rules.append(
+            '.sprite-%s:before { padding-top: %s; }' % (
+                candidate_id, _percent(100.0 * height / width)))
+    return '\n'.join(rules) + '\n'
+
+
+def build_sprites(session, election, cache_folder, size, cells=100):
+    """ Pack the thumbnails of the approved candidates of the specified
+    election into sprite sheets and return the map of the sprites, as
+    stored in ``sprites.json``.
+
+    The candidates whose thumbnail has not been generated are left out. The
+    sheets and stylesheet of the previous build are kept, for the pages
+    rendered just before, and those of the builds before it are removed.
+
+    :arg session:
+    :arg election:
+    :arg cache_folder: the folder containing the folders of the thumbnails
+        of all the elections.
+    :arg size: the maximal width and height of the thumbnails.
+    :kwarg cells: the maximal number of thumbnails per sheet.
+    """
+    folder = os.path.join(cache_folder, election.election_folder)
+    sprites_folder = os.path.join(folder, SPRITES_FOLDER)
+    if not os.path.isdir(sprites_folder):
+        os.makedirs(sprites_folder)
+
+    cell_width, cell_height = size
+    columns = min(COLUMNS, cells)
+    rows = (cells + columns - 1) // columns
+
+    sheets = []
+    positions = {}
+    cnt = 0
+    for candidate in nuancier.lib.model.Candidates.by_election(
+            session, election.id, approved=True):
+        try:
+            thumbnail = Image.open(nuancier.lib.packs.open_thumbnail(
+                folder, candidate.candidate_file))
+            thumbnail.load()
+        except IOError as err:
+            LOG.warning('No thumbnail for candidate %s: %s',
+                        candidate.id, err)
+            continue
+        thumbnail.thumbnail(size, Image.ANTIALIAS)
+        if thumbnail.mode != 'RGBA':
+            thumbnail = thumbnail.convert('RGBA')
+
+        cell = cnt % cells
+        if cell == 0:
+            sheets.append(Image.new(
+                'RGB', (cell_width * columns, cell_height * rows),
+                (255, 255, 255)))
+        x = (cell % columns) * cell_width
+        y = (cell // columns) * cell_height
+        sheets[-1].paste(thumbnail, (x, y), thumbnail)
+        positions[str(candidate.id)] = [
+            len(sheets) - 1, x, y, thumbnail.size[0], thumbnail.size[1]]
+        cnt += 1
+
+    # Do not keep the empty rows of the last sheet
+    if sheets:
+        used = (cnt - 1) % cells + 1
+        height = cell_height * ((used + columns - 1) // columns)
+        sheets[-1] = sheets[-1].crop(
+            (0, 0, cell_width * columns, height))
+
+    data = []
+    digest = hashlib.sha1()
+    for sheet in sheets:
+        stream = io.BytesIO()
+        sheet.save(stream, 'JPEG', quality=QUALITY, optimize=True,
+                   progressive=True)
+        data.append(stream.getvalue())
+        digest.update(data[-1])
+    digest = digest.hexdigest()[:12]
+
+    sprites = dict(
+        version=digest,
+        sheets=[
+            'sheet-%s-%s.jpg' % (digest, index)
+            for index in range(len(sheets))],
+        sizes=[list(sheet.size) for sheet in sheets],
+        candidates=positions,
+    )
+    sprites['stylesheet'] = 'sprites-%s.css' % digest
+
+    # Two builds at once would remove the sheets of one another
+    with nuancier.lib.packs.FolderLock(sprites_folder):
+        map_path = os.path.join(sprites_folder, MAP_FILE)
+        previous = None
+        if os.path.exists(map_path):
+            previous = _read_map(map_path)
+
+        for filename, content in zip(sprites['sheets'], data):
+            _write(os.path.join(sprites_folder, filename), content)
+        _write(os.path.join(sprites_folder, sprites['stylesheet']),
+               _stylesheet(sprites))
+        # The map comes last, the pages switch to the new sprites with it
+        _write(map_path, json.dumps(sprites, indent=2, sort_keys=True))
+
+        # The pages rendered with the previous map may still be loading
+        # its sheets, they are only removed by the next build
+        keep = set(sprites['sheets'] + [sprites['stylesheet'], MAP_FILE])
+        if previous:
+            keep.update(previous['sheets'] + [previous['stylesheet']])
+        for filename in os.listdir(sprites_folder):
+            if filename not in keep:
+                os.unlink(os.path.join(sprites_folder, filename))
+
+    return sprites
+
+
+def get_sprites(cache_folder, election):
+    """ Return the map of the sprites of the specified election, as built
+    by ``build_sprites``, or None if they have not been built.
+
+    The maps are kept in memory and read again when they are rebuilt.
+
+    :arg cache_folder: the folder containing the folders of the thumbnails
+        of all the elections.
+    :arg election:
+    """
+    path = os.path.join(
+        cache_folder, election.election_folder, SPRITES_FOLDER, MAP_FILE)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    # The map is replaced by a rename, which changes its inode
+    version = (stat.st_ino, stat.st_mtime)
+    cached = _MAPS.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    sprites = _read_map(path)
+    if sprites is None:  # pragma: no cover
+        return None
+    _MAPS[path] = (version, sprites)
+    return sprites
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+
+'''
+Storage of the pictures and of their thumbnails.
+
+The pictures and the thumbnails are read and written through a storage
+backend, so that they can live on the local filesystem, as by default, or
+in an S3-compatible object store shared by all the web nodes.
+
+``NUANCIER_STORAGE`` selects the backend: ``local`` stores the pictures in
+``PICTURE_FOLDER`` and the thumbnails in ``CACHE_FOLDER``, ``s3`` stores
+them under the ``pictures/`` and ``cache/`` prefixes of the bucket
+described by ``NUANCIER_S3``.
+'''
+
+import datetime
+import errno
+import hashlib
+import hmac
+import httplib
+import io
+import os
+import shutil
+import tempfile
+import urllib
+import urlparse
+
+
+# The kinds of files stored
+PICTURES = 'pictures'
+CACHE = 'cache'
+# Size of the chunks in which the files are read and written
+CHUNK_SIZE = 64 * 1024
+
+
+class Storage(object):
+    """ The interface of the storage backends, in which the files are
+    identified by their path relative to the root of the storage.
+    """
+
+    def put(self, path, stream):
+        """ Store the content of the stream at the given path, replacing
+        the file there if any, and return the number of bytes stored.
+
+        :arg path:
+        :arg stream: a file-like object, read until its end.
+        """
+        raise NotImplementedError()
+
+    def get(self, path):
+        """ Return the content of the file at the given path.
+
+        :arg path:
+        """
+        return ''.join(self.stream(path))
+
+    def open(self, path):
+        """ Return a file-like object reading the file at the given path.
+
+        :arg path:
+        """
+        return io.BytesIO(self.get(path))
+
+    def stream(self, path, chunk_size=CHUNK_SIZE):
+        """ Return an iterator over the content of the file at the given
+        path, in chunks of the given size.
+
+        :arg path:
+        :kwarg chunk_size:
+        """
+        raise NotImplementedError()
+
+    def exists(self, path):
+        """ Return whether there is a file at the given path.
+
+        :arg path:
+        """
+        raise NotImplementedError()
+
+    def delete(self, path):
+        """ Remove the file at the given path, if there is one.
+
+        :arg path:
+        """
+        raise NotImplementedError()
+
+    def url(self, path, expires=3600):
+        """ Return a URL at which the file at the given path can be
+        downloaded directly from the storage, or None if it cannot, in
+        which case nuancier serves it itself.
+
+        :arg path:
+        :kwarg expires: the number of seconds during which the URL works.
+        """
+        return None
+
+    def subfolder(self, folder):
+        """ Return the storage of the files under the given folder.
+
+        :arg folder:
+        """
+        raise NotImplementedError()
+
+
+def _stream_size(stream):
+    """ Return the number of bytes left to read from the stream, or None
+    if it cannot be known without reading it.
+    """
+    try:
+        position = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell() - position
+        stream.seek(position)
+    except (AttributeError, IOError):
+        return None
+    return size
+
+
+class LocalStorage(Storage):
+    """ The files stored in a folder of the local filesystem. """
+
+    def __init__(self, root):
+        """ Store the files in the given folder.
+
+        :arg root:
+        """
+        self.root = root
+
+    def __repr__(self):
+        return 'LocalStorage(%r)' % self.root
+
+    def path(self, path):
+        """ Return the path on the filesystem of the file at the given path
+        of the storage, which cannot be outside of its folder.
+
+        :arg path:
+        """
+        root = os.path.abspath(self.root)
+        fullpath = os.path.normpath(os.path.join(root, path))
+        if not fullpath.startswith(root + os.sep):
+            raise IOError(errno.ENOENT, 'Invalid path', path)
+        return fullpath
+
+    def put(self, path, stream):
+        fullpath = self.path(path)
+        folder = os.path.dirname(fullpath)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                if not os.path.isdir(folder):
+                    raise
+
+        # Readers never see a partially written file
+        handle, tmp_path = tempfile.mkstemp(dir=folder)
+        try:
+            with os.fdopen(handle, 'wb') as output:
+                shutil.copyfileobj(stream, output, CHUNK_SIZE)
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, fullpath)
+        except:
+            os.unlink(tmp_path)
+            raise
+        return os.path.getsize(fullpath)
+
+    def get(self, path):
+        with open(self.path(path), 'rb') as stream:
+            return stream.read()
+
+    def open(self, path):
+        return open(self.path(path), 'rb')
+
+    def stream(self, path, chunk_size=CHUNK_SIZE):
+        with open(self.path(path), 'rb') as stream:
+            for chunk in iter(lambda: stream.read(chunk_size), ''):
+                yield chunk
+
+    def exists(self, path):
+        try:
+            return os.path.isfile(self.path(path))
+        except IOError:
+            return False
+
+    def delete(self, path):
+        try:
+            os.unlink(self.path(path))
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+    def subfolder(self, folder):
+        return LocalStorage(self.path(folder))
+
+
+def _quote(value, safe='-_.~'):
+    """ URI-encode the value as required by the signatures of S3. """
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return urllib.quote(value, safe=safe)
+
+
+def _hmac(key, msg):
+    """ Return the HMAC-SHA256 of the message with the given key. """
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+
+class S3Storage(Storage):
+    """ The files stored in a bucket of an S3-compatible object store,
+    requests being signed with AWS Signature Version 4.
+    """
+
+    def __init__(self, endpoint, bucket, access_key, secret_key,
+                 region='us-east-1', prefix='', virtual_host=False,
+                 timeout=60):
+        """ Store the files in the given bucket.
+
+        :arg endpoint: the URL of the object store, for example
+            ``https://s3.amazonaws.com``.
+        :arg bucket:
+        :arg access_key:
+        :arg secret_key:
+        :kwarg region: the region of the bucket.
+        :kwarg prefix: the prefix of the keys of the files in the bucket.
+        :kwarg virtual_host: whether the bucket is addressed as a sub-domain
+            of the endpoint rather than as the first part of the path.
+        :kwarg timeout: the number of seconds after which the requests to
+            the object store fail.
+        """
+        self.endpoint = endpoint
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix
+        self.virtual_host = virtual_host
+        self.timeout = timeout
+
+    def __repr__(self):
+        return 'S3Storage(%r, %r, prefix=%r)' % (
+            self.endpoint, self.bucket, self.prefix)
+
+    def _location(self, path):
+        """ Return the scheme, host and URI of the file at the given path.
+        """
+        parts = urlparse.urlsplit(self.endpoint)
+        key = self.prefix + path.lstrip('/')
+        if self.virtual_host:
+            return parts.scheme, '%s.%s' % (self.bucket, parts.netloc), \
+                '/' + _quote(key, safe='/-_.~')
+        return parts.scheme, parts.netloc, \
+            '/%s/%s' % (_quote(self.bucket), _quote(key, safe='/-_.~'))
+
+    def _signature(self, method, uri, query, headers, payload_hash, now):
+        """ Return the scope of the signature of the request and the
+        signature itself.
+        """
+        date = now.strftime('%Y%m%d')
+        scope = '%s/%s/s3/aws4_request' % (date, self.region)
+        names = sorted(headers)
+        canonical_request = '\n'.join([
+            method,
+            uri,
+            '&'.join(
+                '%s=%s' % (_quote(key), _quote(value))
+                for key, value in sorted(query.items())),
+            ''.join('%s:%s\n' % (name, headers[name].strip())
+                    for name in names),
+            ';'.join(names),
+            payload_hash,
+        ])
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256',
+            now.strftime('%Y%m%dT%H%M%SZ'),
+            scope,
+            hashlib.sha256(canonical_request).hexdigest(),
+        ])
+        key = ('AWS4' + self.secret_key).encode('utf-8')
+        for part in [date, self.region, 's3', 'aws4_request']:
+            key = _hmac(key, part)
+        return scope, hmac.new(
+            key, string_to_sign, hashlib.sha256).hexdigest()
+
+    def _request(self, method, path, stream=None, size=None):
+        """ Send the request to the object store and return the connection
+        and the response, whose body is left to be read.
+        """
+        scheme, host, uri = self._location(path)
+        now = datetime.datetime.utcnow()
+        headers = {
+            'host': host,
+            'x-amz-content-sha256': 'UNSIGNED-PAYLOAD',
+            'x-amz-date': now.strftime('%Y%m%dT%H%M%SZ'),
+        }
+        if stream is not None:
+            headers['content-length'] = str(size)
+        scope, signature = self._signature(
+            method, uri, {}, headers, 'UNSIGNED-PAYLOAD', now)
+        headers['authorization'] = (
+            'AWS4-HMAC-SHA256 Credential=%s/%s, SignedHeaders=%s, '
+            'Signature=%s' % (
+                self.access_key, scope, ';'.join(sorted(headers)),
+                signature))
+
+        connection_class = httplib.HTTPConnection
+        if scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+        connection = connection_class(host, timeout=self.timeout)
+        try:
+            connection.putrequest(
+                method, uri, skip_host=True, skip_accept_encoding=True)
+            for name, value in sorted(headers.items()):
+                connection.putheader(name, value)
+            connection.endheaders()
+            if stream is not None:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), ''):
+                    connection.send(chunk)
+            return connection, connection.getresponse()
+        except:
+            connection.close()
+            raise
+
+    @staticmethod
+    def _error(response, path):
+        """ Return the error corresponding to the failed response. """
+        if response.status == 404:
+            return IOError(errno.ENOENT, 'No such file', path)
+        return IOError(
+            'The object store answered %s %s for %s' % (
+                response.status, response.reason, path))
+
+    def put(self, path, stream):
+        size = _stream_size(stream)
+        if size is None:
+            stream = io.BytesIO(stream.read())
+            size = len(stream.getvalue())
+        connection, response = self._request('PUT', path, stream, size)
+        try:
+            response.read()
+            if response.status != 200:
+                raise self._error(response, path)
+        finally:
+            connection.close()
+        return size
+
+    def stream(self, path, chunk_size=CHUNK_SIZE):
+        connection, response = self._request('GET', path)
+        try:
+            if response.status != 200:
+                response.read()
+                raise self._error(response, path)
+            for chunk in iter(lambda: response.read(chunk_size), ''):
+                yield chunk
+        finally:
+            connection.close()
+
+    def exists(self, path):
+        connection, response = self._request('HEAD', path)
+        try:
+            response.read()
+            if response.status == 404:
+                return False
+            if response.status != 200:
+                raise self._error(response, path)
+            return True
+        finally:
+            connection.close()
+
+    def delete(self, path):
+        connection, response = self._request('DELETE', path)
+        try:
+            response.read()
+            if response.status not in (200, 204, 404):
+                raise self._error(response, path)
+        finally:
+            connection.close()
+
+    def url(self, path, expires=3600, now=None):
+        """ Return a presigned URL at which the file at the given path can
+        be downloaded from the object store.
+
+        :arg path:
+        :kwarg expires: the number of seconds during which the URL works.
+        :kwarg now: the date of the signature, now by default.
+        """
+        scheme, host, uri = self._location(path)
+        now = now or datetime.datetime.utcnow()
+        query = {
+            'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+            'X-Amz-Credential': '%s/%s/%s/s3/aws4_request' % (
+                self.access_key, now.strftime('%Y%m%d'), self.region),
+            'X-Amz-Date': now.strftime('%Y%m%dT%H%M%SZ'),
+            'X-Amz-Expires': str(int(expires)),
+            'X-Amz-SignedHeaders': 'host',
+        }
+        _, signature = self._signature(
+            'GET', uri, query, {'host': host}, 'UNSIGNED-PAYLOAD', now)
+        query['X-Amz-Signature'] = signature
+        return '%s://%s%s?%s' % (
+            scheme, host, uri, '&'.join(
+                '%s=%s' % (_quote(key), _quote(value))
+                for key, value in sorted(query.items())))
+
+    def subfolder(self, folder):
+        return S3Storage(
+            self.endpoint, self.bucket, self.access_key, self.secret_key,
+            region=self.region,
+            prefix='%s%s/' % (self.prefix, folder.strip('/')),
+            virtual_host=self.virtual_host, timeout=self.timeout)
+
+
+def as_storage(folder):
+    """ Return the given storage, or the storage of the given folder of the
+    local filesystem.
+
+    :arg folder: a storage or the path of a folder.
+    """
+    if isinstance(folder, Storage):
+        return folder
+    return LocalStorage(folder)
+
+
+def get_storage(config, kind):
+    """ Return the storage of the given kind of files, as configured.
+
+    :arg config: the configuration of nuancier.
+    :arg kind: ``PICTURES`` or ``CACHE``.
+    """
+    backend = config.get('NUANCIER_STORAGE', 'local')
+    if backend == 'local':
+        if kind == PICTURES:
+            return LocalStorage(config['PICTURE_FOLDER'])
+        return LocalStorage(config['CACHE_FOLDER'])
+    if backend == 's3':
+        settings = dict(config['NUANCIER_S3'])
+        settings['prefix'] = '%s%s/' % (settings.get('prefix', ''), kind)
+        return S3Storage(**settings)
+    raise ValueError('Unknown storage backend: %s' % backend)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+'''
+Tally of the votes of an election.
+
+The votes of an election are loaded once, as ``(user, candidate, value)``
+triplets in which the user names and the candidate identifiers are
+replaced by dense integer codes. The totals, rankings, histograms and
+co-votes are then computed from these codes using NumPy when it is
+installed, and plain python otherwise.
+'''
+
+import collections
+import itertools
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+import nuancier.lib.model
+
+
+class Tally(object):
+    """ The votes of an election, encoded as dense integer codes.
+
+    ``users`` and ``candidates`` map the codes back to the user names and
+    to the candidate identifiers, the candidates being sorted by
+    identifier.
+    """
+
+    def __init__(self, rows, use_numpy=None):
+        """ Encode the given votes.
+
+        :arg rows: an iterable of ``(user_name, candidate_id, value)``.
+        :kwarg use_numpy: whether to use NumPy for the computations,
+            defaults to using it if it is installed.
+        """
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        self.use_numpy = use_numpy
+
+        user_codes = {}
+        candidate_codes = {}
+        users = []
+        candidates = []
+        values = []
+        for user_name, candidate_id, value in rows:
+            users.append(user_codes.setdefault(user_name, len(user_codes)))
+            candidates.append(
+                candidate_codes.setdefault(candidate_id, len(candidate_codes)))
+            values.append(value)
+
+        self.users = [None] * len(user_codes)
+        for user_name, code in user_codes.items():
+            self.users[code] = user_name
+        self.candidates = sorted(candidate_codes)
+        remap = [0] * len(candidate_codes)
+        for code, candidate_id in enumerate(self.candidates):
+            remap[candidate_codes[candidate_id]] = code
+
+        if self.use_numpy:
+            self._users = numpy.array(users, dtype=numpy.int64)
+            self._candidates = numpy.array(
+                remap, dtype=numpy.int64)[
+                    numpy.array(candidates, dtype=numpy.int64)]
+            self._values = numpy.array(values, dtype=numpy.int64)
+        else:
+            self._users = users
+            self._candidates = [remap[code] for code in candidates]
+            self._values = values
+
+    @classmethod
+    def from_election(cls, session, election_id, use_numpy=None):
+        """ Load and encode the votes of the specified election.
+
+        :arg session:
+        :arg election_id:
+        :kwarg use_numpy:
+        """
+        return cls(
+            nuancier.lib.model.Votes.values_by_election(session, election_id),
+            use_numpy=use_numpy)
+
+    @property
+    def n_votes(self):
+        """ Return the number of votes cast. """
+        return len(self._users)
+
+    @property
+    def n_voters(self):
+        """ Return the number of users who voted. """
+        return len(self.users)
+
+    def total(self, weighted=True):
+        """ Return the sum of all the votes.
+
+        :kwarg weighted: whether to take the value of the votes into
+            account or to count each vote as one.
+        """
+        if not weighted:
+            return self.n_votes
+        if self.use_numpy:
+            return int(self._values.sum())
+        return sum(self._values)
+
+    def _tallies(self, weighted):
+        """ Return the total of each candidate, indexed by code. """
+        if self.use_numpy:
+            return numpy.bincount(
+                self._candidates,
+                weights=self._values if weighted else None,
+                minlength=len(self.candidates)).astype(numpy.int64)
+        tallies = [0] * len(self.candidates)
+        if weighted:
+            for code, value in itertools.izip(
+                    self._candidates, self._values):
+                tallies[code] += value
+        else:
+            for code in self._candidates:
+                tallies[code] += 1
+        return tallies
+
+    def totals(self, weighted=True):
+        """ Return a dictionnary of the total of votes of each candidate.
+
+        :kwarg weighted:
+        """
+        return dict(itertools.izip(
+            self.candidates, [int(total) for total in self._tallies(weighted)]
+        ))
+
+    def ranking(self, weighted=True):
+        """ Return the list of ``(candidate_id, total)`` sorted from the
+        candidate with the most votes to the one with the least, candidates
+        with as many votes being sorted by identifier.
+
+        :kwarg weighted:
+        """
+        tallies = self._tallies(weighted)
+        if self.use_numpy:
+            order = numpy.lexsort(
+                (numpy.arange(len(tallies)), -tallies)).tolist()
+        else:
+            order = sorted(
+                range(len(tallies)), key=lambda code: -tallies[code])
+        return [(self.candidates[code], int(tallies[code]))
+                for code in order]
+
+    def ranks(self, weighted=True):
+        """ Return a dictionnary of the rank of each candidate, candidates
+        with as many votes sharing the same rank (1, 2, 2, 4...).
+
+        :kwarg weighted:
+        """
+        tallies = self._tallies(weighted)
+        if self.use_numpy:
+            ordered = numpy.sort(-tallies)
+            ranks = numpy.searchsorted(ordered, -tallies) + 1
+            return dict(itertools.izip(self.candidates, ranks.tolist()))
+
+        ranks = {}
+        rank = 0
+        previous = None
+        for idx, (candidate_id, total) in enumerate(
+                self.ranking(weighted=weighted)):
+            if total != previous:
+                rank = idx + 1
+                previous = total
+            ranks[candidate_id] = rank
+        return ranks
+
+    def votes_per_voter(self):
+        """ Return the histogram of the number of votes cast per user, as a
+        list of ``[number of votes, number of users]``.
+        """
+        if self.use_numpy:
+            histogram = numpy.bincount(
+                numpy.bincount(self._users, minlength=len(self.users)))
+            return [[int(n_votes), int(n_users)]
+                    for n_votes, n_users in enumerate(histogram.tolist())
+                    if n_users and n_votes]
+
+        per_user = collections.Counter(self._users)
+        histogram = collections.Counter(per_user.values())
+        return [[n_votes, histogram[n_votes]]
+                for n_votes in sorted(histogram)]
+
+    def covotes(self):
+        """ Return how many users voted for each pair of candidates, as a
+        list of ``(candidate_id, other_candidate_id, count)`` where the
+        first candidate has the smallest identifier. Pairs of candidates
+        no-one voted for together are left out.
+        """
+        n_candidates = len(self.candidates)
+        if self.use_numpy:
+            if not self.n_votes:
+                return []
+            order = numpy.lexsort((self._candidates, self._users))
+            users = self._users[order]
+            candidates = self._candidates[order]
+            # Pair each vote with the following votes of the same user,
+            # ballots being sorted by candidate the first code is the
+            # smallest one.
+            longest = int(numpy.bincount(users).max())
+            keys = []
+            for offset in range(1, longest):
+                same = users[offset:] == users[:-offset]
+                keys.append(
+                    candidates[:-offset][same] * n_candidates
+                    + candidates[offset:][same])
+            if not keys:
+                return []
+            keys, counts = numpy.unique(
+                numpy.concatenate(keys), return_counts=True)
+            return [
+                (self.candidates[key // n_candidates],
+                 self.candidates[key % n_candidates], count)
+                for key, count in itertools.izip(
+                    keys.tolist(), counts.tolist())
+            ]
+
+        ballots = collections.defaultdict(list)
+        for user, candidate in itertools.izip(self._users, self._candidates):
+            ballots[user].append(candidate)
+        pairs = collections.Counter()
+        for ballot in ballots.itervalues():
+            pairs.update(itertools.combinations(sorted(ballot), 2))
+        return [
+            (self.candidates[first], self.candidates[second],
+             pairs[(first, second)])
+            for first, second in sorted(pairs)
+        ]
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+'''
+Metrics of nuancier, exported in the Prometheus text format.
+
+Each process keeps its metrics in memory. When a metrics folder is
+configured, every process regularly dumps its values in a file of that
+folder and the export sums the values of all the processes, so that the
+metrics of all the uWSGI/gunicorn workers are aggregated.
+'''
+
+import atexit
+import errno
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+# Buckets used for the durations, in seconds
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                10.0, 30.0)
+# Buckets used for the upload sizes, in bytes
+SIZE_BUCKETS = tuple(2 ** power * 1024 for power in range(6, 15))
+
+# Name of the file in which the metrics of the dead processes are merged
+ARCHIVE = 'archive.json'
+
+
+class Registry(object):
+    ''' Hold the values of the metrics of the current process.
+
+    :kwarg folder: the folder in which the processes share their metrics,
+        if None the metrics are only those of the current process.
+    :kwarg flush_interval: the minimal number of seconds between two dumps
+        of the metrics of the process in the folder.
+    '''
+
+    def __init__(self, folder=None, flush_interval=1.0):
+        self.folder = folder
+        self.flush_interval = flush_interval
+        self.metrics = []
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        ''' Start with empty values, in a new process. '''
+        self._pid = os.getpid()
+        self._values = {}
+        self._last_flush = 0
+
+    def configure(self, folder=None, flush_interval=1.0):
+        ''' Set the folder shared by the processes. '''
+        if folder and not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError as err:  # pragma: no cover
+                if err.errno != errno.EEXIST:
+                    raise
+        self.folder = folder
+        self.flush_interval = flush_interval
+
+    def register(self, metric):
+        ''' Add a metric to the registry. '''
+        self.metrics.append(metric)
+        return metric
+
+    def update(self, kind, key, func):
+        ''' Update the value stored under the given key with the provided
+        function, which receives the current value (or None).
+        '''
+        with self._lock:
+            if os.getpid() != self._pid:
+                # We have been forked, the values are those of our parent
+                self._reset()
+            self._values[(kind,) + key] = func(self._values.get(
+                (kind,) + key))
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        ''' Dump the metrics of this process if it has not been done for a
+        while.
+        '''
+        if self.folder \
+                and time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        ''' Dump the metrics of this process in the shared folder. '''
+        if not self.folder:
+            return
+        with self._lock:
+            self._last_flush = time.time()
+            data = [list(key) + [value]
+                    for key, value in self._values.items()]
+            pid = self._pid
+        filename = os.path.join(self.folder, '%s.json' % pid)
+        tmpfile = '%s.tmp' % filename
+        with open(tmpfile, 'w') as stream:
+            json.dump(data, stream)
+        os.rename(tmpfile, filename)
+
+    def collect(self):
+        ''' Return the values of all the processes, summed, as a dict. '''
+        with self._lock:
+            if os.getpid() != self._pid:
+                self._reset()
+            values = dict(self._values)
+        if not self.folder:
+            return values
+
+        self.flush()
+        values = {}
+        with _FolderLock(self.folder):
+            archive = os.path.join(self.folder, ARCHIVE)
+            for key, value in _read(archive).items():
+                _merge(values, key, value)
+            merged = {}
+            for filename in os.listdir(self.folder):
+                name, ext = os.path.splitext(filename)
+                if ext != '.json' or not name.isdigit():
+                    continue
+                path = os.path.join(self.folder, filename)
+                data = _read(path)
+                alive = _is_alive(int(name))
+                for key, value in data.items():
+                    if key[0] == 'gauge' and not alive:
+                        continue
+                    _merge(values, key, value)
+                    if not alive:
+                        _merge(merged, key, value)
+                if not alive:
+                    # Fold the metrics of the dead processes in the archive
+                    for key, value in _read(archive).items():
+                        _merge(merged, key, value)
+                    _write(archive, merged)
+                    os.unlink(path)
+                    merged = {}
+        return values
+
+    def render(self):
+        ''' Return all the metrics in the Prometheus text format. '''
+        values = self.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(values))
+        return '\n'.join(lines) + '\n'
+
+
+def _read(path):
+    ''' Return the metrics stored in the given file as a dict. '''
+    try:
+        with open(path) as stream:
+            data = json.load(stream)
+    except (IOError, ValueError):
+        return {}
+    return dict(
+        (tuple(_freeze(part) for part in entry[:-1]), entry[-1])
+        for entry in data)
+
+
+def _write(path, values):
+    ''' Store atomically the given metrics in the given file. '''
+    tmpfile = '%s.tmp' % path
+    with open(tmpfile, 'w') as stream:
+        json.dump([list(key) + [value] for key, value in values.items()],
+                  stream)
+    os.rename(tmpfile, path)
+
+
+def _freeze(value):
+    ''' Turn the lists read from JSON back into hashable tuples. '''
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _merge(values, key, value):
+    ''' Add the given value to the one stored in values under key. '''
+    current = values.get(key)
+    if current is None:
+        values[key] = value
+    elif isinstance(value, list):
+        values[key] = [left + right for left, right in zip(current, value)]
+    else:
+        values[key] = current + value
+
+
+def _is_alive(pid):
+    ''' Return whether the process with the given pid is still running. '''
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno == errno.EPERM
+    return True
+
+
+class _FolderLock(object):
+    ''' Lock the metrics folder while its files are being merged. '''
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, '.lock')
+        self.stream = None
+
+    def __enter__(self):
+        self.stream = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self.stream, fcntl.LOCK_EX)
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self.stream, fcntl.LOCK_UN)
+        self.stream.close()
+
+
+def _labels(names, values):
+    ''' Return the label set of a sample in the Prometheus format. '''
+    if not names:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values))
+
+
+def _number(value):
+    ''' Return the given number in the Prometheus format. '''
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric(object):
+    ''' Base class of the metrics. '''
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def _key(self, labels):
+        ''' Return the key under which the values with these labels are
+        stored.
+        '''
+        return (self.name, tuple(str(labels[name]) for name in self.labels))
+
+    def _samples(self, values):
+        ''' Return the (labels, value) stored for this metric. '''
+        for key, value in sorted(values.items()):
+            if key[0] == self.kind and key[1] == self.name:
+                yield key[2], value
+
+    def render(self, values):
+        ''' Return the lines describing this metric. '''
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.kind),
+        ]
+        for labels, value in self._samples(values):
+            lines.append('%s%s %s' % (
+                self.name, _labels(self.labels, labels), _number(value)))
+        return lines
+
+
+class Counter(_Metric):
+    ''' A value that only goes up. '''
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        ''' Increase the counter by the given amount. '''
+        self.registry.update(
+            self.kind, self._key(labels),
+            lambda value: (value or 0) + amount)
+
+
+class Gauge(_Metric):
+    ''' A value that can go up and down, summed over the live processes.
+    '''
+
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        ''' Increase the gauge by the given amount. '''
+        self.registry.update(
+            self.kind, self._key(labels),
+            lambda value: (value or 0) + amount)
+
+    def dec(self, amount=1, **labels):
+        ''' Decrease the gauge by the given amount. '''
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    ''' The distribution of the observed values in buckets. '''
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=TIME_BUCKETS, registry=None):
+        super(Histogram, self).__init__(
+            name, documentation, labels, registry)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, amount, **labels):
+        ''' Record an observed value. '''
+        def _observe(value):
+            ''' Add the amount to the buckets, the sum and the count. '''
+            value = list(value or [0] * (len(self.buckets) + 2))
+            for idx, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    value[idx] += 1
+                    break
+            value[-2] += amount
+            value[-1] += 1
+            return value
+        self.registry.update(self.kind, self._key(labels), _observe)
+
+    def time(self, **labels):
+        ''' Return a context manager observing the time spent in it. '''
+        return _Timer(self, labels)
+
+    def render(self, values):
+        ''' Return the lines describing this histogram. '''
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.kind),
+        ]
+        for labels, value in self._samples(values):
+            cumulated = 0
+            for idx, bound in enumerate(self.buckets):
+                cumulated += value[idx]
+                lines.append('%s_bucket%s %s' % (
+                    self.name,
+                    _labels(self.labels + ('le',), labels + (
+                        _number(bound),)),
+                    _number(cumulated)))
+            label_set = _labels(self.labels, labels)
+            lines.append('%s_sum%s %s' % (
+                self.name, label_set, _number(value[-2])))
+            lines.append('%s_count%s %s' % (
+                self.name, label_set, _number(value[-1])))
+        return lines
+
+
+class _Timer(object):
+    ''' Observe in a histogram the time spent in a with block. '''
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.time() - self.start, **self.labels)
+
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.flush)
+
+
+REQUEST_DURATION = Histogram(
+    'nuancier_request_duration_seconds',
+    'Time spent processing the requests.', labels=('endpoint',))
+REQUEST_QUERIES = Counter(
+    'nuancier_request_queries_total',
+    'SQL queries run while processing the requests.', labels=('endpoint',))
+BALLOTS = Counter(
+    'nuancier_ballots_total', 'Ballots cast.')
+VOTES = Counter(
+    'nuancier_votes_total', 'Votes cast, one ballot holding several votes.')
+UPLOAD_SIZE = Histogram(
+    'nuancier_upload_bytes', 'Size of the candidates uploaded.',
+    buckets=SIZE_BUCKETS)
+THUMBNAIL_DURATION = Histogram(
+    'nuancier_thumbnail_duration_seconds',
+    'Time spent generating the thumbnails.')
+CACHE_REQUESTS = Counter(
+    'nuancier_cache_requests_total',
+    'Lookups in the dogpile cache, by result (hit or miss).',
+    labels=('result',))
+DB_CONNECTIONS_CHECKED_OUT = Gauge(
+    'nuancier_db_connections_checked_out',
+    'Connections of the database pools currently in use.')
+DB_CHECKOUTS = Counter(
+    'nuancier_db_checkouts_total',
+    'Connections checked out of the database pools.')
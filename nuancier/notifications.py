@@ -28,8 +28,6 @@ import warnings
 
 from email.mime.text import MIMEText
 
-import nuancier
-
 
 ## Let's ignore the warning about a global variable being in lower case
 # pylint: disable=C0103
@@ -48,6 +46,7 @@ def publish(topic, msg):  # pragma: no cover
 
 def email_publish(to_email, img_title, motif):  # pragma: no cover
     ''' Send notification by email. '''
+    from nuancier.app import APP
 
     message = """
 Dear Madam/Sir,
@@ -70,14 +69,14 @@ The Nuancier administrators team
     msg = MIMEText(message)
     msg['Subject'] = '[Nuancier] {0} has been rejected'.format(
         img_title.encode('utf-8'))
-    from_email = nuancier.APP.config.get(
+    from_email = APP.config.get(
         'NUANCIER_EMAIL_FROM', 'nobody@fedoraproject.org')
     msg['From'] = from_email
     msg['To'] = to_email
 
     # Send the message via our own SMTP server, but don't include the
     # envelope header.
-    smtp = smtplib.SMTP(nuancier.APP.config.get(
+    smtp = smtplib.SMTP(APP.config.get(
         'NUANCIER_EMAIL_SMTP_SERVER', 'localhost'))
     smtp.sendmail(from_email, [to_email], msg.as_string())
     smtp.quit()
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+
+'''
+Publication of the closed elections as a static web site.
+
+The gallery, results and statistics pages of the elections whose results
+are public are rendered, as an anonymous user would see them, into a
+directory tree mirroring the URLs of nuancier, together with the thumbnails
+of the candidates and the static files of nuancier. A web server can then
+serve these pages directly.
+
+A state file kept in the output directory records what each election looked
+like when it was published, so that only the elections which changed since
+are rendered again.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+
+import flask
+
+import nuancier
+import nuancier.lib as nuancierlib
+import nuancier.lib.packs
+import nuancier.lib.sprites
+from nuancier.app import APP
+from nuancier.lib import model
+
+
+STATE_FILE = '.nuancier-publish.json'
+
+
+def _write(path, data):
+    ''' Write the data in the specified file, replacing it atomically. '''
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'wb') as stream:
+        stream.write(data)
+    os.rename(tmp_path, path)
+
+
+def _sync_folder(source, target, exclude=()):
+    ''' Copy the files of the source folder into the target folder, unless
+    they are already there or excluded, and return the number of files
+    copied.
+    '''
+    if not os.path.isdir(source):
+        return 0
+    if not os.path.exists(target):
+        os.makedirs(target)
+    cnt = 0
+    for filename in os.listdir(source):
+        # The hidden files are the locks and temporary files of nuancier
+        if filename in exclude or filename.startswith('.'):
+            continue
+        infile = os.path.join(source, filename)
+        outfile = os.path.join(target, filename)
+        if not os.path.isfile(infile):
+            continue
+        if os.path.exists(outfile):
+            instat = os.stat(infile)
+            outstat = os.stat(outfile)
+            if instat.st_size == outstat.st_size \
+                    and int(instat.st_mtime) == int(outstat.st_mtime):
+                continue
+        shutil.copy2(infile, outfile)
+        cnt += 1
+    return cnt
+
+
+def _extract_pack(source, target):
+    ''' Write the thumbnails packed in the source folder into the target
+    folder, unless they are already there or newer copies are in the source
+    folder, and return the number of files written.
+    '''
+    pack = nuancier.lib.packs.get_pack(source)
+    if pack is None:
+        return 0
+    if not os.path.exists(target):
+        os.makedirs(target)
+    cnt = 0
+    for filename in sorted(pack.index):
+        if os.path.isfile(os.path.join(source, filename)):
+            # Generated again since it was packed, see _sync_folder
+            continue
+        content = pack.get(filename)
+        outfile = os.path.join(target, filename)
+        if os.path.exists(outfile):
+            with open(outfile, 'rb') as stream:
+                if stream.read() == content:
+                    continue
+        _write(outfile, content)
+        cnt += 1
+    return cnt
+
+
+def _fingerprint(session, election):
+    ''' Return a string changing whenever the pages of the election do. '''
+    return hashlib.sha1(repr((
+        nuancier.__version__,
+        election.date_updated,
+        model.Candidates.last_update(session, election.id),
+        model.Votes.tally_version(session, election.id),
+    ))).hexdigest()
+
+
+def _sync_tree(source, target):
+    ''' Copy the files of the source folder and of its sub-folders into the
+    target folder, as ``_sync_folder`` does, and return the number of files
+    copied.
+    '''
+    cnt = 0
+    for folder, _, _ in os.walk(source):
+        cnt += _sync_folder(
+            folder,
+            os.path.join(target, os.path.relpath(folder, source)))
+    return cnt
+
+
+def _fallback_links(session, election, base_url, output_dir, pictures):
+    ''' Return the links to the display versions of the candidates of the
+    election which have none, mapped to the links to the picture they
+    stand for, and copy these pictures into the output directory unless
+    all the pictures are.
+    '''
+    picture_folder = os.path.join(
+        APP.config['PICTURE_FOLDER'], election.election_folder)
+    links = {}
+    with APP.test_request_context(base_url=base_url):
+        for candidate in nuancierlib.get_candidates(
+                session, election.id, approved=True):
+            filename = '%s/%s' % (
+                election.election_folder, candidate.candidate_file)
+            if os.path.exists(os.path.join(
+                    APP.config['CACHE_FOLDER'],
+                    nuancierlib.get_display_path(filename))):
+                continue
+            links[flask.url_for('base_display', filename=filename)] = \
+                flask.url_for('base_picture', filename=filename)
+            infile = os.path.join(picture_folder, candidate.candidate_file)
+            if not pictures and os.path.isfile(infile):
+                outfolder = os.path.join(
+                    output_dir, 'pictures', election.election_folder)
+                if not os.path.exists(outfolder):
+                    os.makedirs(outfolder)
+                shutil.copy2(infile, outfolder)
+    return links
+
+
+def _render(client, url, base_url, output_dir, links=None):
+    ''' Render the page at the given URL into the output directory,
+    replacing the links given, if any.
+    '''
+    output = client.get(url, base_url=base_url)
+    if output.status_code != 200:
+        raise nuancierlib.NuancierException(
+            'Could not render %s: %s' % (url, output.status))
+    data = output.data
+    for link, replacement in (links or {}).items():
+        data = data.replace('"%s"' % link, '"%s"' % replacement)
+    _write(
+        os.path.join(output_dir, url.strip('/'), 'index.html'),
+        data)
+
+
+def publish(session, output_dir, base_url='http://localhost/',
+            pictures=False, force=False):
+    ''' Render the pages of the elections whose results are public into
+    the output directory.
+
+    :arg session: the session used to find the elections to publish.
+    :arg output_dir: the directory in which to write the static site.
+    :kwarg base_url: the URL at which the site will be served, used for the
+        absolute links of the pages.
+    :kwarg pictures: whether to copy the pictures of the candidates, in
+        addition to their thumbnails.
+    :kwarg force: whether to render every election again, changed or not.
+    :return: a tuple of the identifiers of the elections published and of
+        those removed from the site as their results are no longer public.
+    '''
+    state_path = os.path.join(output_dir, STATE_FILE)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as stream:
+            state = json.load(stream)
+
+    with APP.test_request_context():
+        results_list_url = flask.url_for('results_list')
+
+    client = APP.test_client()
+    published = []
+    elections = nuancierlib.get_elections_public(session)
+    for election in elections:
+        fingerprint = _fingerprint(session, election)
+        previous = state.get(str(election.id))
+        if not force and previous \
+                and previous['fingerprint'] == fingerprint:
+            continue
+
+        with APP.test_request_context():
+            election_urls = [
+                flask.url_for(endpoint, election_id=election.id)
+                for endpoint in ['election', 'results', 'stats']
+            ]
+        # The lightbox shows the picture itself when it has no display
+        # version, as nuancier.app.base_display does
+        links = _fallback_links(
+            session, election, base_url, output_dir, pictures)
+        for url in election_urls:
+            _render(client, url, base_url, output_dir, links)
+
+        _sync_folder(
+            os.path.join(APP.config['CACHE_FOLDER'], election.election_folder),
+            os.path.join(output_dir, 'cache', election.election_folder),
+            exclude=[nuancier.lib.packs.PACK_FILE])
+        _extract_pack(
+            os.path.join(APP.config['CACHE_FOLDER'], election.election_folder),
+            os.path.join(output_dir, 'cache', election.election_folder))
+        # The display versions are served at the URL of the picture they
+        # stand for followed by .jpg, see nuancier.app.base_display
+        _sync_folder(
+            os.path.join(
+                APP.config['CACHE_FOLDER'], election.election_folder,
+                nuancierlib.DISPLAY_FOLDER),
+            os.path.join(output_dir, 'display', election.election_folder))
+        _sync_folder(
+            os.path.join(
+                APP.config['CACHE_FOLDER'], election.election_folder,
+                nuancier.lib.sprites.SPRITES_FOLDER),
+            os.path.join(
+                output_dir, 'cache', election.election_folder,
+                nuancier.lib.sprites.SPRITES_FOLDER))
+        if pictures:
+            _sync_folder(
+                os.path.join(
+                    APP.config['PICTURE_FOLDER'], election.election_folder),
+                os.path.join(output_dir, 'pictures', election.election_folder))
+
+        state[str(election.id)] = dict(
+            fingerprint=fingerprint,
+            folder=election.election_folder,
+            urls=election_urls,
+        )
+        published.append(election.id)
+
+    removed = []
+    public_ids = set(str(election.id) for election in elections)
+    for election_id in sorted(set(state) - public_ids):
+        info = state.pop(election_id)
+        for url in info['urls']:
+            shutil.rmtree(
+                os.path.join(output_dir, url.strip('/')), ignore_errors=True)
+        for folder in ['cache', 'display', 'pictures']:
+            shutil.rmtree(
+                os.path.join(output_dir, folder, info['folder']),
+                ignore_errors=True)
+        removed.append(int(election_id))
+
+    _sync_tree(
+        APP.static_folder,
+        os.path.join(output_dir, APP.static_url_path.strip('/')))
+
+    if published or removed or not os.path.exists(state_path):
+        _render(client, results_list_url, base_url, output_dir)
+        _write(state_path, json.dumps(state, indent=2, sort_keys=True))
+
+    return published, removed
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+
+'''
+Compilation of the templates of nuancier.
+
+Jinja compiles each template to python code the first time it is used, in
+every process. With a bytecode cache configured
+(``NUANCIER_TEMPLATE_CACHE_FOLDER``), the compiled templates are stored on
+disk and shared by all the processes, and ``precompile`` fills this cache
+at deploy time so that no request has to compile a template.
+'''
+
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache
+
+
+class SharedBytecodeCache(FileSystemBytecodeCache):
+    ''' Filesystem bytecode cache safe to share between processes: the
+    compiled templates are written to a temporary file first and then
+    renamed, so a process never reads a partially written template.
+    '''
+
+    def dump_bytecode(self, bucket):
+        filename = self._get_cache_filename(bucket)
+        handle, tmp_path = tempfile.mkstemp(
+            dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(handle, 'wb') as stream:
+                bucket.write_bytecode(stream)
+            os.rename(tmp_path, filename)
+        except (IOError, OSError):  # pragma: no cover
+            # Not being able to write the cache is not fatal
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
+def configure_bytecode_cache(app, folder):
+    ''' Make the Jinja environment of the application store its compiled
+    templates in the given folder.
+
+    :arg app: the Flask application.
+    :arg folder: the folder in which to store the compiled templates.
+    '''
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    app.jinja_env.bytecode_cache = SharedBytecodeCache(folder)
+
+
+def precompile(app):
+    ''' Compile all the templates of the application, filling the bytecode
+    cache if one is configured, and return the number of templates
+    compiled.
+
+    :arg app: the Flask application.
+    '''
+    env = app.jinja_env
+    cnt = 0
+    for name in env.list_templates(extensions=['html']):
+        # Go through the loader to bypass the templates already in memory
+        env.loader.load(env, name)
+        cnt += 1
+    return cnt
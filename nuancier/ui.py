@@ -23,9 +23,7 @@
 User interface for the nuancier flask application.
 '''
 
-import hashlib
 import os
-import random
 
 import flask
 
@@ -34,10 +32,16 @@ from sqlalchemy.exc import SQLAlchemyError
 # pylint: disable=E0611
 from werkzeug import secure_filename
 
-import nuancier
+import nuancier.app
+import nuancier.forms
 import nuancier.lib as nuancierlib
+import nuancier.lib.duplicates
+import nuancier.lib.ordering
+import nuancier.lib.sprites
+import nuancier.lib.storage
+import nuancier.metrics as metrics
 
-from nuancier import (
+from nuancier.app import (
     APP, SESSION, LOG, fas_login_required, contributor_required,
     validate_input_file
 )
@@ -49,6 +53,16 @@ from nuancier import (
 # pylint: disable=R0911
 
 
+def _get_sprites(election):
+    ''' Return the sprites of the thumbnails of the election, if the pages
+    should use them and they have been built.
+    '''
+    if not APP.config.get('NUANCIER_SPRITES', False):
+        return None
+    return nuancier.lib.sprites.get_sprites(
+        APP.config['CACHE_FOLDER'], election)
+
+
 @APP.route('/')
 def index():
     ''' Display the index page. '''
@@ -103,7 +117,12 @@ def contribute(election_id):
         candidate_file = flask.request.files['candidate_file']
 
         try:
-            validate_input_file(candidate_file)
+            metadata = validate_input_file(candidate_file)
+            candidate_file.seek(0)
+            metadata.update(
+                nuancierlib.get_picture_digest(candidate_file.stream))
+            candidate_file.seek(0)
+            dhash = nuancier.lib.duplicates.dhash(candidate_file.stream)
         except nuancierlib.NuancierException as err:
             LOG.debug('ERROR: Uploaded file is invalid - user: "%s" '
                       'election: "%s"', flask.g.fas_user.username,
@@ -119,21 +138,8 @@ def contribute(election_id):
                                    candidate_file.filename))
 
         # Only save the file once everything has been safely saved in the DB
-        upload_folder = os.path.join(
-            APP.config['PICTURE_FOLDER'], election.election_folder)
-        if not os.path.exists(upload_folder):  # pragma: no cover
-            try:
-                os.mkdir(upload_folder)
-            except OSError, err:
-                LOG.debug('ERROR: cannot add candidate file')
-                LOG.exception(err)
-                flask.flash(
-                    'An error occured while writing the file, please '
-                    'contact an administrator', 'error')
-                return flask.render_template(
-                    'contribute.html',
-                    election=election,
-                    form=form)
+        pictures = nuancier.app.get_storage(nuancierlib.storage.PICTURES)
+        path = '%s/%s' % (election.election_folder, filename)
 
         # Save candidate to the database
         try:
@@ -148,6 +154,8 @@ def contribute(election_id):
                 submitter_email=flask.g.fas_user.email,
                 election_id=election.id,
                 user=flask.g.fas_user.username,
+                candidate_dhash=dhash,
+                metadata=metadata,
             )
         except nuancierlib.NuancierException as err:
             flask.flash(err.message, 'error')
@@ -158,16 +166,27 @@ def contribute(election_id):
 
         # The PIL module has already read the stream so we need to back up
         candidate_file.seek(0)
-
-        candidate_file.save(
-            os.path.join(upload_folder, filename))
+        try:
+            metrics.UPLOAD_SIZE.observe(
+                pictures.put(path, candidate_file.stream))
+        except (IOError, OSError) as err:  # pragma: no cover
+            SESSION.rollback()
+            LOG.debug('ERROR: cannot add candidate file')
+            LOG.exception(err)
+            flask.flash(
+                'An error occured while writing the file, please '
+                'contact an administrator', 'error')
+            return flask.render_template(
+                'contribute.html',
+                election=election,
+                form=form)
 
         try:
             SESSION.commit()
         except SQLAlchemyError as err:  # pragma: no cover
             SESSION.rollback()
             # Remove file from the system if the db commit failed
-            os.unlink(os.path.join(upload_folder, filename))
+            pictures.delete(path)
             LOG.debug('ERROR: cannot add candidate - user: "%s" '
                       'election: "%s"', flask.g.fas_user.username,
                       election_id)
@@ -231,18 +250,18 @@ def election(election_id):
     candidates = nuancierlib.get_candidates(
         SESSION, election_id, approved=True)
 
+    user_name = None
     if hasattr(flask.g, 'fas_user') and flask.g.fas_user:
-        random.seed(
-            int(
-                hashlib.sha1(flask.g.fas_user.username).hexdigest(), 16
-            ) % 100000)
-    random.shuffle(candidates)
+        user_name = flask.g.fas_user.username
+    candidates = nuancier.lib.ordering.order_candidates(
+        candidates, user_name, region=nuancier.app.CACHE)
 
     return flask.render_template(
         'election.html',
         candidates=candidates,
         election=election,
         can_vote=can_vote,
+        sprites=_get_sprites(election),
         picture_folder=os.path.join(
             APP.config['PICTURE_FOLDER'], election.election_folder),
         cache_folder=os.path.join(
@@ -265,12 +284,8 @@ def vote(election_id):
         flask.flash('This election is not open', 'error')
         return flask.redirect(flask.url_for('index'))
 
-    if flask.g.fas_user:
-        random.seed(
-            int(
-                hashlib.sha1(flask.g.fas_user.username).hexdigest(), 16
-            ) % 100000)
-    random.shuffle(candidates)
+    candidates = nuancier.lib.ordering.order_candidates(
+        candidates, flask.g.fas_user.username, region=nuancier.app.CACHE)
 
     # How many votes the user made:
     votes = nuancierlib.get_votes_user(SESSION, election_id,
@@ -294,6 +309,7 @@ def vote(election_id):
         form=nuancier.forms.ConfirmationForm(),
         candidates=candidates,
         n_votes_done=len(votes),
+        sprites=_get_sprites(election),
         picture_folder=os.path.join(
             APP.config['PICTURE_FOLDER'], election.election_folder),
         cache_folder=os.path.join(
@@ -372,10 +388,10 @@ def process_vote(election_id):
         )
 
     # Allowed to vote, selection sufficient, choice confirmed: process
+    value = 1
+    if nuancier.app.has_weigthed_vote(flask.g.fas_user):
+        value = 2
     for selection in entries:
-        value = 1
-        if nuancier.has_weigthed_vote(flask.g.fas_user):
-            value = 2
         nuancierlib.add_vote(
             SESSION, selection, flask.g.fas_user.username, value=value)
 
@@ -390,6 +406,9 @@ def process_vote(election_id):
         flask.flash('An error occured while processing your votes, please '
                     'report this to your lovely admin or see logs for '
                     'more details', 'error')
+    else:
+        metrics.BALLOTS.inc()
+        metrics.VOTES.inc(len(entries))
 
     flask.flash('Your vote has been recorded, thank you for voting on '
                 '%s %s' % (election.election_name, election.election_year))
@@ -429,6 +448,7 @@ def results(election_id):
         'results.html',
         election=election,
         results=election_results,
+        candidates=[candidate for candidate, _ in election_results],
         picture_folder=os.path.join(
             APP.config['PICTURE_FOLDER'], election.election_folder),
         cache_folder=os.path.join(
@@ -499,7 +519,12 @@ def update_candidate(cand_id):
         candidate_file = flask.request.files['candidate_file']
 
         try:
-            validate_input_file(candidate_file)
+            metadata = validate_input_file(candidate_file)
+            candidate_file.seek(0)
+            metadata.update(
+                nuancierlib.get_picture_digest(candidate_file.stream))
+            candidate_file.seek(0)
+            dhash = nuancier.lib.duplicates.dhash(candidate_file.stream)
         except nuancierlib.NuancierException as err:
             LOG.debug('ERROR: Uploaded file is invalid - user: "%s" '
                       'election: "%s"', flask.g.fas_user.username,
@@ -511,38 +536,53 @@ def update_candidate(cand_id):
                 candidate=candidate,
                 form=form)
 
+        if nuancier.lib.model.Candidates.by_election_sha256(
+                SESSION, candidate.election_id, metadata['picture_sha256'],
+                exclude_id=candidate.id):
+            flask.flash(
+                'This picture has already been submitted to this election',
+                'error')
+            return flask.render_template(
+                'update_contribution.html',
+                candidate=candidate,
+                form=form)
+
         filename = secure_filename('%s-%s' % (flask.g.fas_user.username,
                                    candidate_file.filename))
 
         # Only save the file once everything has been safely saved in the DB
-        upload_folder = os.path.join(
-            APP.config['PICTURE_FOLDER'],
-            candidate.election.election_folder)
-        if not os.path.exists(upload_folder):  # pragma: no cover
-            try:
-                os.mkdir(upload_folder)
-            except OSError, err:
-                LOG.debug('ERROR: cannot add candidate file')
-                LOG.exception(err)
-                flask.flash(
-                    'An error occured while writing the file, please '
-                    'contact an administrator', 'error')
-                return flask.render_template(
-                    'update_contribution.html',
-                    candidate=candidate,
-                    form=form)
+        pictures = nuancier.app.get_storage(nuancierlib.storage.PICTURES)
+        path = '%s/%s' % (candidate.election.election_folder, filename)
+        old_path = '%s/%s' % (
+            candidate.election.election_folder, candidate.candidate_file)
 
         # Update the candidate
         form.populate_obj(obj=candidate)
         candidate.candidate_file = filename
+        candidate.candidate_dhash = dhash
+        candidate.candidate_placeholder = None
+        for key in nuancierlib.METADATA_FIELDS:
+            setattr(candidate, key, metadata[key])
         candidate.approved = False
         candidate.approved_motif = None
         SESSION.add(candidate)
 
         # The PIL module has already read the stream so we need to back up
         candidate_file.seek(0)
-        candidate_file.save(
-            os.path.join(upload_folder, filename))
+        try:
+            metrics.UPLOAD_SIZE.observe(
+                pictures.put(path, candidate_file.stream))
+        except (IOError, OSError) as err:  # pragma: no cover
+            SESSION.rollback()
+            LOG.debug('ERROR: cannot add candidate file')
+            LOG.exception(err)
+            flask.flash(
+                'An error occured while writing the file, please '
+                'contact an administrator', 'error')
+            return flask.render_template(
+                'update_contribution.html',
+                candidate=candidate,
+                form=form)
 
         try:
             SESSION.commit()
@@ -550,7 +590,7 @@ def update_candidate(cand_id):
             LOG.debug(err)
             SESSION.rollback()
             # Remove file from the system if the db commit failed
-            os.unlink(os.path.join(upload_folder, filename))
+            pictures.delete(path)
             LOG.debug('ERROR: cannot add candidate - user: "%s" '
                       'election: "%s"', flask.g.fas_user.username,
                       candidate.election.id)
@@ -563,6 +603,12 @@ def update_candidate(cand_id):
                 candidate=candidate,
                 form=form)
 
+        # The thumbnail and display version of the previous picture no
+        # longer apply
+        cache = nuancier.app.get_storage(nuancierlib.storage.CACHE)
+        cache.delete(old_path)
+        cache.delete(nuancierlib.get_display_path(old_path))
+
         flask.flash('Thanks for updating your submission')
         return flask.redirect(flask.url_for('index'))
 
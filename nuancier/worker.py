@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions
+# of the GNU General Public License v.2, or (at your option) any later
+# version.  This program is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+# PURPOSE.  See the GNU General Public License for more details.  You
+# should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Any Red Hat trademarks that are incorporated in the source
+# code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission
+# of Red Hat, Inc.
+#
+
+
+'''
+Worker running the jobs queued by the administration panel of nuancier.
+
+Installed as ``nuancier-worker``, it polls the database for queued jobs and
+runs them one after the other, spreading the files of each job over a pool
+of processes.
+'''
+
+import argparse
+import logging
+import multiprocessing
+import multiprocessing.util
+import sys
+import time
+
+import nuancier.config
+import nuancier.lib as nuancierlib
+import nuancier.lib.jobs
+import nuancier.metrics
+from nuancier.lib import model
+
+
+LOG = logging.getLogger('nuancier.worker')
+
+
+def parse_arguments(argv=None):
+    ''' Parse the arguments given on the command line. '''
+    parser = argparse.ArgumentParser(
+        prog='nuancier-worker',
+        description='Run the jobs queued by nuancier')
+    parser.add_argument(
+        '--config',
+        help='Configuration file to use in addition to the one pointed by '
+        'the NUANCIER_CONFIG environment variable.')
+    parser.add_argument(
+        '--processes', type=int, default=multiprocessing.cpu_count(),
+        help='Number of processes in which to run the jobs, defaults to '
+        'the number of CPUs.')
+    parser.add_argument(
+        '--interval', type=float, default=5,
+        help='Number of seconds to wait before looking again for jobs when '
+        'none is queued.')
+    parser.add_argument(
+        '--once', action='store_true', default=False,
+        help='Exit once all the queued jobs are done.')
+    parser.add_argument(
+        '--requeue', action='store_true', default=False,
+        help='Queue again the jobs left running, by a worker which has been '
+        'killed, before starting. Only use it if no other worker runs.')
+    return parser.parse_args(argv)
+
+
+def init_process(metrics_folder):
+    ''' Prepare a process of the pool of the worker.
+
+    :arg metrics_folder: the folder in which the processes share their
+        metrics.
+    '''
+    nuancier.metrics.REGISTRY.configure(metrics_folder)
+    # The processes of the pool do not run the atexit handlers
+    multiprocessing.util.Finalize(
+        None, nuancier.metrics.REGISTRY.flush, exitpriority=10)
+
+
+def run(session, config, pool=None, once=False, interval=5):
+    ''' Run the queued jobs, waiting for new ones unless ``once`` is set.
+
+    :arg session:
+    :arg config: the configuration of nuancier.
+    :kwarg pool: a ``multiprocessing.Pool`` in which to run the jobs.
+    :kwarg once: whether to return when no job is queued.
+    :kwarg interval: the number of seconds to wait between two looks for
+        queued jobs.
+    '''
+    while True:
+        job = model.Jobs.claim(session)
+        if job is None:
+            if once:
+                return
+            time.sleep(interval)
+            continue
+
+        LOG.info('Running job %s (%s)', job.id, job.job_type)
+        start = time.time()
+        nuancier.lib.jobs.run_job(session, job, config, pool)
+        LOG.info('Job %s %s in %.1fs', job.id, job.status,
+                 time.time() - start)
+
+
+def main(argv=None):
+    ''' Entry point of ``nuancier-worker``. '''
+    args = parse_arguments(argv)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    config = nuancier.config.load_config(args.config)
+    metrics_folder = config.get('NUANCIER_METRICS_FOLDER')
+    nuancier.metrics.REGISTRY.configure(metrics_folder)
+    session = nuancierlib.create_session(config['DB_URL'])
+    pool = None
+    if args.processes > 1:
+        pool = multiprocessing.Pool(
+            args.processes, init_process, (metrics_folder,))
+    try:
+        if args.requeue:
+            LOG.info('%s jobs queued again', model.Jobs.requeue_running(
+                session))
+        run(session, config, pool=pool, once=args.once,
+            interval=args.interval)
+        if pool is not None:
+            # Let the processes exit, and flush their metrics, by themselves
+            pool.close()
+            pool.join()
+            pool = None
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pool is not None:
+            pool.terminate()
+        session.remove()
+        nuancier.metrics.REGISTRY.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,9 @@
 #!/usr/bin/env python2
 
-# These two lines are needed to run on EL6
-__requires__ = ['SQLAlchemy >= 0.8', 'jinja2 >= 2.4']
-import pkg_resources
+import nuancier.bootstrap
+nuancier.bootstrap.select_versions()
 
 import argparse
-import sys
 import os
 
 
@@ -39,7 +37,9 @@ if args.config:
         config = os.path.join(os.getcwd(), config)
     os.environ['NUANCIER_CONFIG'] = config
 
-from nuancier import APP
+from nuancier.app import create_app
+
+APP = create_app()
 
 if args.profile:
     from werkzeug.contrib.profiler import ProfilerMiddleware
@@ -38,4 +38,14 @@ setup(
     include_package_data=True,
     install_requires=['Flask', 'SQLAlchemy>=0.6', 'wtforms', 'flask-wtf',
                       'python-fedora', 'Pillow', 'dogpile.cache', 'blinker'],
+    extras_require={
+        # Faster statistics on large elections
+        'numpy': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': [
+            'nuancier-admin = nuancier.cli:main',
+            'nuancier-worker = nuancier.worker:main',
+        ],
+    },
 )
@@ -23,13 +23,12 @@
 nuancier tests.
 '''
 
-__requires__ = ['SQLAlchemy >= 0.7']
-import pkg_resources
-
 import unittest
 import shutil
 import sys
 import os
+import threading
+import BaseHTTPServer
 
 from datetime import datetime
 from datetime import date
@@ -89,6 +88,60 @@ class FakeFasUser(object):
     email = 'pingou'
 
 
+class FakeS3(object):
+    """ Local stand-in for an S3-compatible object store, keeping the
+    objects in memory, for the tests of the S3 storage. """
+
+    def __init__(self):
+        """ Start the object store on a free port of localhost. """
+        self.objects = {}
+        self.requests = []
+        store = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            """ Answer the requests with the objects of the store. """
+
+            def log_message(self, *args):
+                pass
+
+            def _answer(self, status, body=''):
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _handle(self):
+                store.requests.append((self.command, self.path, dict(
+                    (key.lower(), value)
+                    for key, value in self.headers.items())))
+                if 'authorization' not in self.headers:
+                    return self._answer(403)
+                if self.command == 'PUT':
+                    length = int(self.headers['Content-Length'])
+                    store.objects[self.path] = self.rfile.read(length)
+                    return self._answer(200)
+                if self.path not in store.objects:
+                    return self._answer(404)
+                if self.command == 'DELETE':
+                    del store.objects[self.path]
+                    return self._answer(204)
+                return self._answer(200, store.objects[self.path])
+
+            do_GET = do_HEAD = do_PUT = do_DELETE = _handle
+
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.endpoint = 'http://127.0.0.1:%s' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop the object store. """
+        self.server.shutdown()
+        self.server.server_close()
+
+
 class Modeltests(unittest.TestCase):
     """ Model tests. """
 
@@ -120,6 +173,9 @@ class Modeltests(unittest.TestCase):
 
         ## Empty the database if it's not a sqlite
         if self.session.bind.driver != 'pysqlite':
+            self.session.execute('DROP TABLE "JobFiles" CASCADE;')
+            self.session.execute('DROP TABLE "Jobs" CASCADE;')
+            self.session.execute('DROP TABLE "Covotes" CASCADE;')
             self.session.execute('DROP TABLE "Votes" CASCADE;')
             self.session.execute('DROP TABLE "Candidates" CASCADE;')
             self.session.execute('DROP TABLE "Elections" CASCADE;')
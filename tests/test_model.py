@@ -23,9 +23,6 @@
 nuancier tests for the sqlalchemy model
 '''
 
-__requires__ = ['SQLAlchemy >= 0.7']
-import pkg_resources
-
 import unittest
 import sys
 import os
@@ -85,6 +82,22 @@ class NuancierModeltests(Modeltests):
             )
         )
 
+    def test_votes_by_election(self):
+        """ Test streaming the votes of an election. """
+        create_elections(self.session)
+        create_candidates(self.session)
+        create_votes(self.session)
+
+        votes = model.Votes.by_election(self.session, 1, yield_per=2)
+        self.assertEqual(
+            [('pingou', 1), ('pingou', 2), ('ralph', 1), ('toshio', 1),
+             ('toshio', 2)],
+            [(vote.user_name, vote.candidate_id) for vote in votes])
+
+        votes = model.Votes.by_election(
+            self.session, 2, columns=(model.Votes.user_name,))
+        self.assertEqual([('pingou',), ('ralph',), ('ralph',)], list(votes))
+
     def test_elections_api_repr(self):
         """ Test the api_repr function of Elections. """
         create_elections(self.session)
@@ -23,27 +23,35 @@
 nuancier tests for the internal api lib.
 '''
 
-__requires__ = ['SQLAlchemy >= 0.7']
-import pkg_resources
-
+import json
 import unittest
 import shutil
 import sys
 import os
+import tempfile
 from datetime import timedelta
 
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import IntegrityError
+import werkzeug.test
+import werkzeug.wsgi
 
 sys.path.insert(0, os.path.join(os.path.dirname(
     os.path.abspath(__file__)), '..'))
 
-import nuancier
+import nuancier.app
+import nuancier.instrumentation
+import nuancier.lib.jobs
+import nuancier.lib.packs
+import nuancier.lib.sprites
+import nuancier.publish
+import nuancier.templating
 import nuancier.lib as nuancierlib
 from nuancier.lib import model
 from tests import (Modeltests, create_elections, create_candidates,
                    create_votes, FakeFasUser, user_set, approve_candidate,
-                   deny_candidate, CACHE_FOLDER, PICTURE_FOLDER, TODAY)
+                   deny_candidate, CACHE_FOLDER, FakeS3, PICTURE_FOLDER,
+                   TODAY)
 
 
 FILE_OK = os.path.join(
@@ -77,6 +85,8 @@ FILE_NOTOK4 = os.path.join(
     'small.txt'
 )
 
+nuancier.app.create_app()
+
 
 class Nuanciertests(Modeltests):
     """ Nuancier tests. """
@@ -85,37 +95,159 @@ class Nuanciertests(Modeltests):
         """ Set up the environnment, ran before every tests. """
         super(Nuanciertests, self).setUp()
 
-        nuancier.APP.config['TESTING'] = True
-        nuancier.APP.logger.handlers = []
-        nuancier.SESSION = self.session
+        nuancier.app.APP.config['TESTING'] = True
+        nuancier.app.APP.logger.handlers = []
+        nuancier.app.SESSION = self.session
         nuancier.admin.SESSION = self.session
+        nuancier.api.SESSION = self.session
         nuancier.ui.SESSION = self.session
-        nuancier.APP.config['PICTURE_FOLDER'] = PICTURE_FOLDER
-        nuancier.APP.config['CACHE_FOLDER'] = CACHE_FOLDER
-        self.app = nuancier.APP.test_client()
+        nuancier.app.APP.config['PICTURE_FOLDER'] = PICTURE_FOLDER
+        nuancier.app.APP.config['CACHE_FOLDER'] = CACHE_FOLDER
+        self.app = nuancier.app.APP.test_client()
+
+    def test_compat_app(self):
+        """ Test the application and session kept on the nuancier module.
+        """
+        self.assertTrue(nuancier.APP is nuancier.app.APP)
+        self.assertTrue(nuancier.SESSION is self.session)
+        self.assertTrue('APP' in dir(nuancier))
+        self.assertRaises(AttributeError, getattr, nuancier, 'UNKNOWN')
 
     def test_is_nuancier_admin(self):
         """ Test the is_nuancier_admin function. """
 
-        output = nuancier.is_nuancier_admin(None)
+        output = nuancier.app.is_nuancier_admin(None)
         self.assertFalse(output)
 
         user = FakeFasUser()
         user.groups = ['packager', 'cla_done']
 
-        output = nuancier.is_nuancier_admin(user)
+        output = nuancier.app.is_nuancier_admin(user)
         self.assertFalse(output)
 
         user.groups = []
 
-        output = nuancier.is_nuancier_admin(user)
+        output = nuancier.app.is_nuancier_admin(user)
         self.assertFalse(output)
 
         user.groups.append('sysadmin-main')
 
-        output = nuancier.is_nuancier_admin(user)
+        output = nuancier.app.is_nuancier_admin(user)
         self.assertTrue(output)
 
+    def test_get_user_roles(self):
+        """ Test the get_user_roles function. """
+
+        roles = nuancier.app.get_user_roles(None)
+        self.assertFalse(roles.admin)
+        self.assertFalse(roles.reviewer)
+        self.assertFalse(roles.weighted)
+
+        user = FakeFasUser()
+        user.groups = ['designteam', 'cla_done']
+
+        roles = nuancier.app.get_user_roles(user)
+        self.assertFalse(roles.admin)
+        self.assertTrue(roles.reviewer)
+        self.assertTrue(roles.weighted)
+
+        # Within a request, the roles are resolved once and kept on flask.g
+        with user_set(nuancier.app.APP, user):
+            with nuancier.app.APP.test_request_context('/'):
+                roles = nuancier.app.get_user_roles(user)
+                self.assertTrue(roles is nuancier.app.get_user_roles(user))
+                self.assertTrue(nuancier.app.is_nuancier_reviewer(user))
+                self.assertFalse(nuancier.app.is_nuancier_admin(user))
+
+    def test_request_timer(self):
+        """ Test the per-request timing and query count instrumentation. """
+        create_elections(self.session)
+        timer = nuancier.app.APP.wsgi_app
+
+        # The timings are only shown to the clients if asked
+        output = self.app.get('/')
+        self.assertEqual(output.status_code, 200)
+        self.assertFalse('Server-Timing' in output.headers)
+
+        timer.header = True
+        try:
+            output = self.app.get('/')
+        finally:
+            timer.header = False
+        self.assertEqual(output.status_code, 200)
+        timing = output.headers['Server-Timing']
+        self.assertTrue(timing.startswith('app;dur='))
+        self.assertTrue('db;dur=' in timing)
+        self.assertFalse('desc="0 queries"' in timing)
+
+        # The request is accounted as soon as the application returns
+        self.assertTrue('<h1>Nuancier</h1>' in output.data)
+        self.assertTrue('index' in timer.endpoints)
+        count = timer.endpoints['index'][0]
+        self.app.get('/')
+        self.assertEqual(timer.endpoints['index'][0], count + 1)
+
+        # The files are handed back to the server as they are, so that it
+        # can send them with sendfile
+        class FileWrapper(werkzeug.wsgi.FileWrapper):
+            pass
+
+        environ = werkzeug.test.EnvironBuilder(
+            '/pictures/F20/small.JPG').get_environ()
+        environ['wsgi.file_wrapper'] = FileWrapper
+        count = timer.endpoints.get('base_picture', (0,))[0]
+        body = timer(environ, lambda status, headers, exc_info=None: None)
+        self.assertTrue(isinstance(body, FileWrapper))
+        self.assertEqual(timer.endpoints['base_picture'][0], count + 1)
+        body.close()
+
+        # A streamed body is accounted to its request until it is sent
+        recorded = []
+
+        def streamed_app(environ, start_response):
+            environ['nuancier.stats'].streamed = True
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+
+            def chunks():
+                for chunk in ['a', 'b']:
+                    stats = nuancier.instrumentation.current_stats()
+                    stats.queries += 1
+                    yield chunk
+            return chunks()
+
+        streamed = nuancier.instrumentation.RequestTimer(streamed_app)
+        streamed.record = lambda environ, stats: recorded.append(stats)
+        body = streamed({}, lambda status, headers, exc_info=None: None)
+        self.assertEqual([], recorded)
+        self.assertEqual('ab', ''.join(body))
+        body.close()
+        self.assertEqual(1, len(recorded))
+        self.assertEqual(2, recorded[0].queries)
+        self.assertEqual(None, nuancier.instrumentation.current_stats())
+
+        # Or until it is closed, if it is not sent entirely
+        body = streamed({}, lambda status, headers, exc_info=None: None)
+        self.assertEqual('a', next(iter(body)))
+        self.assertEqual(1, len(recorded))
+        body.close()
+        self.assertEqual(2, len(recorded))
+        self.assertEqual(1, recorded[1].queries)
+
+    def test_metrics(self):
+        """ Test the metrics function. """
+        self.app.get('/')
+
+        output = self.app.get('/metrics')
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue(output.content_type.startswith('text/plain'))
+        self.assertTrue(
+            '# TYPE nuancier_request_duration_seconds histogram'
+            in output.data)
+        self.assertTrue(
+            'nuancier_request_duration_seconds_count{endpoint="index"}'
+            in output.data)
+        self.assertTrue('# TYPE nuancier_votes_total counter' in output.data)
+
     def test_login(self):
         """ Test the login function. """
         output = self.app.get('/login')
@@ -134,7 +266,7 @@ class Nuanciertests(Modeltests):
         self.assertTrue('<h1>Nuancier</h1>' in output.data)
 
         user = FakeFasUser()
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/logout/', follow_redirects=True)
             self.assertEqual(output.status_code, 200)
             self.assertTrue(
@@ -155,6 +287,103 @@ class Nuanciertests(Modeltests):
         # cache hasn't been generated
         self.assertEqual(output.status_code, 404)
 
+    def test_base_cache_pack(self):
+        """ Test the base_cache function when the thumbnails are packed. """
+        create_elections(self.session)
+        create_candidates(self.session)
+        election = nuancierlib.get_election(self.session, 2)
+        nuancierlib.generate_cache(
+            self.session, election, PICTURE_FOLDER, CACHE_FOLDER, pack=True)
+        pack = nuancier.lib.packs.get_pack(os.path.join(CACHE_FOLDER, 'F20'))
+
+        output = self.app.get('/cache/F20/small.JPG')
+        self.assertEqual(output.status_code, 404)
+
+        nuancier.app.APP.config['NUANCIER_THUMBNAIL_PACKS'] = True
+        try:
+            output = self.app.get('/cache/F20/small.JPG')
+            self.assertEqual(output.status_code, 200)
+            self.assertEqual('image/jpeg', output.headers['Content-Type'])
+            self.assertEqual(pack.get('small.JPG'), output.data)
+            etag = output.headers['ETag']
+            self.assertEqual('"%s"' % pack.digest('small.JPG'), etag)
+
+            output = self.app.get(
+                '/cache/F20/small.JPG', headers={'If-None-Match': etag})
+            self.assertEqual(output.status_code, 304)
+
+            output = self.app.get('/cache/F20/ok.JPG')
+            self.assertEqual(output.status_code, 404)
+
+            # A thumbnail generated again is not served from the pack
+            nuancierlib.generate_thumbnail(
+                'F20/small.JPG', PICTURE_FOLDER, CACHE_FOLDER, (64, 64))
+            thumbnail_path = os.path.join(CACHE_FOLDER, 'F20', 'small.JPG')
+            with open(thumbnail_path) as stream:
+                thumbnail = stream.read()
+            output = self.app.get('/cache/F20/small.JPG')
+            self.assertEqual(output.status_code, 200)
+            self.assertEqual(thumbnail, output.data)
+            self.assertNotEqual(pack.get('small.JPG'), output.data)
+        finally:
+            nuancier.app.APP.config['NUANCIER_THUMBNAIL_PACKS'] = False
+
+    def test_base_s3(self):
+        """ Test serving the pictures stored in an object store. """
+        fake = FakeS3()
+        nuancier.app.APP.config['NUANCIER_STORAGE'] = 's3'
+        nuancier.app.APP.config['NUANCIER_S3'] = {
+            'endpoint': fake.endpoint,
+            'bucket': 'nuancier',
+            'access_key': 'key',
+            'secret_key': 'secret',
+        }
+        try:
+            output = self.app.get('/pictures/F20/small.JPG')
+            self.assertEqual(output.status_code, 302)
+            self.assertTrue(output.headers['Location'].startswith(
+                '%s/nuancier/pictures/F20/small.JPG?X-Amz-Algorithm='
+                % fake.endpoint))
+
+            output = self.app.get('/cache/F20/small.JPG')
+            self.assertEqual(output.status_code, 302)
+            self.assertTrue(output.headers['Location'].startswith(
+                '%s/nuancier/cache/F20/small.JPG?' % fake.endpoint))
+
+            output = self.app.get('/display/F20/small.JPG.jpg')
+            self.assertEqual(output.status_code, 302)
+            self.assertTrue(
+                output.headers['Location'].endswith('/pictures/F20/small.JPG'))
+
+            fake.objects['/nuancier/cache/F20/display/small.JPG.jpg'] = 'a'
+            output = self.app.get('/display/F20/small.JPG.jpg')
+            self.assertEqual(output.status_code, 302)
+            self.assertTrue(output.headers['Location'].startswith(
+                '%s/nuancier/cache/F20/display/small.JPG.jpg?'
+                % fake.endpoint))
+        finally:
+            nuancier.app.APP.config['NUANCIER_STORAGE'] = 'local'
+            fake.stop()
+
+    def test_base_display(self):
+        """ Test the base_display function. """
+
+        # No display version, the original is served instead
+        output = self.app.get('/display/F20/small.JPG.jpg')
+        self.assertEqual(output.status_code, 302)
+        self.assertTrue(
+            output.headers['Location'].endswith('/pictures/F20/small.JPG'))
+
+        os.makedirs(os.path.join(CACHE_FOLDER, 'F20', 'display'))
+        with open(os.path.join(
+                CACHE_FOLDER, 'F20', 'display', 'small.JPG.jpg'), 'w') \
+                as stream:
+            stream.write('display')
+        output = self.app.get('/display/F20/small.JPG.jpg')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual('image/jpeg', output.headers['Content-Type'])
+        self.assertEqual('display', output.data)
+
     def test_index(self):
         """ Test the index function. """
 
@@ -200,7 +429,7 @@ class Nuanciertests(Modeltests):
 
         # Fails - No election in the DB
         user = FakeFasUser()
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/contribute/1')
             self.assertEqual(output.status_code, 200)
             self.assertTrue('<li class="error">No election found</li>'
@@ -210,7 +439,7 @@ class Nuanciertests(Modeltests):
         upload_path = os.path.join(PICTURE_FOLDER, 'F21')
 
         # Fails - Election closed for submission
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/contribute/2', follow_redirects=True)
             self.assertEqual(output.status_code, 200)
             self.assertTrue(
@@ -220,7 +449,7 @@ class Nuanciertests(Modeltests):
 
         # Fails - CLA not done
         user.cla_done = False
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/contribute/3')
             self.assertEqual(output.status_code, 302)
 
@@ -231,7 +460,7 @@ class Nuanciertests(Modeltests):
                 'License Agreement to use nuancier</li>' in output.data)
 
         user.cla_done = True
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/contribute/3')
             self.assertEqual(output.status_code, 200)
             self.assertTrue('<h1>Contribute a supplemental wallpaper</h1>'
@@ -388,11 +617,7 @@ class Nuanciertests(Modeltests):
                 self.assertTrue('<h1>Contribute a supplemental wallpaper</h1>'
                                 in output.data)
 
-            self.assertEqual(
-                os.listdir(upload_path), [])
-            self.assertTrue(os.path.exists(upload_path))
-            shutil.rmtree(upload_path)
-
+            # The storage only creates the folder when it writes a file
             self.assertFalse(os.path.exists(upload_path))
 
     def test_elections_list(self):
@@ -456,6 +681,9 @@ class Nuanciertests(Modeltests):
                         in output.data)
         self.assertEqual(output.data.count("data-lightbox='Wallpaper F19"),
                          2)
+        self.assertTrue('href="/display/F19/ok.JPG.jpg"' in output.data)
+        self.assertEqual(
+            output.data.count('" download>Download the original</a>'), 2)
 
         output = self.app.get('/election/3/')
         self.assertEqual(output.status_code, 302)
@@ -470,7 +698,7 @@ class Nuanciertests(Modeltests):
         self.assertEqual(output.status_code, 302)
 
         user = FakeFasUser()
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/election/2/')
             self.assertEqual(output.status_code, 302)
             self.assertTrue('target URL: <a href="/election/2/vote/">'
@@ -484,7 +712,7 @@ class Nuanciertests(Modeltests):
 
         create_votes(self.session)
 
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
 
             output = self.app.get('/election/2/')
             self.assertEqual(output.status_code, 302)
@@ -498,7 +726,7 @@ class Nuanciertests(Modeltests):
             self.assertTrue('var votelimit = 2 - 1;' in output.data)
 
         user.username = 'ralph'
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
 
             output = self.app.get('/election/2/')
             self.assertEqual(output.status_code, 200)
@@ -511,6 +739,36 @@ class Nuanciertests(Modeltests):
             self.assertEqual(output.data.count("data-lightbox='Wallpaper F20"),
                              3)
 
+    def test_vote_sprites(self):
+        """ Test the vote function when the thumbnails are in sprites. """
+        create_elections(self.session)
+        create_candidates(self.session)
+        approve_candidate(self.session)
+        election = nuancierlib.get_election(self.session, 2)
+        nuancierlib.generate_cache(
+            self.session, election, PICTURE_FOLDER, CACHE_FOLDER)
+        sprites = nuancier.lib.sprites.build_sprites(
+            self.session, election, CACHE_FOLDER, (128, 128))
+
+        user = FakeFasUser()
+        with user_set(nuancier.app.APP, user):
+            output = self.app.get('/election/2/vote/')
+            self.assertEqual(output.status_code, 200)
+            self.assertFalse('sprite' in output.data)
+
+            nuancier.app.APP.config['NUANCIER_SPRITES'] = True
+            try:
+                output = self.app.get('/election/2/vote/')
+            finally:
+                nuancier.app.APP.config['NUANCIER_SPRITES'] = False
+            self.assertEqual(output.status_code, 200)
+            self.assertTrue(
+                '/cache/F20/sprites/%s' % sprites['stylesheet']
+                in output.data)
+            self.assertEqual(3, output.data.count(
+                '<span class="smallthumb sprite sprite-'))
+            self.assertFalse('<img class="smallthumb"' in output.data)
+
     def test_vote(self):
         """ Test the vote function. """
         ## Login required
@@ -523,7 +781,7 @@ class Nuanciertests(Modeltests):
         user = FakeFasUser()
         # Fails; not CLA + 1
         user.groups = []
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/election/1/vote/', follow_redirects=True)
             self.assertEqual(output.status_code, 200)
             self.assertTrue('<li class="error">You must be in one more '
@@ -532,7 +790,7 @@ class Nuanciertests(Modeltests):
         # Fails; CLA not signed
         user.groups = ['packager', 'cla_done']
         user.cla_done = False
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/election/1/vote/', follow_redirects=True)
             self.assertEqual(output.status_code, 200)
             self.assertTrue('<li class="error">You must sign the CLA '
@@ -541,7 +799,7 @@ class Nuanciertests(Modeltests):
 
         # Works
         user.cla_done = True
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/election/1/vote')
             self.assertEqual(output.status_code, 301)
 
@@ -555,7 +813,7 @@ class Nuanciertests(Modeltests):
         approve_candidate(self.session)
 
         user = FakeFasUser()
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/election/1/vote/')
             self.assertEqual(output.status_code, 302)
 
@@ -572,7 +830,7 @@ class Nuanciertests(Modeltests):
         create_votes(self.session)
 
         user.username = 'ralph'
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/election/2/vote/', follow_redirects=True)
             self.assertTrue('<h1>Election: Wallpaper F20 - 2013</h1>'
                             in output.data)
@@ -592,7 +850,7 @@ class Nuanciertests(Modeltests):
         user = FakeFasUser()
         # Fails; not CLA + 1
         user.groups = []
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.post('/election/1/voted/',
                                    follow_redirects=True)
             self.assertEqual(output.status_code, 200)
@@ -602,7 +860,7 @@ class Nuanciertests(Modeltests):
         # Fails; CLA not signed
         user.groups = ['packager', 'cla_done']
         user.cla_done = False
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.post('/election/1/voted/',
                                    follow_redirects=True)
             self.assertEqual(output.status_code, 200)
@@ -612,7 +870,7 @@ class Nuanciertests(Modeltests):
 
         # Fails: no elections
         user.cla_done = True
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             # Edit the first election
             output = self.app.get('/election/1/vote/')
             self.assertEqual(output.status_code, 200)
@@ -624,7 +882,7 @@ class Nuanciertests(Modeltests):
         approve_candidate(self.session)
 
         # Works
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             # No CSRF
             output = self.app.post('/election/1/voted/')
             self.assertEqual(output.status_code, 200)
@@ -729,7 +987,7 @@ class Nuanciertests(Modeltests):
         # Works
         user.username = 'toshio'
         user.groups.append('designteam')
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             # Works
             data = {
                 'selection': [3, 4],
@@ -817,7 +1075,7 @@ class Nuanciertests(Modeltests):
         # Fails - not an admin
         user = FakeFasUser()
         user.groups = ['packager', 'cla_done']
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/')
             self.assertEqual(output.status_code, 302)
 
@@ -829,7 +1087,7 @@ class Nuanciertests(Modeltests):
 
         # Fails - did not sign the CLA
         user.cla_done = False
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/')
             self.assertEqual(output.status_code, 302)
 
@@ -845,7 +1103,7 @@ class Nuanciertests(Modeltests):
         # Fails - is not CLA + 1
         user.cla_done = True
         user.groups = []
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/')
             self.assertEqual(output.status_code, 302)
 
@@ -859,7 +1117,7 @@ class Nuanciertests(Modeltests):
 
         # Success
         user.groups = ['packager', 'cla_done', 'sysadmin-main']
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/')
             self.assertEqual(output.status_code, 200)
             self.assertTrue('<h1>Nuancier Admin -- Version'
@@ -890,7 +1148,7 @@ class Nuanciertests(Modeltests):
         self.assertEqual(output.status_code, 302)
 
         user = FakeFasUser()
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/1/edit/')
             self.assertEqual(output.status_code, 302)
 
@@ -901,14 +1159,14 @@ class Nuanciertests(Modeltests):
                 'reviewer of nuancier</li>' in output.data)
 
         user.groups.append('designteam')
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/1/edit/', follow_redirects=True)
             self.assertEqual(output.status_code, 200)
             self.assertTrue('<li class="error">You are not an administrator'
                             ' of nuancier</li>' in output.data)
 
         user.groups.append('sysadmin-main')
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/1/edit/')
             self.assertEqual(output.status_code, 200)
             self.assertTrue('<li class="error">No election found</li>'
@@ -916,7 +1174,7 @@ class Nuanciertests(Modeltests):
 
         create_elections(self.session)
 
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             # Check the admin page before the edit
             output = self.app.get('/admin/')
             self.assertEqual(output.status_code, 200)
@@ -1020,7 +1278,7 @@ class Nuanciertests(Modeltests):
 
         user = FakeFasUser()
         user.groups = ['packager', 'cla_done']
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/new/')
             self.assertEqual(output.status_code, 302)
 
@@ -1031,7 +1289,7 @@ class Nuanciertests(Modeltests):
                 'reviewer of nuancier</li>' in output.data)
 
         user.groups.append('designteam')
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/new/', follow_redirects=True)
             self.assertEqual(output.status_code, 200)
             self.assertTrue('<li class="error">You are not an administrator'
@@ -1040,7 +1298,7 @@ class Nuanciertests(Modeltests):
         user.groups.append('sysadmin-main')
         create_elections(self.session)
 
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             # Check the admin page before the edit
             output = self.app.get('/admin/')
             self.assertEqual(output.status_code, 200)
@@ -1207,7 +1465,7 @@ class Nuanciertests(Modeltests):
 
         user = FakeFasUser()
         user.groups = ['packager', 'cla_done']
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/review/1/')
             self.assertEqual(output.status_code, 302)
 
@@ -1219,7 +1477,7 @@ class Nuanciertests(Modeltests):
 
         user.groups.append('sysadmin-main')
 
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/review/1/', follow_redirects=True)
             self.assertEqual(output.status_code, 200)
             self.assertTrue('<li class="error">No election found</li>'
@@ -1227,7 +1485,7 @@ class Nuanciertests(Modeltests):
 
         create_elections(self.session)
 
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/review/1/', follow_redirects=True)
             self.assertEqual(output.status_code, 200)
             self.assertTrue('<li class="error">The results of this election'
@@ -1262,7 +1520,7 @@ class Nuanciertests(Modeltests):
 
         user = FakeFasUser()
         user.groups = ['packager', 'cla_done']
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.post('/admin/review/1/process')
             self.assertEqual(output.status_code, 302)
 
@@ -1274,7 +1532,7 @@ class Nuanciertests(Modeltests):
                 'reviewer of nuancier</li>' in output.data)
 
         user.groups.append('designteam')
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.post('/admin/review/1/process',
                                    follow_redirects=True)
             self.assertEqual(output.status_code, 200)
@@ -1285,7 +1543,7 @@ class Nuanciertests(Modeltests):
         create_elections(self.session)
         create_candidates(self.session)
 
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.post('/admin/review/1/process',
                                    follow_redirects=True)
             self.assertEqual(output.status_code, 200)
@@ -1309,7 +1567,7 @@ class Nuanciertests(Modeltests):
             self.assertTrue('<li class="error">No election found</li>'
                             in output.data)
 
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             # Check the review page before changes
             output = self.app.get('/admin/review/3/all')
             self.assertEqual(output.status_code, 200)
@@ -1475,7 +1733,7 @@ class Nuanciertests(Modeltests):
 
         user = FakeFasUser()
         user.groups = ['packager', 'cla_done']
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/cache/2')
             self.assertEqual(output.status_code, 302)
 
@@ -1487,28 +1745,33 @@ class Nuanciertests(Modeltests):
 
         user.groups.append('sysadmin-main')
 
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/admin/cache/2', follow_redirects=True)
             self.assertEqual(output.status_code, 200)
             self.assertTrue('<li class="error">No election found</li>'
                             in output.data)
 
         create_elections(self.session)
+        create_candidates(self.session)
+
+        with user_set(nuancier.app.APP, user):
+            output = self.app.get('/admin/cache/2')
+            self.assertEqual(output.status_code, 302)
+            self.assertTrue('/admin/job/1/' in output.location)
 
-        with user_set(nuancier.APP, user):
             output = self.app.get('/admin/cache/2', follow_redirects=True)
             self.assertEqual(output.status_code, 200)
-            self.assertTrue('<li class="message">Cache regenerated for '
-                            'election Wallpaper F20</li>' in output.data)
+            self.assertTrue('<li class="message">Cache regeneration queued '
+                            'for election Wallpaper F20</li>' in output.data)
+            self.assertTrue('<h1>Job 1: thumbnails' in output.data)
+            self.assertTrue('<a href="/admin/">Back</a>' in output.data)
 
+            # The job still queued is re-used
             output = self.app.get(
                 '/admin/cache/2?next=/', follow_redirects=True)
             self.assertEqual(output.status_code, 200)
-            self.assertTrue('<li class="message">Cache regenerated for '
-                            'election Wallpaper F20</li>' in output.data)
-            self.assertTrue('<h1>Nuancier</h1>' in output.data)
-            self.assertTrue('<h3>Vote</h3>' in output.data)
-            self.assertTrue('<h3>Contribute</h3>' in output.data)
+            self.assertTrue('<h1>Job 1: thumbnails' in output.data)
+            self.assertTrue('<a href="/">Back</a>' in output.data)
 
             output = self.app.get('/admin/cache/1', follow_redirects=True)
             self.assertEqual(output.status_code, 200)
@@ -1517,6 +1780,80 @@ class Nuanciertests(Modeltests):
 
         self.assertTrue(os.path.exists(CACHE_FOLDER))
 
+    def test_admin_review_duplicates(self):
+        """ Test flagging the possible duplicates in admin_review. """
+        create_elections(self.session)
+        create_candidates(self.session)
+
+        user = FakeFasUser()
+        user.groups = ['sysadmin-main', 'cla_done']
+        with user_set(nuancier.app.APP, user):
+            output = self.app.get('/admin/review/2/', follow_redirects=True)
+            self.assertEqual(output.status_code, 200)
+            self.assertFalse('Possible duplicate of' in output.data)
+
+        candidates = nuancierlib.get_candidates(self.session, 2)
+        candidates[0].candidate_dhash = 'd2db2f2f1f1b076f'
+        candidates[1].candidate_dhash = 'd2db2f2f1f1b0760'
+        candidates[2].candidate_dhash = '0f0f0f0f17d8f8ff'
+        self.session.commit()
+
+        with user_set(nuancier.app.APP, user):
+            output = self.app.get('/admin/review/2/', follow_redirects=True)
+            self.assertEqual(output.status_code, 200)
+            self.assertEqual(2, output.data.count('Possible duplicate of'))
+            self.assertEqual(2, output.data.count('4 bits off)'))
+
+    def test_admin_job(self):
+        """ Test the admin_job and admin_job_progress functions. """
+        output = self.app.get('/admin/job/1/progress')
+        self.assertEqual(output.status_code, 302)
+
+        user = FakeFasUser()
+        user.groups = ['sysadmin-main', 'cla_done']
+        with user_set(nuancier.app.APP, user):
+            output = self.app.get('/admin/job/1/')
+            self.assertEqual(output.status_code, 200)
+            self.assertTrue('<li class="error">No job found</li>'
+                            in output.data)
+
+            output = self.app.get('/admin/job/1/progress')
+            self.assertEqual(output.status_code, 404)
+
+        create_elections(self.session)
+        create_candidates(self.session)
+        election = nuancierlib.get_election(self.session, 2)
+        nuancier.lib.jobs.enqueue_thumbnails(
+            self.session, election, 'pingou', PICTURE_FOLDER, CACHE_FOLDER)
+        self.session.commit()
+
+        with user_set(nuancier.app.APP, user):
+            output = self.app.get('/admin/job/1/?next=http://example.com/')
+            self.assertEqual(output.status_code, 200)
+            self.assertTrue('<a href="/admin/">Back</a>' in output.data)
+            self.assertTrue('setTimeout(update_job' in output.data)
+
+            output = self.app.get('/admin/job/1/progress')
+            self.assertEqual(output.status_code, 200)
+            data = json.loads(output.data)
+            self.assertEqual('queued', data['status'])
+            self.assertEqual(3, data['total'])
+            self.assertEqual(0, data['done'])
+            self.assertEqual(
+                ['queued', 'queued', 'queued'],
+                [item['status'] for item in data['files']])
+
+            nuancier.lib.jobs.run_job(
+                self.session, model.Jobs.claim(self.session),
+                nuancier.app.APP.config)
+
+            data = json.loads(self.app.get('/admin/job/1/progress').data)
+            self.assertEqual('done', data['status'])
+            self.assertEqual(3, data['done'])
+
+            output = self.app.get('/admin/job/1/')
+            self.assertFalse('setTimeout(update_job' in output.data)
+
     def test_stats(self):
         """ Test the stats function. """
         output = self.app.get('/stats/2/')
@@ -1541,6 +1878,372 @@ class Nuanciertests(Modeltests):
         self.assertTrue('<div id="placeholder" class="demo-placeholder">'
                         '</div>' in output.data)
 
+    def test_admin_covotes(self):
+        """ Test the admin_covotes function. """
+        user = FakeFasUser()
+        user.groups = ['packager', 'cla_done', 'sysadmin-main']
+
+        with user_set(nuancier.app.APP, user):
+            output = self.app.get('/admin/1/covotes/')
+            self.assertEqual(output.status_code, 200)
+            self.assertTrue('<li class="error">No election found</li>'
+                            in output.data)
+
+        create_elections(self.session)
+        create_candidates(self.session)
+        create_votes(self.session)
+
+        with user_set(nuancier.app.APP, user):
+            output = self.app.get('/admin/2/covotes/', follow_redirects=True)
+            self.assertEqual(output.status_code, 200)
+            self.assertTrue('<li class="error">This election is not closed '
+                            'yet</li>' in output.data)
+
+            output = self.app.get('/admin/1/covotes/')
+            self.assertEqual(output.status_code, 200)
+            self.assertTrue('<h1>Co-votes: Wallpaper F19 - 2013</h1>'
+                            in output.data)
+            self.assertTrue('The co-votes of this election have not been '
+                            'computed yet.' in output.data)
+
+            csrf_token = output.data.split(
+                'name="csrf_token" type="hidden" value="')[1].split('">')[0]
+
+            output = self.app.post(
+                '/admin/1/covotes/', data={'csrf_token': csrf_token},
+                follow_redirects=True)
+            self.assertEqual(output.status_code, 200)
+            self.assertTrue(
+                '<li class="message">Co-votes computed for election '
+                'Wallpaper F19: 1 pairs of candidates</li>' in output.data)
+            self.assertTrue('Image too narrow:\n                    2 users'
+                            '\n                    (66.7%)' in output.data)
+
+    def test_admin_export(self):
+        """ Test the admin_export function. """
+        user = FakeFasUser()
+        user.groups = ['packager', 'cla_done', 'sysadmin-main']
+
+        with user_set(nuancier.app.APP, user):
+            output = self.app.get('/admin/1/export/votes.csv')
+            self.assertEqual(output.status_code, 200)
+            self.assertTrue('<li class="error">No election found</li>'
+                            in output.data)
+
+        create_elections(self.session)
+        create_candidates(self.session)
+        approve_candidate(self.session)
+        create_votes(self.session)
+
+        with user_set(nuancier.app.APP, user):
+            output = self.app.get(
+                '/admin/2/export/votes.csv', follow_redirects=True)
+            self.assertEqual(output.status_code, 200)
+            self.assertTrue('<li class="error">This election is not closed '
+                            'yet</li>' in output.data)
+
+            output = self.app.get(
+                '/admin/1/export/ballots.csv', follow_redirects=True)
+            self.assertEqual(output.status_code, 200)
+            self.assertTrue('<li class="error">Cannot export "ballots"'
+                            in output.data)
+
+            output = self.app.get('/admin/1/export/results.csv')
+            self.assertEqual(output.status_code, 200)
+            self.assertEqual(output.mimetype, 'text/csv')
+            self.assertEqual(
+                output.headers['Content-Disposition'],
+                'attachment; filename=F19-results.csv')
+            self.assertEqual(
+                output.data.splitlines()[1], '1,1,Image ok,pingou,3,3')
+
+            output = self.app.get('/admin/2/export/candidates.ndjson')
+            self.assertEqual(output.status_code, 200)
+            self.assertEqual(3, len(output.data.splitlines()))
+
+        user.groups = ['packager', 'cla_done', 'designteam']
+        with user_set(nuancier.app.APP, user):
+            output = self.app.get(
+                '/admin/1/export/votes.csv', follow_redirects=True)
+            self.assertTrue('<li class="error">You are not an administrator '
+                            'of nuancier</li>' in output.data)
+
+    def test_api_elections(self):
+        """ Test the api_elections function. """
+        output = self.app.get('/api/v1/elections')
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertEqual(data['elections'], [])
+        self.assertEqual(data['total'], 0)
+
+        create_elections(self.session)
+
+        output = self.app.get('/api/v1/elections?per_page=2')
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertEqual(
+            [election['name'] for election in data['elections']],
+            ['Wallpaper F21', 'Wallpaper F20'])
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(data['pages'], 2)
+        self.assertEqual(data['elections'][1]['election_open'], True)
+        self.assertEqual(
+            data['elections'][1]['date_end'],
+            (TODAY + timedelta(days=3)).isoformat())
+
+        output = self.app.get(
+            '/api/v1/elections?per_page=2&page=2&fields=id,name')
+        data = json.loads(output.data)
+        self.assertEqual(
+            data['elections'], [{'id': 1, 'name': 'Wallpaper F19'}])
+
+        output = self.app.get('/api/v1/elections?fields=id,votes')
+        self.assertEqual(output.status_code, 400)
+        self.assertTrue(json.loads(output.data)['error'].startswith(
+            'Unknown fields: votes'))
+        output = self.app.get('/api/v1/elections?per_page=1000')
+        self.assertEqual(output.status_code, 400)
+        output = self.app.get('/api/v1/elections?page=a')
+        self.assertEqual(output.status_code, 400)
+
+        # ETag
+        output = self.app.get('/api/v1/elections')
+        etag = output.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        output = self.app.get(
+            '/api/v1/elections', headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 304)
+        self.assertEqual(output.data, '')
+        output = self.app.get(
+            '/api/v1/elections?page=2', headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 200)
+
+    def test_api_candidates(self):
+        """ Test the api_candidates function. """
+        output = self.app.get('/api/v1/elections/1/candidates')
+        self.assertEqual(output.status_code, 404)
+        self.assertEqual(
+            json.loads(output.data), {'error': 'No election found'})
+
+        create_elections(self.session)
+        create_candidates(self.session)
+
+        output = self.app.get('/api/v1/elections/1/candidates')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(json.loads(output.data)['candidates'], [])
+        etag = output.headers['ETag']
+
+        approve_candidate(self.session)
+
+        output = self.app.get(
+            '/api/v1/elections/1/candidates', headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['candidates'][0]['id'], 1)
+        self.assertEqual(data['candidates'][0]['name'], 'Image ok')
+        self.assertEqual(
+            data['candidates'][0]['url'],
+            'http://localhost/pictures/F19/ok.JPG')
+
+        output = self.app.get(
+            '/api/v1/elections/1/candidates',
+            headers={'If-None-Match': output.headers['ETag']})
+        self.assertEqual(output.status_code, 304)
+
+        # The candidates of an election in submission are not listed
+        output = self.app.get('/api/v1/elections/3/candidates')
+        self.assertEqual(output.status_code, 403)
+        self.assertEqual(
+            json.loads(output.data), {'error': 'This election is not open'})
+
+    def test_api_results(self):
+        """ Test the api_results function. """
+        create_elections(self.session)
+        create_candidates(self.session)
+        approve_candidate(self.session)
+
+        output = self.app.get('/api/v1/elections/2/results')
+        self.assertEqual(output.status_code, 403)
+
+        output = self.app.get('/api/v1/elections/1/results?fields=id,votes')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(
+            json.loads(output.data)['results'],
+            [{'id': 1, 'votes': 0}, {'id': 2, 'votes': 0}])
+        etag = output.headers['ETag']
+
+        create_votes(self.session)
+
+        output = self.app.get(
+            '/api/v1/elections/1/results?fields=id,votes',
+            headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(
+            json.loads(output.data)['results'],
+            [{'id': 1, 'votes': 3}, {'id': 2, 'votes': 2}])
+
+        output = self.app.get(
+            '/api/v1/elections/1/results?fields=id,votes',
+            headers={'If-None-Match': output.headers['ETag']})
+        self.assertEqual(output.status_code, 304)
+
+        output = self.app.get(
+            '/api/v1/elections/1/results?per_page=1&page=2')
+        data = json.loads(output.data)
+        self.assertEqual(data['results'][0]['rank'], 2)
+        self.assertEqual(data['results'][0]['name'], 'Image too narrow')
+
+    def test_candidate_tiles(self):
+        """ Test the candidate_tiles function. """
+        create_elections(self.session)
+        create_candidates(self.session)
+        election = nuancierlib.get_election(self.session, 1)
+        candidates = nuancierlib.get_candidates(self.session, 1)
+
+        with nuancier.app.APP.test_request_context():
+            tiles = nuancier.app.candidate_tiles(
+                'vote_tile', election, candidates)
+            self.assertEqual(2, len(tiles))
+            self.assertTrue(
+                'id="candidate%s"' % candidates[0].id in tiles[0])
+            self.assertTrue(
+                '/cache/F19/%s' % candidates[1].candidate_file in tiles[1])
+
+            # The tiles come from the cache as long as the candidate does
+            # not change
+            candidates[0].candidate_name = 'New name'
+            tiles = nuancier.app.candidate_tiles(
+                'vote_tile', election, candidates)
+            self.assertFalse('New name' in tiles[0])
+
+            candidates[0].date_updated = candidates[0].date_updated \
+                + timedelta(seconds=1)
+            tiles = nuancier.app.candidate_tiles(
+                'vote_tile', election, candidates)
+            self.assertTrue("title='New name'" in tiles[0])
+
+            self.assertEqual([], nuancier.app.candidate_tiles(
+                'results_tile', election, []))
+
+            # The size and placeholder of the picture, filled in later by
+            # the worker, are part of the key
+            self.assertFalse('width=' in tiles[1])
+            tiles = nuancier.app.candidate_tiles(
+                'election_tile', election, candidates)
+            candidates[1].picture_width = 1600
+            candidates[1].picture_height = 1200
+            tiles = nuancier.app.candidate_tiles(
+                'election_tile', election, candidates)
+            self.assertTrue(' width="256" height="192"' in tiles[1])
+            self.assertTrue(' loading="lazy"' in tiles[1])
+            self.assertFalse('background: url(' in tiles[1])
+
+            candidates[1].candidate_placeholder = 'data:image/png;base64,AA'
+            tiles = nuancier.app.candidate_tiles(
+                'election_tile', election, candidates)
+            self.assertTrue(
+                ' style="background: url(data:image/png;base64,AA) center / '
+                'cover no-repeat"' in tiles[1])
+
+    def test_precompile_templates(self):
+        """ Test compiling the templates into the bytecode cache. """
+        folder = os.path.join(CACHE_FOLDER, 'templates')
+        app = nuancier.app.APP
+        self.assertEqual(None, app.jinja_env.bytecode_cache)
+        nuancier.templating.configure_bytecode_cache(app, folder)
+        try:
+            cnt = nuancier.templating.precompile(app)
+            self.assertEqual(
+                len(app.jinja_env.list_templates(extensions=['html'])), cnt)
+            self.assertTrue(cnt > 10)
+            files = os.listdir(folder)
+            self.assertEqual(cnt, len(files))
+            self.assertFalse([name for name in files
+                              if not name.startswith('__jinja2_')])
+
+            # The templates are loaded from the cache
+            self.assertEqual(cnt, nuancier.templating.precompile(app))
+            self.assertEqual(files, os.listdir(folder))
+
+            output = self.app.get('/')
+            self.assertEqual(output.status_code, 200)
+        finally:
+            app.jinja_env.bytecode_cache = None
+
+    def test_publish(self):
+        """ Test publishing the closed elections as a static site. """
+        create_elections(self.session)
+        create_candidates(self.session)
+        approve_candidate(self.session)
+        create_votes(self.session)
+        os.makedirs(os.path.join(CACHE_FOLDER, 'F19'))
+        with open(os.path.join(CACHE_FOLDER, 'F19', 'ok.JPG'), 'w') as stream:
+            stream.write('thumbnail')
+        os.makedirs(os.path.join(CACHE_FOLDER, 'F19', 'display'))
+        with open(os.path.join(
+                CACHE_FOLDER, 'F19', 'display', 'ok.JPG.jpg'), 'w') as stream:
+            stream.write('display')
+        os.makedirs(os.path.join(PICTURE_FOLDER, 'F19'))
+        self.addCleanup(shutil.rmtree, os.path.join(PICTURE_FOLDER, 'F19'))
+        with open(os.path.join(
+                PICTURE_FOLDER, 'F19', 'narrow.JPG'), 'w') as stream:
+            stream.write('picture')
+
+        output_dir = tempfile.mkdtemp()
+        try:
+            published, removed = nuancier.publish.publish(
+                self.session, output_dir)
+            self.assertEqual(([1], []), (published, removed))
+            for page in ['election/1', 'results/1', 'stats/1', 'results']:
+                self.assertTrue(os.path.exists(
+                    os.path.join(output_dir, page, 'index.html')))
+            with open(os.path.join(
+                    output_dir, 'results', '1', 'index.html')) as stream:
+                self.assertTrue('Election results: Wallpaper F19 - 2013'
+                                in stream.read())
+            self.assertTrue(os.path.exists(
+                os.path.join(output_dir, 'cache', 'F19', 'ok.JPG')))
+            self.assertTrue(os.path.exists(
+                os.path.join(output_dir, 'display', 'F19', 'ok.JPG.jpg')))
+            self.assertTrue(os.path.exists(
+                os.path.join(output_dir, 'static', 'nuancier.css')))
+            self.assertTrue(os.path.exists(
+                os.path.join(output_dir, 'static', 'lightbox')))
+
+            # The lightbox falls back to the pictures without display version
+            with open(os.path.join(
+                    output_dir, 'election', '1', 'index.html')) as stream:
+                page = stream.read()
+            self.assertTrue('href="/display/F19/ok.JPG.jpg"' in page)
+            self.assertFalse('href="/display/F19/narrow.JPG.jpg"' in page)
+            self.assertTrue('href="/pictures/F19/narrow.JPG"' in page)
+            self.assertTrue(os.path.exists(
+                os.path.join(output_dir, 'pictures', 'F19', 'narrow.JPG')))
+
+            # Nothing changed
+            self.assertEqual(
+                ([], []), nuancier.publish.publish(self.session, output_dir))
+            self.assertEqual(
+                ([1], []), nuancier.publish.publish(
+                    self.session, output_dir, force=True))
+
+            # The results are no longer public
+            election = nuancierlib.get_election(self.session, 1)
+            election.election_date_end = TODAY + timedelta(days=1)
+            self.session.add(election)
+            self.session.commit()
+            self.assertEqual(
+                ([], [1]), nuancier.publish.publish(self.session, output_dir))
+            self.assertFalse(
+                os.path.exists(os.path.join(output_dir, 'results', '1')))
+            self.assertFalse(
+                os.path.exists(os.path.join(output_dir, 'cache', 'F19')))
+            self.assertFalse(
+                os.path.exists(os.path.join(output_dir, 'display', 'F19')))
+        finally:
+            shutil.rmtree(output_dir)
+
     def test_contributions(self):
         """ Test the contributions function. """
         output = self.app.get('/contributions')
@@ -1557,7 +2260,7 @@ class Nuanciertests(Modeltests):
         create_candidates(self.session)
         deny_candidate(self.session)
 
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/contributions/')
             self.assertEqual(output.status_code, 200)
 
@@ -1579,7 +2282,7 @@ class Nuanciertests(Modeltests):
         deny_candidate(self.session)
 
         user = FakeFasUser()
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/contribution/60/update')
             self.assertEqual(output.status_code, 200)
             self.assertTrue(
@@ -1609,7 +2312,7 @@ class Nuanciertests(Modeltests):
 
         upload_path = os.path.join(PICTURE_FOLDER, 'F21')
 
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/contributions/')
             self.assertEqual(output.status_code, 200)
 
@@ -1618,7 +2321,7 @@ class Nuanciertests(Modeltests):
             self.assertTrue(
                 '<a href="/contribution/7/update">' in output.data)
 
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/contribution/6/update')
             self.assertEqual(output.status_code, 200)
             self.assertTrue('<h1>Update your candidate</h1>'
@@ -1768,7 +2471,7 @@ class Nuanciertests(Modeltests):
 
         user = FakeFasUser()
         user.cla_done = True
-        with user_set(nuancier.APP, user):
+        with user_set(nuancier.app.APP, user):
             output = self.app.get('/contribute/3', follow_redirects=True)
             self.assertEqual(output.status_code, 200)
             self.assertTrue('<h1>Elections</h1>' in output.data)
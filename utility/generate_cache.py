@@ -1,18 +1,27 @@
 # -*- coding: utf-8 -*-
 
-__requires__ = ['SQLAlchemy >= 0.7', 'jinja2 >= 2.4']
-import pkg_resources
+import nuancier.bootstrap
+nuancier.bootstrap.select_versions()
+
 import os
 
 os.environ['NUANCIER_CONFIG'] = '/etc/nuancier/nuancier.cfg'
 
-from nuancier import APP, SESSION, lib
+from nuancier import lib
+from nuancier.config import load_config
+
+CONFIG = load_config()
+SESSION = lib.create_session(CONFIG['DB_URL'])
 
 election = lib.get_election(SESSION, 1)
 lib.generate_cache(
     SESSION,
     election,
-    APP.config['PICTURE_FOLDER'],
-    APP.config['CACHE_FOLDER'],
-    APP.config['THUMB_SIZE'],
+    CONFIG['PICTURE_FOLDER'],
+    CONFIG['CACHE_FOLDER'],
+    CONFIG['THUMB_SIZE'],
+    CONFIG.get('DISPLAY_SIZE'),
+    CONFIG.get('NUANCIER_THUMBNAIL_PACKS', False),
 )
+# Keep the placeholders computed while generating the thumbnails
+SESSION.commit()